@@ -0,0 +1,175 @@
+import json
+import os
+import struct
+import sys
+import threading
+
+# Packed metadata layout:
+#   MAGIC | u32 little-endian index length | index JSON (utf-8) | payload blobs
+# The index holds plain metadata values under "values" and, under "args",
+# [offset, length] pairs into the payload area. Identical arg contents share
+# one blob.
+MAGIC = b"HTMAPACK"
+HEADER = struct.Struct("<8sI")
+
+# argv[1] values for the packed transports; anything else is a metadata TMP path
+STDIN_ARG = "-"
+SHM_PREFIX = "shm:"
+
+# Name of the plugin a script runs for: an environment variable for plugin
+# processes, and per thread for plugins called in-process, which share one
+RUNNING_PLUGIN_ENV = "HTMA_PLUGIN"
+RUNNING = threading.local()
+
+
+def pack_metadata(values, args):
+    """Pack metadata values and arg contents (key -> str) into one buffer"""
+    blobs = []
+    offsets = {}
+    index_args = {}
+    size = 0
+    for key, content in args.items():
+        data = content.encode("utf-8")
+        offset = offsets.get(data)
+        if offset is None:
+            offset = offsets[data] = size
+            blobs.append(data)
+            size += len(data)
+        index_args[key] = [offset, len(data)]
+
+    index = json.dumps({"values": values, "args": index_args}).encode("utf-8")
+    return b"".join([HEADER.pack(MAGIC, len(index)), index] + blobs)
+
+
+def is_arg_key(key):
+    """True for plugin:arg:n keys (as opposed to directory and window entries)"""
+    parts = key.split(":")
+    return len(parts) == 3 and parts[0] != "window" and parts[1] != "directory"
+
+
+class PackedMetadata:
+    """Read-only view over a packed metadata buffer.
+
+    Arg contents are decoded only when asked for; view() returns a
+    memoryview into the buffer without copying.
+    """
+
+    def __init__(self, buffer, keepalive=None):
+        self.buffer = memoryview(buffer)
+        self.keepalive = keepalive
+        magic, index_len = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("not a packed HTMA metadata buffer")
+        start = HEADER.size
+        index = json.loads(bytes(self.buffer[start:start + index_len]))
+        self.values = index["values"]
+        self.args = index["args"]
+        self.base = start + index_len
+
+    def keys(self):
+        return list(self.values) + list(self.args)
+
+    def __contains__(self, key):
+        return key in self.values or key in self.args
+
+    def __getitem__(self, key):
+        if key in self.args:
+            return self.text(key)
+        return self.values[key]
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def view(self, key):
+        """Zero-copy memoryview of an arg's utf-8 bytes"""
+        offset, length = self.args[key]
+        return self.buffer[self.base + offset:self.base + offset + length]
+
+    def text(self, key):
+        """An arg's content as str"""
+        return str(self.view(key), "utf-8")
+
+    def close(self):
+        self.buffer.release()
+        if self.keepalive is not None:
+            self.keepalive.close()
+            self.keepalive = None
+
+
+class FileMetadata:
+    """The same interface over the classic metadata TMP file of pointers"""
+
+    def __init__(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            self.raw = json.load(f)
+        self.values = {k: v for k, v in self.raw.items() if not is_arg_key(k)}
+        self.args = {k: v for k, v in self.raw.items() if is_arg_key(k)}
+        self.cache = {}
+
+    def keys(self):
+        return list(self.raw)
+
+    def __contains__(self, key):
+        return key in self.raw
+
+    def __getitem__(self, key):
+        if key in self.args:
+            return self.text(key)
+        return self.values[key]
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def view(self, key):
+        if key not in self.cache:
+            with open(self.args[key], "rb") as f:
+                self.cache[key] = f.read()
+        return memoryview(self.cache[key])
+
+    def text(self, key):
+        return str(self.view(key), "utf-8")
+
+    def close(self):
+        self.cache.clear()
+
+
+def attach_shared_memory(name):
+    """Open an existing shared memory block without taking ownership of it"""
+    from multiprocessing import shared_memory
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the block for unlinking at exit
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name != "nt":
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def current_plugin():
+    """Name of the plugin the calling code runs for, or None outside one"""
+    return getattr(RUNNING, "plugin", None) or os.environ.get(RUNNING_PLUGIN_ENV) or None
+
+
+def load_metadata(argv=None):
+    """Open the metadata a plugin was started with, whatever the transport.
+
+    Plugins call this instead of reading sys.argv[1] themselves:
+        metadata = load_metadata()
+        text = metadata["myplugin:content:1"]
+    """
+    if argv is None:
+        argv = sys.argv
+    target = argv[1]
+    if target == STDIN_ARG:
+        return PackedMetadata(sys.stdin.buffer.read())
+    if target.startswith(SHM_PREFIX):
+        shm = attach_shared_memory(target[len(SHM_PREFIX):])
+        return PackedMetadata(shm.buf, keepalive=shm)
+    with open(target, "rb") as f:
+        packed = f.read(len(MAGIC)) == MAGIC
+    if packed:
+        with open(target, "rb") as f:
+            return PackedMetadata(f.read())
+    return FileMetadata(target)
@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# References that point outside the page directory and are never inlined
+REMOTE_PREFIXES = ("http://", "https://", "//", "data:", "file:", "blob:")
+
+# Asset texts kept in memory across documents, in megabytes
+ASSET_CACHE_MB = 64
+
+
+def is_remote(ref):
+    return ref.lower().startswith(REMOTE_PREFIXES)
+
+
+class Asset:
+    """One CSS/JS file read for inlining"""
+
+    __slots__ = ("path", "text", "error", "size", "seconds", "cached", "served")
+
+    def __init__(self, path):
+        self.path = path
+        self.text = None
+        self.error = None
+        self.size = 0
+        self.seconds = 0.0
+        self.cached = False
+        # Too big to inline; the window fetches it from the asset handler
+        self.served = False
+
+
+class AssetCache:
+    """Texts of asset files shared by every document compiled in this process.
+
+    Entries are revalidated against the file's mtime and size on every
+    read, so an edited stylesheet is picked up by the next compile. The
+    least recently used entries are dropped once the cache holds more than
+    max_bytes of text.
+    """
+
+    def __init__(self, max_bytes=ASSET_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = {}
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def read(self, path, inline_max_bytes=None):
+        """Asset for path; files larger than inline_max_bytes are not read"""
+        asset = Asset(path)
+        start = time.perf_counter()
+        try:
+            st = os.stat(path)
+        except OSError:
+            # Missing: the tag is left as it is, like before
+            return asset
+        if inline_max_bytes is not None and st.st_size > inline_max_bytes and os.path.isfile(path):
+            asset.served = True
+            asset.size = st.st_size
+            return asset
+        signature = (st.st_mtime_ns, st.st_size)
+        key = str(path)
+
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                if entry[0] == signature:
+                    # Re-insert so dict order stays least recently used first
+                    self.entries[key] = entry
+                    asset.text = entry[1]
+                    asset.cached = True
+                else:
+                    self.total -= len(entry[1])
+
+        if asset.text is None:
+            try:
+                # Text mode, like the open() in inject_resources
+                with open(path, 'r', encoding='utf-8') as f:
+                    asset.text = f.read()
+            except Exception as e:
+                asset.error = e
+            else:
+                self.store(key, signature, asset.text)
+
+        asset.size = len(asset.text) if asset.text is not None else 0
+        asset.seconds = time.perf_counter() - start
+        return asset
+
+    def store(self, key, signature, text):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total -= len(old[1])
+            if len(text) > self.max_bytes:
+                return
+            self.entries[key] = (signature, text)
+            self.total += len(text)
+            while self.total > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self.total -= len(self.entries.pop(oldest)[1])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total = 0
+
+
+ASSET_CACHE = AssetCache()
+
+# Reader threads shared by every loader, started on first use
+POOL = None
+POOL_LOCK = threading.Lock()
+POOL_WORKERS = 8
+
+
+def reader_pool():
+    global POOL
+    with POOL_LOCK:
+        if POOL is None:
+            POOL = ThreadPoolExecutor(max_workers=POOL_WORKERS, thread_name_prefix="htma-asset")
+        return POOL
+
+
+class AssetLoader:
+    """Reads the unique set of assets a document refers to, in parallel.
+
+    With inline_max_bytes set, larger files are only stat()ed and marked
+    as served instead of read.
+    """
+
+    def __init__(self, cache=None, parallel=True, inline_max_bytes=None):
+        self.cache = cache if cache is not None else ASSET_CACHE
+        self.parallel = parallel
+        self.inline_max_bytes = inline_max_bytes
+        self.assets = {}
+        self.seconds = 0.0
+
+    def read(self, path):
+        return self.cache.read(path, self.inline_max_bytes)
+
+    def load(self, paths):
+        """Read every path once; return {path: Asset}"""
+        start = time.perf_counter()
+        unique = [path for path in dict.fromkeys(paths) if path not in self.assets]
+        if len(unique) > 1 and self.parallel:
+            for asset in reader_pool().map(self.read, unique):
+                self.assets[asset.path] = asset
+        else:
+            for path in unique:
+                self.assets[path] = self.read(path)
+        self.seconds += time.perf_counter() - start
+        return self.assets
+
+    def get(self, path):
+        """A loaded asset, reading it now if load() did not see it"""
+        asset = self.assets.get(path)
+        if asset is None:
+            asset = self.assets[path] = self.read(path)
+        return asset
+
+    def report(self):
+        """Print size and read time of every asset"""
+        found = [asset for asset in self.assets.values() if asset.text is not None or asset.served]
+        if not found:
+            return
+        total = sum(asset.size for asset in found)
+        print(f"Assets: {len(found)} files, {total / 1024:.1f} KB in {self.seconds * 1000:.1f} ms")
+        for asset in found:
+            source = "served" if asset.served else "cached" if asset.cached else "read"
+            print(f"  {asset.path.name}: {asset.size / 1024:.1f} KB, {asset.seconds * 1000:.2f} ms ({source})")
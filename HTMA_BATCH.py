@@ -0,0 +1,204 @@
+import contextlib
+import glob
+import io
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from HTMA_SETTINGS import load_settings
+
+
+def find_pages(inputs):
+    """Expand files, directories (searched recursively) and globs into .htma files
+
+    Returns (path, relative output name) pairs, each page once.
+    """
+    pages = {}
+    cwd = Path.cwd()
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            found = sorted(path.rglob("*.htma"))
+        elif glob.has_magic(item):
+            found = [Path(m) for m in sorted(glob.glob(item, recursive=True))]
+        else:
+            found = [path]
+        if not found:
+            print(f"Warning: No .htma files in {item}")
+        for page in found:
+            if not page.is_file():
+                print(f"Warning: Not a file: {page}")
+                continue
+            page = page.resolve()
+            # Keep the folder layout below the current directory in the output
+            try:
+                relative = page.relative_to(cwd)
+            except ValueError:
+                relative = page.relative_to(path.resolve()) if path.is_dir() else Path(page.name)
+            pages.setdefault(page, relative)
+    return list(pages.items())
+
+
+def output_path(page, relative, out_dir):
+    """Where the compiled HTML of page goes: next to it, or mirrored under out_dir"""
+    if out_dir is None:
+        return page.with_suffix(".html")
+    return Path(out_dir).resolve() / relative.with_suffix(".html")
+
+
+def compile_file(page, out_file, run_plugins, settings):
+    """Parse one page, optionally run its plugins, and write the compiled HTML
+
+    Runs in a pool process. Everything the page prints is collected into
+    the returned result instead of being mixed with other pages' output.
+    """
+    from HTMA_PARSE import HTMAParser
+    from UI import compile_page, read_document
+
+    result = {"file": str(page), "output": str(out_file), "bytes": 0, "plugins": 0, "parse_ms": 0.0,
+              "plugins_ms": 0.0, "compile_ms": 0.0, "total_ms": 0.0, "error": None, "log": ""}
+    log = io.StringIO()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(log):
+        try:
+            content = read_document(page)
+            result["bytes"] = len(content)
+
+            start = time.perf_counter()
+            parser = HTMAParser(page, settings)
+            plugin_list = parser.parse_plugin_calls(content)
+            result["plugins"] = len(plugin_list)
+            result["parse_ms"] = (time.perf_counter() - start) * 1000
+
+            if run_plugins and plugin_list:
+                start = time.perf_counter()
+                parser.metadata["window:file"] = str(parser.htma_file)
+                parser.prepare_transports(plugin_list)
+                parser.execute_plugins(plugin_list)
+                parser.wait_for_plugins()
+                parser.scheduler.report()
+                parser.close_transports()
+                if parser.session:
+                    parser.session.release()
+                failed = [job.name for job in parser.scheduler.jobs.values() if job.failed]
+                result["plugins_ms"] = (time.perf_counter() - start) * 1000
+                if failed:
+                    result["error"] = f"plugins failed: {', '.join(failed)}"
+
+            # There is no window to serve large files from, so every linked
+            # CSS/JS file is inlined whatever asset_mode says
+            start = time.perf_counter()
+            html_content = compile_page(content, page.parent, dedupe=settings.get("dedupe_assets", False),
+                                        minify=settings.get("minify_html", False))
+            out_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(out_file, "w", encoding="utf-8") as f:
+                f.write(html_content)
+            result["compile_ms"] = (time.perf_counter() - start) * 1000
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+            traceback.print_exc(file=log)
+    result["total_ms"] = (time.perf_counter() - started) * 1000
+    result["log"] = log.getvalue()
+    return result
+
+
+def run_batch(pages, out_dir=None, run_plugins=False, max_workers=None, settings=None, verbose=False):
+    """Compile every (page, relative name) pair on a process pool; return the results
+
+    Pages are handed out largest first, so a single big page starts early
+    instead of being what the last worker is still busy with at the end.
+    Unless settings set max_workers, each page runs its plugins on its
+    share of the cores.
+    """
+    settings = settings if settings is not None else load_settings()
+    pages = sorted(pages, key=lambda item: item[0].stat().st_size, reverse=True)
+    jobs = []
+    outputs = {}
+    for page, relative in pages:
+        out_file = output_path(page, relative, out_dir)
+        if out_file in outputs:
+            print(f"Warning: Skipping {page}, its output {out_file} is already written for {outputs[out_file]}")
+            continue
+        outputs[out_file] = page
+        jobs.append((page, out_file))
+    max_workers = max(1, min(max_workers or os.cpu_count() or 1, len(jobs) or 1))
+    if settings.get("max_workers") is None:
+        # Each page's scheduler would otherwise run a plugin per core, a
+        # core's worth of pages at a time: split the cores between pages
+        settings = dict(settings, max_workers=max(1, (os.cpu_count() or 1) // max_workers))
+
+    results = []
+
+    def collect(result):
+        results.append(result)
+        status = "FAILED" if result["error"] else "ok"
+        print(f"[{len(results)}/{len(jobs)}] {status} {result['file']} ({result['total_ms']:.0f} ms)")
+        if verbose or result["error"]:
+            print(result["log"], end="")
+
+    if max_workers == 1:
+        for page, out_file in jobs:
+            collect(compile_file(page, out_file, run_plugins, settings))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            # Submitted in size order; the pool starts them in that order
+            futures = [pool.submit(compile_file, page, out_file, run_plugins, settings) for page, out_file in jobs]
+            for future in as_completed(futures):
+                collect(future.result())
+    return results
+
+
+def report(results, seconds):
+    """Print per-file timings, slowest first, and the failures"""
+    print(f"\n{'='*50}")
+    print("Batch results")
+    print(f"{'file':<40} {'KB':>8} {'parse':>8} {'plugins':>8} {'compile':>8} {'total':>8}")
+    for result in sorted(results, key=lambda r: r["total_ms"], reverse=True):
+        name = result["file"]
+        if len(name) > 40:
+            name = "..." + name[-37:]
+        print(f"{name:<40} {result['bytes'] / 1024:>8.1f} {result['parse_ms']:>8.1f} {result['plugins_ms']:>8.1f} "
+              f"{result['compile_ms']:>8.1f} {result['total_ms']:>8.1f}")
+    failed = [result for result in results if result["error"]]
+    busy = sum(result["total_ms"] for result in results) / 1000
+    print(f"\n{len(results) - len(failed)} of {len(results)} pages compiled in {seconds:.2f}s "
+          f"({busy:.2f}s of work)")
+    for result in failed:
+        print(f"  FAILED {result['file']}: {result['error']}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Compile many .htma files to .html without opening windows")
+    arg_parser.add_argument("inputs", nargs="+", help=".htma files, directories or glob patterns")
+    arg_parser.add_argument("-o", "--out", help="write outputs under this directory instead of next to each page")
+    arg_parser.add_argument("-j", "--jobs", type=int, help="pages compiled at once (default: number of cores)")
+    arg_parser.add_argument("--plugins", action="store_true", help="also run each page's plugins")
+    arg_parser.add_argument("--minify", action="store_true", help="strip comments and extra whitespace from the HTML")
+    arg_parser.add_argument("--summary", help="write the results as JSON to this file")
+    arg_parser.add_argument("-v", "--verbose", action="store_true", help="print every page's output")
+    args = arg_parser.parse_args()
+
+    pages = find_pages(args.inputs)
+    if not pages:
+        print("No .htma files found")
+        sys.exit(1)
+
+    settings = load_settings()
+    if args.minify:
+        settings["minify_html"] = True
+
+    started = time.perf_counter()
+    results = run_batch(pages, args.out, args.plugins, args.jobs, settings, args.verbose)
+    seconds = time.perf_counter() - started
+    report(results, seconds)
+
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump({"seconds": seconds, "files": results}, f, indent=2)
+    sys.exit(1 if any(result["error"] for result in results) else 0)
@@ -0,0 +1,432 @@
+import base64
+import collections
+import json
+import secrets
+import socket
+import struct
+import sys
+import threading
+import traceback
+from pathlib import Path
+
+# Every message on a plugin connection is one frame:
+#   u32 little-endian payload length | u8 kind | payload
+# A JSON frame's payload is one UTF-8 JSON object. A binary frame's payload
+# is u32 header length | header JSON | raw bytes, for results and events
+# that carry bytes (the page receives those as a Uint8Array).
+FRAME = struct.Struct("<IB")
+HEADER_LENGTH = struct.Struct("<I")
+JSON_FRAME = 0
+BINARY_FRAME = 1
+
+# Name of the WebView script message handler the page posts to
+PAGE_HANDLER = "htmaBridge"
+
+# Runs in every page of a window with a bridge. htma.call() returns a
+# Promise for a plugin function's result; htma.on() subscribes to events a
+# plugin emits. Calls made in the same turn of the event loop go to the
+# host as one message.
+PAGE_SHIM = """(function () {
+    if (window.htma && window.htma._deliver) { return; }
+    var pending = {}, handlers = {}, queue = [], nextId = 1;
+    function decode(message) {
+        if (message.base64 === undefined) { return message.data; }
+        var raw = atob(message.base64), bytes = new Uint8Array(raw.length);
+        for (var i = 0; i < raw.length; i++) { bytes[i] = raw.charCodeAt(i); }
+        return bytes;
+    }
+    function flush() {
+        var batch = queue;
+        queue = [];
+        window.%(handler)s.postMessage(JSON.stringify(batch));
+    }
+    window.htma = {
+        call: function (plugin, fn) {
+            var args = Array.prototype.slice.call(arguments, 2), id = nextId++;
+            return new Promise(function (resolve, reject) {
+                pending[id] = {resolve: resolve, reject: reject};
+                if (queue.push({id: id, plugin: plugin, fn: fn, args: args}) === 1) {
+                    Promise.resolve().then(flush);
+                }
+            });
+        },
+        on: function (plugin, event, handler) {
+            var key = plugin + ":" + event;
+            (handlers[key] = handlers[key] || []).push(handler);
+        },
+        _deliver: function (messages) {
+            messages.forEach(function (message) {
+                if (message.type === "event") {
+                    (handlers[message.plugin + ":" + message.event] || []).forEach(function (handler) {
+                        handler(decode(message));
+                    });
+                    return;
+                }
+                var call = pending[message.id];
+                if (!call) { return; }
+                delete pending[message.id];
+                if (message.error !== undefined) { call.reject(new Error(message.error)); }
+                else { call.resolve(decode(message)); }
+            });
+        }
+    };
+})();""" % {"handler": PAGE_HANDLER}
+
+# Hands a batch of messages to the page
+DELIVER_JS = "window.htma && window.htma._deliver(%s);"
+
+
+def encode_frame(message, blob=None):
+    """One frame holding a JSON message, with blob as raw bytes if given"""
+    header = json.dumps(message, separators=(",", ":")).encode("utf-8")
+    if blob is None:
+        return FRAME.pack(len(header), JSON_FRAME) + header
+    payload_length = HEADER_LENGTH.size + len(header) + len(blob)
+    return b"".join([FRAME.pack(payload_length, BINARY_FRAME), HEADER_LENGTH.pack(len(header)), header, blob])
+
+
+def read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) < size:
+        raise EOFError
+    return data
+
+
+def read_frame(stream):
+    """Next (message, blob) from a buffered stream; blob is None for JSON frames. None at EOF"""
+    try:
+        length, kind = FRAME.unpack(read_exactly(stream, FRAME.size))
+        payload = read_exactly(stream, length)
+    except (EOFError, OSError):
+        return None
+    if kind == JSON_FRAME:
+        return json.loads(payload), None
+    (header_length,) = HEADER_LENGTH.unpack_from(payload)
+    start = HEADER_LENGTH.size
+    return json.loads(payload[start:start + header_length]), payload[start + header_length:]
+
+
+class Connection:
+    """One socket with a writer thread that sends queued frames in batches.
+
+    send() never blocks on the network: frames are queued and the writer
+    joins everything queued since its last write into a single sendall(),
+    so a burst of small messages costs one system call.
+    """
+
+    def __init__(self, sock):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        self.stream = sock.makefile("rb")
+        self.frames = collections.deque()
+        self.ready = threading.Condition()
+        self.closed = False
+        self.writer = threading.Thread(target=self.write_loop, name="htma-bridge-writer", daemon=True)
+        self.writer.start()
+
+    def send(self, message, blob=None):
+        with self.ready:
+            if self.closed:
+                return False
+            self.frames.append(encode_frame(message, blob))
+            self.ready.notify()
+        return True
+
+    def write_loop(self):
+        while True:
+            with self.ready:
+                while not self.frames and not self.closed:
+                    self.ready.wait()
+                if not self.frames:
+                    return
+                batch = b"".join(self.frames)
+                self.frames.clear()
+            try:
+                self.sock.sendall(batch)
+            except OSError:
+                self.close()
+                return
+
+    def receive(self):
+        return read_frame(self.stream)
+
+    def close(self):
+        """Send what is still queued, then close the socket"""
+        with self.ready:
+            if self.closed:
+                return
+            self.closed = True
+            self.ready.notify()
+        if threading.current_thread() is not self.writer:
+            self.writer.join(1)
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class BridgeServer:
+    """Connects the page in a window with the plugins that opted in.
+
+    Plugins with "bridge": true in plugin.json find the address and token
+    under "bridge:address" and "bridge:token" in their metadata and
+    connect with BridgeClient. Calls from the page (PAGE_SHIM) arrive
+    through the WebView's script message handler and are forwarded to
+    the plugin's connection; calls for a plugin that has not connected yet
+    wait for it. Replies and events go back through RunScript. Everything
+    that arrives before the GUI thread gets to it is delivered in one
+    batch.
+    """
+
+    def __init__(self, plugins, token=None):
+        self.plugins = set(plugins)
+        self.token = token or secrets.token_hex(16)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(len(self.plugins) + 4)
+        self.address = "%s:%d" % self.sock.getsockname()
+        self.lock = threading.Lock()
+        self.connections = {}
+        # Calls for plugins that have not connected yet, and calls a
+        # plugin has not answered (failed if it disconnects)
+        self.waiting = collections.defaultdict(list)
+        self.in_flight = collections.defaultdict(set)
+        self.outbox = []
+        self.flush_scheduled = False
+        # Set by attach(): post(func) runs func on the GUI thread,
+        # run_script(js) runs JavaScript in the page
+        self.post = None
+        self.run_script = None
+        self.closed = False
+
+    def metadata(self):
+        """Entries plugins need to connect"""
+        return {"bridge:address": self.address, "bridge:token": self.token}
+
+    def start(self):
+        threading.Thread(target=self.accept_loop, name="htma-bridge", daemon=True).start()
+        print(f"Plugin bridge listening on {self.address} for: {', '.join(sorted(self.plugins))}")
+
+    def attach(self, post, run_script):
+        """Start delivering to a page; messages that arrived earlier are sent now"""
+        with self.lock:
+            self.post = post
+            self.run_script = run_script
+        self.schedule_flush()
+
+    def accept_loop(self):
+        while not self.closed:
+            try:
+                sock, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve_plugin, args=(sock,), name="htma-bridge-plugin", daemon=True).start()
+
+    def serve_plugin(self, sock):
+        connection = Connection(sock)
+        hello = connection.receive()
+        plugin = hello[0].get("plugin") if hello else None
+        if (not hello or hello[0].get("type") != "hello" or not secrets.compare_digest(
+                str(hello[0].get("token", "")), self.token) or plugin not in self.plugins):
+            print(f"Bridge: Refused a connection for plugin {plugin!r}")
+            connection.close()
+            return
+
+        with self.lock:
+            if self.closed:
+                connection.close()
+                return
+            old = self.connections.get(plugin)
+            self.connections[plugin] = connection
+            waiting = self.waiting.pop(plugin, [])
+            self.in_flight[plugin].update(call["id"] for call in waiting)
+        if old is not None:
+            old.close()
+        for call in waiting:
+            connection.send(call)
+
+        while True:
+            frame = connection.receive()
+            if frame is None:
+                break
+            message, blob = frame
+            self.from_plugin(plugin, message, blob)
+
+        with self.lock:
+            if self.connections.get(plugin) is connection:
+                del self.connections[plugin]
+                lost = self.in_flight.pop(plugin, set())
+            else:
+                lost = set()
+        for call_id in lost:
+            self.to_page({"type": "reply", "plugin": plugin, "id": call_id, "error": f"plugin '{plugin}' disconnected"})
+        connection.close()
+
+    def from_page(self, text):
+        """A batch of calls posted by PAGE_SHIM (GUI thread)"""
+        try:
+            calls = json.loads(text)
+        except ValueError:
+            print("Bridge: Ignored a malformed message from the page")
+            return
+        for call in calls if isinstance(calls, list) else [calls]:
+            plugin = call.get("plugin")
+            message = {"type": "call", "id": call.get("id"), "fn": call.get("fn"), "args": call.get("args", [])}
+            if plugin not in self.plugins:
+                self.to_page({"type": "reply", "plugin": plugin, "id": message["id"],
+                              "error": f"plugin '{plugin}' has no bridge on this page"})
+                continue
+            with self.lock:
+                connection = self.connections.get(plugin)
+                if connection is None:
+                    self.waiting[plugin].append(message)
+                    continue
+                self.in_flight[plugin].add(message["id"])
+            connection.send(message)
+
+    def from_plugin(self, plugin, message, blob):
+        kind = message.get("type")
+        if kind not in ("reply", "event"):
+            return
+        out = dict(message, plugin=plugin)
+        if blob is not None:
+            out["base64"] = base64.b64encode(blob).decode("ascii")
+        if kind == "reply":
+            with self.lock:
+                self.in_flight[plugin].discard(message.get("id"))
+        self.to_page(out)
+
+    def to_page(self, message):
+        with self.lock:
+            self.outbox.append(message)
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        with self.lock:
+            if self.post is None or self.flush_scheduled or not self.outbox:
+                return
+            self.flush_scheduled = True
+            post = self.post
+        post(self.flush)
+
+    def flush(self):
+        """Deliver everything queued for the page in one RunScript (GUI thread)"""
+        with self.lock:
+            batch, self.outbox = self.outbox, []
+            self.flush_scheduled = False
+            run_script = self.run_script
+        if batch and run_script is not None and not self.closed:
+            run_script(DELIVER_JS % json.dumps(batch, separators=(",", ":")))
+
+    def close(self):
+        """Stop accepting and disconnect every plugin; their serve() loops return"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            # shutdown() wakes the accept() blocked in accept_loop, close() alone does not
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        with self.lock:
+            connections = list(self.connections.values())
+            self.connections.clear()
+        for connection in connections:
+            connection.close()
+
+
+class BridgeClient:
+    """A plugin's end of the bridge.
+
+        from HTMA_ARGS import load_metadata
+        from HTMA_BRIDGE import BridgeClient
+
+        bridge = BridgeClient.connect(load_metadata())
+
+        @bridge.function
+        def add(a, b):
+            return a + b
+
+        bridge.emit("ready", {"version": 1})
+        bridge.serve()  # answers calls until the window closes
+
+    In the page: await htma.call("myplugin", "add", 1, 2) and
+    htma.on("myplugin", "ready", data => ...). Functions returning bytes
+    (and emit() with bytes) send them as a binary frame.
+    """
+
+    def __init__(self, address, token, plugin):
+        host, port = address.rsplit(":", 1)
+        self.plugin = plugin
+        self.functions = {}
+        self.connection = Connection(socket.create_connection((host, int(port))))
+        self.connection.send({"type": "hello", "plugin": plugin, "token": token})
+
+    @classmethod
+    def connect(cls, metadata, plugin=None):
+        """Connect with the bridge entries of a plugin's metadata.
+
+        plugin defaults to the plugin the scheduler runs this code for,
+        however it runs it (see HTMA_ARGS.current_plugin), and otherwise
+        to the name of the plugin folder of a script started by hand
+        (plugins/_name_/script.py).
+        """
+        if plugin is None:
+            from HTMA_ARGS import current_plugin
+            plugin = current_plugin()
+        if plugin is None:
+            folder = Path(sys.argv[0]).resolve().parent.name
+            plugin = folder[1:-1] if len(folder) > 2 and folder.startswith("_") and folder.endswith("_") else folder
+        if "bridge:address" not in metadata:
+            raise RuntimeError('No bridge: the page opens no window or plugin.json lacks "bridge": true')
+        return cls(metadata["bridge:address"], metadata["bridge:token"], plugin)
+
+    def function(self, func=None, name=None):
+        """Register func as callable from the page, as @bridge.function or @bridge.function(name="x")"""
+        if func is None:
+            return lambda f: self.function(f, name)
+        self.functions[name or func.__name__] = func
+        return func
+
+    def emit(self, event, data=None):
+        """Send an event to the page's htma.on() handlers; safe from any thread"""
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return self.connection.send({"type": "event", "event": event}, bytes(data))
+        return self.connection.send({"type": "event", "event": event, "data": data})
+
+    def handle(self, message):
+        func = self.functions.get(message.get("fn"))
+        reply = {"type": "reply", "id": message.get("id")}
+        if func is None:
+            reply["error"] = f"unknown function '{message.get('fn')}'"
+            self.connection.send(reply)
+            return
+        try:
+            result = func(*message.get("args", []))
+        except Exception as e:
+            traceback.print_exc()
+            reply["error"] = f"{type(e).__name__}: {e}"
+            self.connection.send(reply)
+            return
+        if isinstance(result, (bytes, bytearray, memoryview)):
+            self.connection.send(reply, bytes(result))
+        else:
+            reply["data"] = result
+            self.connection.send(reply)
+
+    def serve(self):
+        """Answer calls from the page until the host closes the bridge"""
+        while True:
+            frame = self.connection.receive()
+            if frame is None:
+                break
+            message, _ = frame
+            if message.get("type") == "call":
+                self.handle(message)
+        self.connection.close()
+
+    def close(self):
+        self.connection.close()
+
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+# Bump when the compiled output for the same inputs changes
+PAGE_FORMAT = 1
+
+
+def file_signature(path):
+    """(mtime_ns, size) of a dependency, or None if it does not exist"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+class PageCache:
+    """Content-addressed cache of compiled pages with LRU eviction.
+
+    A page is looked up by the hash of its source, base directory and
+    compile options. That finds a manifest listing every asset the compile
+    read (or looked for and did not find). The stored HTML itself is keyed
+    by the source hash plus the current mtime and size of each of those
+    assets, so editing any of them makes the old entry unreachable. Entries
+    are evicted least-recently-used first once the cache exceeds max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=64 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+
+    def source_key(self, content, base_path, options=None):
+        digest = hashlib.sha256()
+        digest.update(f"{PAGE_FORMAT}\0{Path(base_path).resolve()}\0".encode("utf-8"))
+        digest.update(json.dumps(options or {}, sort_keys=True).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(content.encode("utf-8"))
+        return digest.hexdigest()
+
+    @staticmethod
+    def page_key(source_key, deps):
+        digest = hashlib.sha256(source_key.encode("ascii"))
+        for dep in deps:
+            digest.update(json.dumps([str(dep), file_signature(dep)]).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, content, base_path, options=None):
+        """Return the cached HTML for this source, or None on a miss"""
+        source_key = self.source_key(content, base_path, options)
+        manifest_file = self.cache_dir / f"{source_key}.json"
+        try:
+            with open(manifest_file, "r", encoding="utf-8") as f:
+                deps = json.load(f)["deps"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+        page_file = self.cache_dir / f"{self.page_key(source_key, deps)}.html"
+        try:
+            with open(page_file, "r", encoding="utf-8", newline="") as f:
+                html = f.read()
+        except OSError:
+            return None
+
+        # Mark both files as recently used for LRU eviction
+        for path in (manifest_file, page_file):
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return html
+
+    def put(self, content, base_path, deps, html, options=None):
+        """Store a compiled page along with the assets it depends on"""
+        source_key = self.source_key(content, base_path, options)
+        deps = [str(dep) for dep in deps]
+        page_key = self.page_key(source_key, deps)
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self.write_atomic(self.cache_dir / f"{page_key}.html", html)
+            self.write_atomic(self.cache_dir / f"{source_key}.json", json.dumps({"deps": deps, "page": page_key}))
+        except OSError as e:
+            print(f"Warning: Could not write page cache: {e}")
+            return
+        self.evict()
+
+    @staticmethod
+    def write_atomic(path, text):
+        tmp_file = path.with_name(f"{path.name}.{os.getpid()}")
+        with open(tmp_file, "w", encoding="utf-8", newline="") as f:
+            f.write(text)
+        os.replace(tmp_file, path)
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits max_bytes"""
+        try:
+            entries = [(e.stat().st_mtime, e.stat().st_size, e.path) for e in os.scandir(self.cache_dir) if e.is_file()]
+        except OSError:
+            return
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        """Remove every cached page"""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
@@ -0,0 +1,408 @@
+import contextlib
+import hashlib
+import io
+import json
+import os
+import queue
+import runpy
+import secrets
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+
+from HTMA_PROC import pid_alive, process_rss
+from HTMA_SETTINGS import load_settings
+
+SCRIPT_DIR = Path(__file__).parent.resolve()
+
+# Written by the daemon once it is listening: address, authkey and pid
+STATE_FILE = SCRIPT_DIR / ".cache" / "daemon.json"
+LOG_FILE = SCRIPT_DIR / ".cache" / "daemon.log"
+
+# How long a new client waits for a freshly started daemon to come up
+STARTUP_TIMEOUT = 10.0
+# Seconds a job without its own timeout may run on a worker before the
+# worker is replaced, and how much longer a client waits for the reply
+JOB_TIMEOUT = 600.0
+REPLY_MARGIN = 5.0
+
+
+def daemon_address():
+    """Local socket (POSIX) or named pipe (Windows) unique to this install"""
+    tag = hashlib.sha1(str(SCRIPT_DIR).encode("utf-8")).hexdigest()[:12]
+    if os.name == "nt":
+        return rf"\\.\pipe\htma-plus-{tag}"
+    import tempfile
+    return os.path.join(tempfile.gettempdir(), f"htma-plus-{tag}.sock")
+
+
+def read_state():
+    try:
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# ---------------------------------------------------------------- worker side
+
+def local_module(module):
+    """Whether a module came from outside the Python installation (a plugin's own file)"""
+    path = getattr(module, "__file__", None)
+    if not path:
+        return False
+    path = os.path.abspath(path)
+    return not any(path.startswith(os.path.abspath(prefix) + os.sep)
+                   for prefix in {sys.prefix, sys.base_prefix, sys.exec_prefix})
+
+
+def run_worker_job(job):
+    """Run one plugin script inside this warm Python worker
+
+    The script sees what python script.py would give it: its folder first
+    on sys.path and the given argv and cwd. Modules it imported from its
+    own folder (or anywhere outside the Python installation) are dropped
+    afterwards, so the next job imports its own versions; the standard
+    library and installed packages stay loaded.
+    """
+    from HTMA_ARGS import RUNNING_PLUGIN_ENV, load_metadata
+    from HTMA_INPROCESS import load_plugin_module
+
+    out, err = io.StringIO(), io.StringIO()
+    returncode = 0
+    saved_argv, saved_stdin, saved_cwd = sys.argv, sys.stdin, os.getcwd()
+    saved_path = list(sys.path)
+    saved_modules = set(sys.modules)
+    saved_plugin = os.environ.get(RUNNING_PLUGIN_ENV)
+    script = Path(job["script"])
+    try:
+        os.chdir(job["cwd"])
+        os.environ[RUNNING_PLUGIN_ENV] = job["plugin"]
+        sys.path.insert(0, str(script.parent))
+        # Plugins must never read the job channel
+        sys.stdin = io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            try:
+                entry = None
+                if job.get("mode") == "inprocess":
+                    module = load_plugin_module(job["plugin"], script)
+                    entry = getattr(module, job.get("entry") or "run", None)
+                if callable(entry):
+                    metadata = job.get("metadata")
+                    if metadata is None:
+                        metadata = load_metadata([str(script)] + job["argv"])
+                    entry(metadata)
+                else:
+                    sys.argv = [str(script)] + job["argv"]
+                    runpy.run_path(str(script), run_name="__main__")
+            except SystemExit as e:
+                if e.code is None or isinstance(e.code, int):
+                    returncode = e.code or 0
+                else:
+                    print(e.code, file=sys.stderr)
+                    returncode = 1
+            except BaseException:
+                traceback.print_exc()
+                returncode = 1
+    finally:
+        sys.argv, sys.stdin = saved_argv, saved_stdin
+        sys.path[:] = saved_path
+        os.chdir(saved_cwd)
+        if saved_plugin is None:
+            os.environ.pop(RUNNING_PLUGIN_ENV, None)
+        else:
+            os.environ[RUNNING_PLUGIN_ENV] = saved_plugin
+        for name in set(sys.modules) - saved_modules:
+            if local_module(sys.modules[name]):
+                del sys.modules[name]
+    return {"id": job["id"], "returncode": returncode, "stdout": out.getvalue(), "stderr": err.getvalue()}
+
+
+def worker_main():
+    """Loop of a pre-started Python worker: one JSON job per line on stdin"""
+    channel = os.fdopen(os.dup(1), "w", encoding="utf-8")
+    # Anything a plugin writes straight to fd 1 lands in the daemon log instead
+    os.dup2(2, 1)
+    sys.path.insert(0, str(SCRIPT_DIR))
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        reply = run_worker_job(json.loads(line))
+        channel.write(json.dumps(reply) + "\n")
+        channel.flush()
+
+
+# ---------------------------------------------------------------- daemon side
+
+class Worker:
+    """A pre-started python or node process fed jobs over its stdin"""
+
+    def __init__(self, runtime):
+        self.runtime = runtime
+        if runtime == "python":
+            cmd = [sys.executable, str(SCRIPT_DIR / "HTMA_DAEMON.py"), "worker"]
+        else:
+            cmd = ["node", str(SCRIPT_DIR / "HTMA_WORKER.js")]
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     text=True, encoding="utf-8", bufsize=1)
+        self.replies = queue.Queue()
+        threading.Thread(target=self.read_replies, daemon=True).start()
+
+    def read_replies(self):
+        for line in self.proc.stdout:
+            if line.strip():
+                self.replies.put(json.loads(line))
+        self.replies.put(None)
+
+    def run(self, job, timeout):
+        """Send a job and wait for its reply; None on timeout or crash"""
+        try:
+            self.proc.stdin.write(json.dumps(job) + "\n")
+            self.proc.stdin.flush()
+            return self.replies.get(timeout=timeout)
+        except (OSError, queue.Empty):
+            return None
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def kill(self):
+        if self.alive():
+            self.proc.kill()
+        self.proc.wait()
+
+
+class WorkerPool:
+    """Fixed number of warm workers for one runtime, recycled when they misbehave"""
+
+    def __init__(self, runtime, size, max_rss):
+        self.runtime = runtime
+        self.max_rss = max_rss
+        self.idle = queue.Queue()
+        for _ in range(size):
+            self.idle.put(Worker(runtime))
+
+    def run(self, job, timeout):
+        worker = self.idle.get()
+        try:
+            reply = worker.run(job, timeout)
+            if reply is None:
+                timed_out = worker.alive()
+                worker.kill()
+                worker = Worker(self.runtime)
+                return {"id": job["id"], "returncode": None if timed_out else 1,
+                        "timed_out": timed_out, "stdout": "",
+                        "stderr": "" if timed_out else "worker crashed\n"}
+            rss = process_rss(worker.proc.pid)
+            if self.max_rss and rss is not None and rss > self.max_rss:
+                print(f"Recycling {self.runtime} worker {worker.proc.pid}: {rss // (1024 * 1024)} MB")
+                worker.kill()
+                worker = Worker(self.runtime)
+            return reply
+        finally:
+            self.idle.put(worker)
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get().kill()
+
+
+class WorkerDaemon:
+    """Long-lived process holding warm plugin workers for HTMA_PARSE.py launches"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.idle_timeout = settings.get("daemon_idle_timeout", 600)
+        self.authkey = secrets.token_bytes(32)
+        self.address = daemon_address()
+        self.last_activity = time.monotonic()
+        self.active = 0
+        self.stopping = False
+        self.lock = threading.Lock()
+
+        max_rss = (settings.get("daemon_worker_max_mb") or 0) * 1024 * 1024
+        self.pools = {"python": WorkerPool("python", settings.get("daemon_python_workers", 2), max_rss)}
+        try:
+            self.pools["node"] = WorkerPool("node", settings.get("daemon_node_workers", 1), max_rss)
+        except OSError:
+            print("Node.js not found, .js plugins will run outside the daemon")
+
+    def serve(self):
+        if os.name != "nt" and os.path.exists(self.address):
+            os.unlink(self.address)
+        listener = Listener(self.address, authkey=self.authkey)
+
+        STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = STATE_FILE.with_suffix(".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({"address": self.address, "authkey": self.authkey.hex(), "pid": os.getpid()}, f)
+        os.replace(tmp_file, STATE_FILE)
+        print(f"Worker daemon {os.getpid()} listening on {self.address}")
+
+        threading.Thread(target=self.watch_idle, args=(listener,), daemon=True).start()
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                print(f"Rejected connection: {e}")
+                continue
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        with self.lock:
+            self.active += 1
+        try:
+            with conn:
+                request = conn.recv()
+                if request.get("op") == "ping":
+                    conn.send({"ok": True, "pid": os.getpid()})
+                elif request.get("op") == "stop":
+                    conn.send({"ok": True})
+                    self.stopping = True
+                elif request.get("op") == "run":
+                    job = request["job"]
+                    pool = self.pools.get(job["runtime"])
+                    if pool is None:
+                        conn.send(None)
+                    else:
+                        conn.send(pool.run(job, job.get("timeout") or JOB_TIMEOUT))
+        except (EOFError, OSError) as e:
+            print(f"Client connection lost: {e}")
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.last_activity = time.monotonic()
+
+    def watch_idle(self, listener):
+        while True:
+            time.sleep(1)
+            with self.lock:
+                idle = self.active == 0 and time.monotonic() - self.last_activity > self.idle_timeout
+            if idle or self.stopping:
+                print("Stop requested, shutting down" if self.stopping else "Idle timeout reached, shutting down")
+                self.shutdown(listener)
+
+    def shutdown(self, listener):
+        state = read_state()
+        if state and state.get("pid") == os.getpid():
+            with contextlib.suppress(OSError):
+                STATE_FILE.unlink()
+        for pool in self.pools.values():
+            pool.close()
+        with contextlib.suppress(OSError):
+            listener.close()
+        os._exit(0)
+
+
+# ---------------------------------------------------------------- client side
+
+class DaemonClient:
+    """Hands plugin scripts to the warm worker daemon, starting it on first use"""
+
+    def __init__(self):
+        self.state = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        """Open a connection to the daemon, or return None if it can't be reached"""
+        with self.lock:
+            conn = self.try_connect(self.state or read_state())
+            if conn is None:
+                conn = self.start_daemon()
+            return conn
+
+    def try_connect(self, state):
+        if not state:
+            return None
+        try:
+            conn = Client(state["address"], authkey=bytes.fromhex(state["authkey"]))
+        except Exception:
+            return None
+        self.state = state
+        return conn
+
+    def start_daemon(self):
+        """Launch a detached daemon (unless one is starting) and connect to it"""
+        self.state = None
+        state = read_state()
+        if not (state and pid_alive(state.get("pid", -1))):
+            LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+            kwargs = {}
+            if os.name == "nt":
+                kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+            else:
+                kwargs["start_new_session"] = True
+            with open(LOG_FILE, "a", encoding="utf-8") as log:
+                subprocess.Popen([sys.executable, "-u", str(SCRIPT_DIR / "HTMA_DAEMON.py"), "serve"],
+                                 stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                                 cwd=str(SCRIPT_DIR), **kwargs)
+            print("Started plugin worker daemon")
+
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            conn = self.try_connect(read_state())
+            if conn is not None:
+                return conn
+            time.sleep(0.05)
+        print("Warning: Plugin worker daemon did not start, running plugins directly")
+        return None
+
+    def stop(self):
+        """Ask a running daemon to exit; returns False if none was running"""
+        conn = self.try_connect(read_state())
+        if conn is None:
+            return False
+        with conn:
+            conn.send({"op": "stop"})
+            conn.recv()
+        return True
+
+    def run(self, job):
+        """Run a job on the daemon; returns its reply or None to run it locally
+
+        Once the job is sent it is not run locally as well: a daemon that
+        does not answer in time gives a timed-out result, and one that
+        drops the connection a failed one.
+        """
+        conn = self.connect()
+        if conn is None:
+            return None
+        sent = False
+        try:
+            with conn:
+                conn.send({"op": "run", "job": job})
+                sent = True
+                if not conn.poll((job.get("timeout") or JOB_TIMEOUT) + REPLY_MARGIN):
+                    return {"id": job["id"], "returncode": None, "timed_out": True, "stdout": "",
+                            "stderr": "worker daemon did not answer\n"}
+                return conn.recv()
+        except (EOFError, OSError) as e:
+            if not sent:
+                return None
+            # The job may have run, or be running still: never run it twice
+            return {"id": job["id"], "returncode": 1, "timed_out": False, "stdout": "",
+                    "stderr": f"worker daemon connection lost during the job: {str(e) or type(e).__name__}\n"}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        worker_main()
+    elif len(sys.argv) > 1 and sys.argv[1] == "serve":
+        settings = load_settings(SCRIPT_DIR)
+        state = read_state()
+        if state and pid_alive(state.get("pid", -1)):
+            conn = DaemonClient().try_connect(state)
+            if conn is not None:
+                conn.close()
+                print("A worker daemon is already running")
+                sys.exit(0)
+        WorkerDaemon(settings).serve()
+    elif len(sys.argv) > 1 and sys.argv[1] == "stop":
+        print("Worker daemon stopped" if DaemonClient().stop() else "No worker daemon running")
+    else:
+        print("Usage: python HTMA_DAEMON.py serve|stop|worker")
+        sys.exit(1)
@@ -0,0 +1,330 @@
+import contextlib
+import hashlib
+import json
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+
+from HTMA_PROC import pid_alive
+from HTMA_SETTINGS import load_settings
+
+SCRIPT_DIR = Path(__file__).parent.resolve()
+
+# Written by the host once it is listening: address, authkey and pid
+STATE_FILE = SCRIPT_DIR / ".cache" / "host.json"
+LOG_FILE = SCRIPT_DIR / ".cache" / "host.log"
+
+# How long a launch waits for a freshly started host to come up
+STARTUP_TIMEOUT = 15.0
+# After this long waiting for its window the launch says it is still waiting
+OPEN_NOTICE = 10.0
+
+
+def host_address():
+    """Local socket (POSIX) or named pipe (Windows) unique to this install"""
+    tag = hashlib.sha1(str(SCRIPT_DIR).encode("utf-8")).hexdigest()[:12]
+    if os.name == "nt":
+        return rf"\\.\pipe\htma-plus-host-{tag}"
+    import tempfile
+    return os.path.join(tempfile.gettempdir(), f"htma-plus-host-{tag}.sock")
+
+
+def read_state():
+    try:
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# ---------------------------------------------------------------- host side
+
+class DocumentHost:
+    """One resident wx.App showing every launched page as its own HTMAFrame.
+
+    The first window pays for importing wx and starting the WebView engine;
+    later launches only parse their page, run its plugins and open a frame.
+    Each window's plugins, bridge and TMP session are cleaned up when that
+    window closes. The host exits once no window has been open for
+    host_idle_timeout seconds (0: as soon as the last one closes).
+    """
+
+    def __init__(self, settings):
+        self.idle_timeout = settings.get("host_idle_timeout", 300)
+        self.authkey = secrets.token_bytes(32)
+        self.address = host_address()
+        self.lock = threading.Lock()
+        # Windows open plus pages still being prepared
+        self.open_windows = 0
+        self.opening = 0
+        self.last_activity = time.monotonic()
+        self.cleanups = []
+        self.app = None
+        self.listener = None
+
+    def serve(self):
+        import wx
+
+        self.app = wx.App()
+        # Windows come and go; the host decides when the loop ends
+        self.app.SetExitOnFrameDelete(False)
+
+        if os.name != "nt" and os.path.exists(self.address):
+            os.unlink(self.address)
+        self.listener = Listener(self.address, authkey=self.authkey)
+        STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = STATE_FILE.with_suffix(".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({"address": self.address, "authkey": self.authkey.hex(), "pid": os.getpid()}, f)
+        os.replace(tmp_file, STATE_FILE)
+        print(f"HTMA host {os.getpid()} listening on {self.address}")
+
+        threading.Thread(target=self.accept_loop, name="htma-host", daemon=True).start()
+        threading.Thread(target=self.watch_idle, name="htma-host-idle", daemon=True).start()
+        self.app.MainLoop()
+        self.shutdown()
+
+    def accept_loop(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                return
+            except Exception as e:
+                print(f"Rejected connection: {e}")
+                continue
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        with self.lock:
+            self.opening += 1
+        try:
+            with conn:
+                request = conn.recv()
+                if request.get("op") == "ping":
+                    conn.send({"ok": True, "pid": os.getpid()})
+                elif request.get("op") == "stop":
+                    conn.send({"ok": True})
+                    self.stop()
+                elif request.get("op") == "open":
+                    conn.send(self.open_document(request["file"], request.get("options", {})))
+        except (EOFError, OSError) as e:
+            print(f"Client connection lost: {e}")
+        finally:
+            with self.lock:
+                self.opening -= 1
+                self.last_activity = time.monotonic()
+
+    def open_document(self, htma_file, options):
+        """Parse a page and run its plugins here, then open its window on the GUI thread"""
+        import wx
+        from HTMA_PARSE import HTMAParser
+        from UI import check_display_value, page_cache, prepare_window
+
+        settings = load_settings(SCRIPT_DIR)
+        settings.update(options.get("settings", {}))
+        parser = None
+        try:
+            parser = HTMAParser(htma_file, settings)
+            content = parser.read_source()
+            headless = check_display_value(content)
+            parser.parse_and_run(content, bridge=not headless)
+            if not isinstance(content, str):
+                content = None
+            if headless:
+                print("<display value=0> detected - skipping UI launch")
+                self.finish_document(parser)
+                return {"ok": True, "window": False}
+
+            blocking = parser.blocking_plugins()
+            if blocking:
+                parser.wait_for_plugins(blocking)
+            if options.get("clear_cache"):
+                page_cache(settings).clear()
+                print("Cleared compiled page cache")
+            title, html_content, asset_root = prepare_window(parser.htma_file, not options.get("no_cache"),
+                                                             content, settings)
+        except Exception as e:
+            traceback.print_exc()
+            if parser is not None:
+                self.finish_document(parser)
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+        shown = threading.Event()
+        reply = {"ok": True, "window": True}
+
+        def open_frame():
+            from HTMA_WINDOW import HTMAFrame
+            try:
+                frame = HTMAFrame(title, html_content, asset_root=asset_root, bridge=parser.bridge,
+                                  on_closed=lambda: self.window_closed(parser))
+                frame.Show()
+                frame.Raise()
+                with self.lock:
+                    self.open_windows += 1
+                print(f"Opened window: {title} ({self.open_windows} open)")
+            except Exception as e:
+                traceback.print_exc()
+                reply.update(ok=False, error=f"{type(e).__name__}: {e}")
+                self.finish_document(parser)
+            shown.set()
+
+        wx.CallAfter(open_frame)
+        shown.wait()
+        return reply
+
+    def window_closed(self, parser):
+        """GUI thread: a window closed; its plugins are collected off the GUI thread"""
+        with self.lock:
+            self.open_windows -= 1
+            self.last_activity = time.monotonic()
+        thread = threading.Thread(target=self.finish_document, args=(parser,), name="htma-host-cleanup")
+        thread.start()
+        self.cleanups = [t for t in self.cleanups if t.is_alive()] + [thread]
+
+    @staticmethod
+    def finish_document(parser):
+        """What HTMA_PARSE.py does after its window closes, for one page"""
+        if parser.bridge:
+            parser.bridge.close()
+        if parser.scheduler:
+            parser.wait_for_plugins()
+            parser.scheduler.report()
+        parser.close_transports()
+        if parser.session:
+            parser.session.release()
+
+    def watch_idle(self):
+        while True:
+            time.sleep(0.2 if self.idle_timeout == 0 else 1)
+            with self.lock:
+                idle = (self.open_windows == 0 and self.opening == 0
+                        and time.monotonic() - self.last_activity >= self.idle_timeout)
+            if idle:
+                print("No windows open, shutting down")
+                self.stop()
+                return
+
+    def stop(self):
+        """Stop taking pages and end the GUI loop once the state file is gone"""
+        import wx
+        state = read_state()
+        if state and state.get("pid") == os.getpid():
+            with contextlib.suppress(OSError):
+                STATE_FILE.unlink()
+        with contextlib.suppress(OSError):
+            self.listener.close()
+        wx.CallAfter(self.app.ExitMainLoop)
+
+    def shutdown(self):
+        # Windows still open when stopped are closed with their own cleanup
+        import wx
+        for window in wx.GetTopLevelWindows():
+            window.Close(True)
+        for thread in self.cleanups:
+            thread.join()
+        print("HTMA host stopped")
+
+
+# ---------------------------------------------------------------- client side
+
+class HostClient:
+    """Hands pages to the resident host, starting it on first use"""
+
+    def try_connect(self, state):
+        if not state:
+            return None
+        try:
+            return Client(state["address"], authkey=bytes.fromhex(state["authkey"]))
+        except Exception:
+            return None
+
+    def connect(self):
+        """Open a connection to the host, or return None if it can't be reached"""
+        conn = self.try_connect(read_state())
+        if conn is None:
+            conn = self.start_host()
+        return conn
+
+    def start_host(self):
+        """Launch a detached host (unless one is starting) and connect to it"""
+        state = read_state()
+        if not (state and pid_alive(state.get("pid", -1))):
+            LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+            kwargs = {}
+            if os.name == "nt":
+                kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+            else:
+                kwargs["start_new_session"] = True
+            with open(LOG_FILE, "a", encoding="utf-8") as log:
+                subprocess.Popen([sys.executable, "-u", str(SCRIPT_DIR / "HTMA_HOST.py"), "serve"],
+                                 stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                                 cwd=str(SCRIPT_DIR), **kwargs)
+            print("Started HTMA host")
+
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            conn = self.try_connect(read_state())
+            if conn is not None:
+                return conn
+            time.sleep(0.05)
+        print("Warning: HTMA host did not start, opening the page in this process")
+        return None
+
+    def open(self, htma_file, options=None):
+        """Open a page in the host; returns its reply, or None to open it locally
+
+        Only a host that could not be reached or sent the request falls back
+        to opening the page locally. Once the host has the request it may
+        already be running the page's plugins, so the launch waits for its
+        answer however long that takes, and a host that goes away meanwhile
+        is reported as an error rather than opening the page twice.
+        """
+        conn = self.connect()
+        if conn is None:
+            return None
+        with conn:
+            try:
+                conn.send({"op": "open", "file": str(Path(htma_file).resolve()), "options": options or {}})
+            except OSError:
+                return None
+            try:
+                if not conn.poll(OPEN_NOTICE):
+                    print(f"Waiting for the HTMA host to open the page, see {LOG_FILE}")
+                return conn.recv()
+            except (EOFError, OSError) as e:
+                return {"ok": False, "error": f"HTMA host stopped before opening the page ({e or 'connection closed'})"}
+
+    def stop(self):
+        """Ask a running host to exit; returns False if none was running"""
+        conn = self.try_connect(read_state())
+        if conn is None:
+            return False
+        with conn:
+            conn.send({"op": "stop"})
+            conn.recv()
+        return True
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        settings = load_settings(SCRIPT_DIR)
+        state = read_state()
+        if state and pid_alive(state.get("pid", -1)):
+            conn = HostClient().try_connect(state)
+            if conn is not None:
+                conn.close()
+                print("An HTMA host is already running")
+                sys.exit(0)
+        DocumentHost(settings).serve()
+    elif len(sys.argv) > 1 and sys.argv[1] == "stop":
+        print("HTMA host stopped" if HostClient().stop() else "No HTMA host running")
+    else:
+        print("Usage: python HTMA_HOST.py serve|stop")
+        sys.exit(1)
@@ -0,0 +1,298 @@
+import hashlib
+import json
+import os
+import re
+import sys
+from pathlib import Path
+
+from HTMA_ASSETS import is_remote
+from HTMA_REWRITE import HTMA_RULES
+
+SCRIPT_DIR = Path(__file__).parent.resolve()
+
+# Bump when the stored graph layout or the resolved output changes
+GRAPH_FORMAT = 1
+
+# The same tag the "import" rewrite rule strips from compiled pages
+IMPORT_RE = re.compile(r'<import\s+[^>]*>')
+SRC_RE = re.compile(r'\bsrc\s*=\s*["\']([^"\']+)["\']')
+
+# Links and scripts in a fragment point into the fragment's folder; they
+# are rewritten to point there from the importing page
+ASSET_RULES = [rule for rule in HTMA_RULES if rule.asset_group]
+
+# What minify_html() leaves alone or drops: comments (but not conditional
+# ones) and elements whose whitespace matters or is not HTML
+MINIFY_RE = re.compile(r'<!--(?!\[if)[\s\S]*?-->|<(pre|textarea|script|style)\b[^>]*>[\s\S]*?</\1\s*>',
+                       re.IGNORECASE)
+CSS_TOKEN_RE = re.compile(r'"(?:\\[\s\S]|[^"\\])*"|\'(?:\\[\s\S]|[^\'\\])*\'|/\*[\s\S]*?\*/|\s+')
+
+
+def file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def relative_ref(path, root_dir):
+    """A reference to path usable from a page in root_dir"""
+    try:
+        return Path(os.path.relpath(path, root_dir)).as_posix()
+    except ValueError:
+        # Another drive on Windows
+        return path.as_posix()
+
+
+class ImportResolver:
+    """Splices <import src=...> fragments into a page.
+
+    An imported .htma fragment is replaced by its own text, with its
+    imports resolved in turn; its plugin blocks then belong to the page
+    like any other. An imported .css or .js file becomes a <link> or
+    <script src> that the compiler inlines as usual. Relative links inside
+    fragments are rewritten so they still point at the same files.
+
+    An import that would include a fragment already being included (a
+    cycle) is dropped with a warning naming the chain.
+
+    The graph is saved in .cache/imports: each fragment's signature and
+    its text split into parts, plain text and the fragments it imports.
+    A fragment whose signature is unchanged is put together from its
+    saved parts without being read; only changed files are read and
+    scanned again.
+    """
+
+    def __init__(self, htma_file, cache_dir=None):
+        self.root = Path(htma_file).resolve()
+        self.root_dir = self.root.parent
+        cache_dir = Path(cache_dir) if cache_dir else SCRIPT_DIR / ".cache" / "imports"
+        name = hashlib.sha256(str(self.root).encode("utf-8")).hexdigest()[:32]
+        self.cache_file = cache_dir / f"{name}.json"
+        self.nodes = {}
+        # Every fragment the page imported last time, found or not
+        self.files = []
+        self.reused = 0
+        self.resolved = 0
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        if saved.get("format") == GRAPH_FORMAT and saved.get("root") == str(self.root):
+            self.nodes = saved.get("nodes", {})
+            self.files = [Path(path) for path in saved.get("files", [])]
+
+    def save(self):
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.cache_file.with_name(f"{self.cache_file.name}.{os.getpid()}")
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump({"format": GRAPH_FORMAT, "root": str(self.root), "nodes": self.nodes,
+                           "files": [str(path) for path in self.files]}, f)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            print(f"Warning: Could not save import graph: {e}")
+
+    def resolve(self, content):
+        """content (the page's text) with every import resolved"""
+        seen = {}
+        out = []
+        parts, warnings = self.scan(content, self.root)
+        self.assemble(parts, warnings, [self.root], seen, out)
+        files = [Path(path) for path in seen]
+        # Forget fragments the page no longer imports
+        nodes = {path: node for path, node in self.nodes.items() if path in seen}
+        if self.resolved or files != self.files or len(nodes) != len(self.nodes):
+            self.nodes = nodes
+            self.files = files
+            self.save()
+        return "".join(out)
+
+    def assemble(self, parts, warnings, stack, seen, out):
+        """Append the text of parts to out, splicing in the fragments they import"""
+        path = stack[-1]
+        for warning in warnings:
+            print(f"Warning: {warning}")
+        for part in parts:
+            if isinstance(part, str):
+                out.append(part)
+                continue
+            target, ref = Path(part[0]), part[1]
+            if target in stack:
+                chain = " -> ".join(p.name for p in stack[stack.index(target):] + [target])
+                print(f"Warning: Import cycle {chain}, dropped the import in {path.name}")
+                continue
+            node = self.fragment(target, seen)
+            if node is None:
+                print(f"Warning: Imported file not found: {ref} (in {path.name})")
+                continue
+            self.assemble(node["parts"], node["warnings"], stack + [target], seen, out)
+
+    def fragment(self, target, seen):
+        """The saved node of one imported fragment, scanned again if it changed; None if missing"""
+        key = str(target)
+        if key not in seen:
+            seen[key] = file_signature(target)
+        signature = seen[key]
+        if signature is None:
+            return None
+        node = self.nodes.get(key)
+        if node is not None and node["signature"] == signature:
+            self.reused += 1
+            return node
+        self.resolved += 1
+        with open(target, "r", encoding="utf-8") as f:
+            parts, warnings = self.scan(self.rebase(f.read(), target.parent), target)
+        node = self.nodes[key] = {"signature": signature, "parts": parts, "warnings": warnings}
+        return node
+
+    def scan(self, text, path):
+        """Split the text of path into parts: text, and [file, src] for each .htma import
+
+        CSS/JS imports become the tags that load them. Returns (parts,
+        warnings), the warnings being repeated whenever the parts are used.
+        """
+        parts = []
+        warnings = []
+        copied = 0
+        for match in IMPORT_RE.finditer(text):
+            parts.append(text[copied:match.start()])
+            copied = match.end()
+            src = SRC_RE.search(match.group(0))
+            if src is None:
+                warnings.append(f"<import> without src in {path.name}: {match.group(0)}")
+                continue
+            ref = src.group(1)
+            if is_remote(ref):
+                warnings.append(f"Remote imports are not supported: {ref}")
+                continue
+            target = (path.parent / ref).resolve()
+            kind = target.suffix.lower()
+            if kind == ".css":
+                parts.append(f'<link rel="stylesheet" href="{relative_ref(target, self.root_dir)}">')
+            elif kind == ".js":
+                parts.append(f'<script src="{relative_ref(target, self.root_dir)}"></script>')
+            elif kind == ".htma":
+                parts.append([str(target), ref])
+            else:
+                warnings.append(f"Cannot import {ref}: only .htma, .css and .js files can be imported")
+        parts.append(text[copied:])
+        return parts, warnings
+
+    def rebase(self, text, folder):
+        """Point a fragment's relative CSS/JS links at the same files from the page"""
+        if folder == self.root_dir:
+            return text
+
+        def replace(match):
+            ref = match.group(1)
+            if is_remote(ref) or ref.startswith(("/", "data:", "#")):
+                return match.group(0)
+            new_ref = relative_ref(folder / ref, self.root_dir)
+            start, end = match.span(1)
+            tag = match.group(0)
+            offset = match.start()
+            return tag[:start - offset] + new_ref + tag[end - offset:]
+
+        for rule in ASSET_RULES:
+            text = rule.pattern.sub(replace, text)
+        return text
+
+
+def resolve_imports(content, htma_file):
+    """content of htma_file with its <import> tags resolved (see ImportResolver)"""
+    if "<import" not in content:
+        return content
+    resolver = ImportResolver(htma_file)
+    content = resolver.resolve(content)
+    if resolver.files:
+        print(f"Imports: {len(resolver.files)} fragments, {resolver.resolved} read, {resolver.reused} reused")
+    return content
+
+
+def imported_files(htma_file):
+    """Fragments the last resolve of htma_file imported, for watching"""
+    with open(htma_file, "r", encoding="utf-8") as f:
+        # Without imports the page has none, whatever an older graph says
+        if "<import" not in f.read():
+            return []
+    return ImportResolver(htma_file).files
+
+
+def minify_css(css):
+    """Drop comments and collapse whitespace, leaving strings as they are"""
+    def replace(match):
+        token = match.group(0)
+        if token.startswith("/*"):
+            return ""
+        if token[0].isspace():
+            return " "
+        return token
+    return CSS_TOKEN_RE.sub(replace, css).strip()
+
+
+def minify_html(html):
+    """Smaller HTML for the same page: comments dropped, whitespace runs
+    collapsed (to one newline if they held one, else one space), CSS
+    minified. <pre>, <textarea> and scripts are left untouched."""
+    out = []
+    copied = 0
+
+    def collapse(text):
+        return re.sub(r'\s+', lambda m: "\n" if "\n" in m.group(0) else " ", text)
+
+    for match in MINIFY_RE.finditer(html):
+        out.append(collapse(html[copied:match.start()]))
+        copied = match.end()
+        element = match.group(0)
+        if element.startswith("<!--"):
+            continue
+        if match.group(1).lower() == "style":
+            open_end = element.index(">") + 1
+            close_start = element.lower().rindex("</style")
+            element = element[:open_end] + minify_css(element[open_end:close_start]) + element[close_start:]
+        out.append(element)
+    out.append(collapse(html[copied:]))
+    return "".join(out)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Resolve a page's <import> tags into one bundled file")
+    arg_parser.add_argument("htma_file", help="filename.htma")
+    arg_parser.add_argument("-o", "--out", help="output file (default: name.bundle.htma, or name.html with --html)")
+    arg_parser.add_argument("--html", action="store_true", help="write the compiled HTML instead of HTMA source")
+    arg_parser.add_argument("--minify", action="store_true", help="strip comments and extra whitespace")
+    arg_parser.add_argument("--graph", action="store_true", help="print the imported fragments")
+    args = arg_parser.parse_args()
+
+    htma_file = Path(args.htma_file).resolve()
+    if not htma_file.exists():
+        print(f"Error: File not found: {htma_file}")
+        sys.exit(1)
+    with open(htma_file, "r", encoding="utf-8") as f:
+        content = f.read()
+    resolver = ImportResolver(htma_file)
+    content = resolver.resolve(content)
+
+    if args.graph:
+        for path in resolver.files:
+            print(f"  {relative_ref(path, htma_file.parent)}")
+
+    if args.html:
+        from UI import compile_page
+        content = compile_page(content, htma_file.parent, minify=args.minify)
+        out_file = Path(args.out) if args.out else htma_file.with_suffix(".html")
+    else:
+        if args.minify:
+            content = minify_html(content)
+        out_file = Path(args.out) if args.out else htma_file.with_name(f"{htma_file.stem}.bundle.htma")
+    with open(out_file, "w", encoding="utf-8") as f:
+        f.write(content)
+    print(f"Wrote {out_file} ({len(content) / 1024:.1f} KB, {len(resolver.files)} fragments)")
@@ -0,0 +1,271 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+from HTMA_LEX import PluginBlock, iter_plugin_blocks
+from HTMA_MAPPED import write_arg
+from HTMA_PROC import pid_alive
+from HTMA_SESSION import SESSION_PREFIX, owners
+
+# Bump when the lexer would find different blocks in the same text, or the
+# stored layout changes
+INDEX_FORMAT = 2
+
+# Characters per hashed chunk when comparing a document with its last parse
+CHUNK_SIZE = 16 * 1024
+
+# File in a run's TMP session listing the stored arg files the run uses
+PIN_FILE = "args.pin"
+# An eviction lock older than this was left by a crashed run
+EVICT_LOCK_AGE = 60
+
+
+def text_digest(text):
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+
+def chunk_hashes(text, size=CHUNK_SIZE, from_end=False):
+    """Hashes of fixed-size chunks of text, counted from the start or the end"""
+    length = len(text)
+    if from_end:
+        return [text_digest(text[max(end - size, 0):end]) for end in range(length, 0, -size)]
+    return [text_digest(text[start:start + size]) for start in range(0, length, size)]
+
+
+def common_chunks(old, new):
+    count = 0
+    for a, b in zip(old, new):
+        if a != b:
+            break
+        count += 1
+    return count
+
+
+def block_entry(block, info=None):
+    """A block as stored in the index: [kind, name, start, end, body_start, body_end, calls, info]"""
+    calls = {name: [span[0], span[1]] for name, span in block.calls.items()}
+    return [block.kind, block.name, block.start, block.end, block.body_start, block.body_end, calls, info or {}]
+
+
+def entry_block(entry, shift=0):
+    kind, name, start, end, body_start, body_end, calls = entry[:7]
+    if shift:
+        calls = {call: (span[0] + shift, span[1] + shift) for call, span in calls.items()}
+        return PluginBlock(kind, name, start + shift, end + shift, body_start + shift, body_end + shift, calls)
+    return PluginBlock(kind, name, start, end, body_start, body_end, calls)
+
+
+class ParseIndex:
+    """Sidecar index of the plugin blocks found in one document.
+
+    Holds every block's spans plus its instance keys and arg content hashes,
+    along with hashes of the document in CHUNK_SIZE chunks counted from
+    either end. On the next parse the chunk hashes give the unchanged
+    prefix and suffix: blocks inside them are taken from the index (the
+    suffix ones shifted by the change in length) and only the region in
+    between is lexed again. The lexer keeps no state between blocks, so
+    this finds exactly the blocks a full scan would.
+    """
+
+    def __init__(self, index_file):
+        self.index_file = Path(index_file)
+        # Cached details (instance keys, arg hashes) of reused blocks, by new start offset
+        self.reused = {}
+        self.relexed = 0
+
+    def read(self):
+        try:
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or data.get("format") != INDEX_FORMAT or data.get("chunk") != CHUNK_SIZE:
+            return None
+        return data
+
+    def blocks(self, text):
+        """Every plugin block in text, re-lexing only what changed"""
+        self.reused = {}
+        self.forward = chunk_hashes(text)
+        self.backward = chunk_hashes(text, from_end=True)
+        data = self.read()
+        if data is None:
+            self.relexed = len(text)
+            return list(iter_plugin_blocks(text))
+
+        old_length = data["length"]
+        length = len(text)
+        shortest = min(old_length, length)
+        prefix = min(common_chunks(data["forward"], self.forward) * CHUNK_SIZE, shortest)
+        suffix = min(common_chunks(data["backward"], self.backward) * CHUNK_SIZE, shortest - prefix)
+        shift = length - old_length
+
+        entries = data["blocks"]
+        blocks = []
+        resume = 0
+        index = 0
+        # Blocks that end inside the unchanged prefix are exactly as before
+        while index < len(entries) and entries[index][3] <= prefix:
+            blocks.append(self.reuse(entries[index], 0))
+            resume = entries[index][3]
+            index += 1
+
+        # Lex from there until the scan reaches a block that starts inside
+        # the unchanged suffix; from that block on nothing can differ
+        suffix_start = length - suffix
+        old_starts = {entry[2]: i for i, entry in enumerate(entries) if entry[2] >= old_length - suffix}
+        synced = None
+        scan_end = length
+        for block in iter_plugin_blocks(text, resume):
+            if block.start >= suffix_start and block.start - shift in old_starts:
+                synced = old_starts[block.start - shift]
+                scan_end = block.start
+                break
+            blocks.append(block)
+        if synced is not None:
+            blocks.extend(self.reuse(entry, shift) for entry in entries[synced:])
+        self.relexed = scan_end - resume
+        return blocks
+
+    def reuse(self, entry, shift):
+        block = entry_block(entry, shift)
+        self.reused[block.start] = entry
+        return block
+
+    def cached_hash(self, block, arg):
+        """Content hash of an arg of a reused block, or None"""
+        entry = self.reused.get(block.start)
+        if entry is None:
+            return None
+        value = entry[7].get("args", {}).get(arg)
+        return value[1] if value else None
+
+    def save(self, text, blocks, info):
+        """Write the index for text; info holds extra details by block start"""
+        data = {
+            "format": INDEX_FORMAT,
+            "chunk": CHUNK_SIZE,
+            "length": len(text),
+            "forward": self.forward,
+            "backward": self.backward,
+            "blocks": [block_entry(block, info.get(block.start)) for block in blocks],
+        }
+        try:
+            self.index_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.index_file.with_name(f"{self.index_file.name}.{os.getpid()}")
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp_file, self.index_file)
+        except OSError as e:
+            print(f"Warning: Could not write parse index: {e}")
+
+
+class ArgStore:
+    """Arg payload files named by their content hash and kept between runs.
+
+    An arg whose content did not change since an earlier run points at the
+    file written back then instead of a new one. Files not used for the
+    longest time are deleted once the store grows past max_bytes.
+
+    The store sits next to the TMP sessions. A run pins the files it hands
+    to its plugins (pin() writes their names into its session) before it
+    writes or touches them, and evict() never deletes a file pinned by a
+    session that still has a living owner. Only one run evicts at a time.
+    """
+
+    def __init__(self, root, max_bytes=256 * 1024 * 1024):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.written = 0
+
+    @staticmethod
+    def digest(content, digest=None):
+        """Content hash naming the file of content (a str or an ArgSpan)"""
+        if digest is not None:
+            return digest
+        return text_digest(content) if isinstance(content, str) else content.digest()
+
+    def pin(self, session, digests):
+        """Keep the files of digests while session is alive"""
+        with open(session.path / PIN_FILE, "w", encoding="utf-8") as f:
+            json.dump(sorted(set(digests)), f)
+
+    def pinned(self):
+        """Names of files pinned by sessions that still have a living owner"""
+        names = set()
+        for pin_file in self.root.parent.glob(f"{SESSION_PREFIX}*/{PIN_FILE}"):
+            if not any(pid_alive(pid) for pid in owners(pin_file.parent)):
+                continue
+            try:
+                with open(pin_file, "r", encoding="utf-8") as f:
+                    names.update(f"{digest}.TMP" for digest in json.load(f))
+            except (OSError, ValueError):
+                continue
+        return names
+
+    def put(self, content, digest=None):
+        """Return (path, reused) of the file holding content (a str or an ArgSpan)"""
+        digest = self.digest(content, digest)
+        path = self.root / f"{digest}.TMP"
+        try:
+            os.utime(path)
+            return path, True
+        except OSError:
+            pass
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_file = path.with_name(f"{path.name}.{os.getpid()}")
+        write_arg(tmp_file, content)
+        os.replace(tmp_file, path)
+        self.written += 1
+        return path, False
+
+    def evict(self):
+        """Delete least recently used, unpinned payloads until the store fits max_bytes"""
+        lock_file = self.root / ".evict.lock"
+        try:
+            fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - lock_file.stat().st_mtime < EVICT_LOCK_AGE:
+                    # Another run is evicting
+                    return
+                os.unlink(lock_file)
+                fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError:
+                return
+        except OSError:
+            return
+        os.close(fd)
+        try:
+            self.evict_unlocked()
+        finally:
+            try:
+                os.unlink(lock_file)
+            except OSError:
+                pass
+
+    def evict_unlocked(self):
+        try:
+            entries = [(e.stat().st_mtime_ns, e.stat().st_size, e.path) for e in os.scandir(self.root)
+                       if e.is_file() and e.name.endswith(".TMP")]
+        except OSError:
+            return
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        pinned = self.pinned()
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if os.path.basename(path) in pinned:
+                continue
+            try:
+                # Touched since the listing: a run pinned and reused it meanwhile
+                if os.stat(path).st_mtime_ns != mtime:
+                    continue
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
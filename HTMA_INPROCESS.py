@@ -0,0 +1,138 @@
+import importlib.util
+import sys
+import threading
+import time
+import traceback
+
+from HTMA_ARGS import RUNNING
+from HTMA_SCHEDULER import ScriptResult, StreamCapture
+
+# Entry point called when plugin.json does not name one
+DEFAULT_ENTRY = "run"
+
+# (script path, mtime) -> loaded module, so each plugin is imported once
+MODULE_CACHE = {}
+MODULE_LOCK = threading.Lock()
+
+ROUTER_LOCK = threading.Lock()
+
+
+class ThreadRouter:
+    """Stands in for sys.stdout/sys.stderr while in-process plugins run.
+
+    Writes from a thread that has a capture attached go to that capture;
+    everything else passes through to the real stream untouched.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        target = getattr(self.local, "target", None)
+        if target is None:
+            return self.stream.write(text)
+        target.handle(text)
+        return len(text)
+
+    def flush(self):
+        if getattr(self.local, "target", None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def install_routers():
+    """Put ThreadRouters in place of sys.stdout and sys.stderr (once)"""
+    with ROUTER_LOCK:
+        if not isinstance(sys.stdout, ThreadRouter):
+            sys.stdout = ThreadRouter(sys.stdout)
+        if not isinstance(sys.stderr, ThreadRouter):
+            sys.stderr = ThreadRouter(sys.stderr)
+    return sys.stdout, sys.stderr
+
+
+def load_plugin_module(plugin_name, script_path):
+    """Import a plugin script once, reloading it only when the file changes"""
+    key = (str(script_path), script_path.stat().st_mtime_ns)
+    with MODULE_LOCK:
+        module = MODULE_CACHE.get(key)
+        if module is not None:
+            return module
+
+        # Let the plugin import helper modules that sit next to it
+        plugin_dir = str(script_path.parent)
+        if plugin_dir not in sys.path:
+            sys.path.append(plugin_dir)
+
+        module_name = f"htma_plugin_{plugin_name}_{script_path.stem}"
+        spec = importlib.util.spec_from_file_location(module_name, script_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        MODULE_CACHE[key] = module
+        return module
+
+
+def run_inprocess(job, script, script_path, metadata, echo=True):
+    """Call a Python plugin's entry point in this process.
+
+    Returns a ScriptResult, or None when the module has no entry point and
+    the caller should fall back to running the script as a subprocess.
+    Exceptions and sys.exit() inside the plugin are turned into a failed
+    result instead of propagating. A plugin that outlives its timeout is
+    reported as timed out but, being a thread, keeps running until it returns.
+    """
+    entry_name = job.config.get("entry", DEFAULT_ENTRY)
+    result = ScriptResult(job.name, script, ["inprocess", str(script_path), entry_name])
+    start = time.perf_counter()
+
+    stdout, stderr = install_routers()
+    prefix = f"[{job.name}] "
+    captures = [
+        StreamCapture(None, prefix, stdout.stream if echo else None),
+        StreamCapture(None, prefix, stderr.stream if echo else None),
+    ]
+
+    missing_entry = []
+
+    def target():
+        stdout.local.target = captures[0]
+        stderr.local.target = captures[1]
+        RUNNING.plugin = job.name
+        try:
+            module = load_plugin_module(job.name, script_path)
+            entry = getattr(module, entry_name, None)
+            if not callable(entry):
+                missing_entry.append(entry_name)
+                return
+            # Plain dicts are copied so one plugin can't change another's view
+            entry(dict(metadata) if isinstance(metadata, dict) else metadata)
+            result.returncode = 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                result.returncode = e.code or 0
+            else:
+                captures[1].handle(f"{e.code}\n")
+                result.returncode = 1
+        except BaseException:
+            captures[1].handle(traceback.format_exc())
+            result.returncode = 1
+        finally:
+            stdout.local.target = None
+            stderr.local.target = None
+            RUNNING.plugin = None
+
+    worker = threading.Thread(target=target, name=f"htma-inprocess-{job.name}", daemon=True)
+    worker.start()
+    worker.join(job.timeout)
+    if worker.is_alive():
+        result.timed_out = True
+    elif missing_entry:
+        print(f"Warning: Plugin '{job.name}' has no {entry_name}() entry point, running {script} as a subprocess")
+        return None
+
+    result.stdout = captures[0].text()
+    result.stderr = captures[1].text()
+    result.duration = time.perf_counter() - start
+    return result
@@ -0,0 +1,325 @@
+import re
+
+# Header of a plugin block: function plugin(name) { or function cplugin(name) {
+HEADER_PATTERN = r'function\s+(plugin|cplugin)\s*\(\s*([a-zA-Z0-9_]+)\s*\)\s*\{'
+
+# Everything the body scanner has to look at. Text in between is skipped by the
+# regex engine, so the Python loop only runs once per token.
+BODY_PATTERN = r'''
+    (?P<comment>//[^\r\n]*|/\*[\s\S]*?(?:\*/|\Z))
+  | (?P<string>"[^"\\\r\n]*(?:\\[\s\S][^"\\\r\n]*)*"?|'[^'\\\r\n]*(?:\\[\s\S][^'\\\r\n]*)*'?)
+  | (?P<template>`)
+  | (?<![A-Za-z0-9_$])(?P<call>[A-Za-z_$][A-Za-z0-9_$]*)\s*\(
+  | (?P<open>\()
+  | (?P<close>\))
+  | (?P<lbrace>\{)
+  | (?P<rbrace>\})
+'''
+
+# Rest of a template literal, up to its closing backtick or the next ${
+TEMPLATE_PATTERN = r'[^`\\$]*(?:(?:\\[\s\S]|\$(?!\{))[^`\\$]*)*(`|\$\{)?'
+
+# Inside a call whose argument is bare text (not starting with a quote or
+# backtick) only brackets count, as in the original extractor: the text may
+# hold apostrophes or // (content(Don't stop), content(http://x)) that are
+# not JavaScript strings or comments
+BARE_PATTERN = r'(?<![A-Za-z0-9_$])(?P<call>[A-Za-z_$][A-Za-z0-9_$]*)\s*\(|(?P<open>\()|(?P<close>\))|(?P<lbrace>\{)|(?P<rbrace>\})'
+
+# Whitespace before an argument, and its first character if it is a quote
+LEAD_PATTERN = r'\s*([`"\'])?'
+
+HEADER_RE = re.compile(HEADER_PATTERN)
+BODY_RE = re.compile(BODY_PATTERN, re.VERBOSE)
+TEMPLATE_RE = re.compile(TEMPLATE_PATTERN)
+BARE_RE = re.compile(BARE_PATTERN)
+LEAD_RE = re.compile(LEAD_PATTERN)
+
+# Every character \s matches in str patterns (what str.isspace() is true
+# for), as UTF-8 bytes
+UTF8_SPACE = (rb'(?:[\t-\r\x1c-\x20]|\xc2[\x85\xa0]|\xe1\x9a\x80|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]'
+              rb'|\xe2\x81\x9f|\xe3\x80\x80)')
+
+
+def bytes_pattern(pattern):
+    """pattern for UTF-8 bytes, matching where it matches in the decoded str"""
+    # [\s\S] (any character) is left as it is; only a bare \s needs the
+    # multi-byte spaces
+    parts = pattern.encode("ascii").split(rb'[\s\S]')
+    return rb'[\s\S]'.join(part.replace(rb'\s', UTF8_SPACE) for part in parts)
+
+
+# The same patterns for bytes-like text (bytes, or an mmap of a large file,
+# see HTMA_MAPPED). Offsets are then byte offsets. Call names are ASCII in
+# both, so the two find the same tokens in the same text.
+HEADER_BYTES_RE = re.compile(bytes_pattern(HEADER_PATTERN))
+BODY_BYTES_RE = re.compile(bytes_pattern(BODY_PATTERN), re.VERBOSE)
+TEMPLATE_BYTES_RE = re.compile(bytes_pattern(TEMPLATE_PATTERN))
+BARE_BYTES_RE = re.compile(bytes_pattern(BARE_PATTERN))
+LEAD_BYTES_RE = re.compile(bytes_pattern(LEAD_PATTERN))
+
+# Marker pushed on the brace stack for a ${ ... } template substitution
+TEMPLATE_EXPR = object()
+
+
+class PluginBlock:
+    """A function plugin(name) { ... } block located by the lexer"""
+
+    __slots__ = ("kind", "name", "start", "end", "body_start", "body_end", "calls")
+
+    def __init__(self, kind, name, start, end, body_start, body_end, calls):
+        self.kind = kind              # 'plugin' or 'cplugin'
+        self.name = name
+        self.start = start            # offset of 'function'
+        self.end = end                # offset just past the closing brace
+        self.body_start = body_start
+        self.body_end = body_end
+        self.calls = calls            # call name -> (start, end) of its argument text
+
+    def __repr__(self):
+        return f"PluginBlock({self.kind} {self.name} {self.start}:{self.end} calls={list(self.calls)})"
+
+    def body(self, text):
+        """Return the function body text"""
+        return text[self.body_start:self.body_end]
+
+    def arg_content(self, text, arg_name):
+        """Return the content of the first arg_name(...) call in the body"""
+        span = self.calls.get(arg_name)
+        if span is None:
+            return ""
+        return unquote(text[span[0]:span[1]])
+
+    def arg_span(self, text, arg_name):
+        """(start, end) of what arg_content() returns, without copying it out of text"""
+        span = self.calls.get(arg_name)
+        if span is None:
+            return (0, 0)
+        return unquote_span(text, *span)
+
+
+def unquote(content):
+    """Strip whitespace and one level of backtick or quote wrapping"""
+    content = content.strip()
+    if content.startswith('`') and content.endswith('`'):
+        content = content[1:-1]
+    elif content.startswith('"') and content.endswith('"'):
+        content = content[1:-1]
+    elif content.startswith("'") and content.endswith("'"):
+        content = content[1:-1]
+    return content
+
+
+def unquote_span(text, start, end):
+    """unquote() on text[start:end], as the offsets of the result"""
+    if isinstance(text, str):
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+    else:
+        start, end = strip_utf8_span(text, start, end)
+    if end > start:
+        first, last = text[start:start + 1], text[end - 1:end]
+        quotes = ("`", '"', "'") if isinstance(text, str) else (b"`", b'"', b"'")
+        if first == last and first in quotes:
+            start, end = start + 1, max(end - 1, start + 1)
+    return start, end
+
+
+def strip_utf8_span(data, start, end):
+    """Offsets of data[start:end] (UTF-8 bytes) without the whitespace str.strip() removes
+
+    Whitespace outside ASCII (e.g. a no-break space) is several bytes long,
+    so the characters at either edge are decoded one at a time.
+    """
+    while start < end:
+        lead = data[start]
+        size = 1 if lead < 0xC0 else 2 if lead < 0xE0 else 3 if lead < 0xF0 else 4
+        if not data[start:start + size].decode("utf-8", "replace").isspace():
+            break
+        start += size
+    while end > start:
+        first = end - 1
+        # Step back over continuation bytes to the start of the last character
+        while first > start and data[first] & 0xC0 == 0x80 and end - first < 4:
+            first -= 1
+        if not data[first:end].decode("utf-8", "replace").isspace():
+            break
+        end = first
+    return start, end
+
+
+def scan_body(text, pos, end=None, block=True):
+    """Scan JavaScript from pos, recording the first call of every name.
+
+    With block=True the scan stops at the brace that closes the enclosing
+    block and returns its offset; otherwise it runs to end. Strings, template
+    literals and comments are skipped whole, so brackets inside them are not
+    counted. Regex literals are not recognised. A call whose argument is
+    bare text is skipped by counting brackets only (see scan_bare). Of
+    nested calls with the same name the outer one is recorded, and a call
+    that is never closed is reported and not recorded.
+
+    Returns (close_offset, calls).
+    """
+    if end is None:
+        end = len(text)
+    calls = {}
+    braces = []   # open { and ${ markers
+    parens = []   # (call name or None, content start)
+    as_bytes = not isinstance(text, str)
+    search = (BODY_BYTES_RE if as_bytes else BODY_RE).search
+    lead = (LEAD_BYTES_RE if as_bytes else LEAD_RE).match
+
+    def finish(offset):
+        for name, start in parens:
+            if name is not None:
+                warn_unclosed(text, name, start)
+        return offset, decode_names(calls) if as_bytes else calls
+
+    while True:
+        match = search(text, pos, end)
+        if match is None:
+            return finish(end)
+        kind = match.lastgroup
+        pos = match.end()
+
+        if kind == "call":
+            name = match.group("call")
+            if lead(text, pos, end).group(1) is not None:
+                parens.append((name, pos))
+                continue
+            close = scan_bare(text, pos, end, calls)
+            if close is None:
+                warn_unclosed(text, name, pos)
+                continue
+            record_call(calls, name, pos, close)
+            pos = close + 1
+        elif kind == "open":
+            parens.append((None, pos))
+        elif kind == "close":
+            if parens:
+                name, start = parens.pop()
+                if name is not None:
+                    record_call(calls, name, start, match.start())
+        elif kind == "lbrace":
+            braces.append(None)
+        elif kind == "rbrace":
+            if not braces:
+                if block:
+                    return finish(match.start())
+                continue
+            if braces.pop() is TEMPLATE_EXPR:
+                pos = skip_template(text, pos, end, braces)
+        elif kind == "template":
+            pos = skip_template(text, pos, end, braces)
+        # comments and strings need no further handling
+
+
+def scan_bare(text, pos, end, calls):
+    """Find the ) closing a call with a bare argument starting at pos.
+
+    Brackets are counted whatever they are in, the way the original
+    extractor counted them, and calls inside are recorded. Returns the
+    offset of the ), or None if the enclosing block (or the text) ends
+    first.
+    """
+    search = (BARE_RE if isinstance(text, str) else BARE_BYTES_RE).search
+    parens = []   # call name or None, content start
+    braces = 0
+    while True:
+        match = search(text, pos, end)
+        if match is None:
+            return None
+        kind = match.lastgroup
+        pos = match.end()
+        if kind == "call":
+            parens.append((match.group("call"), pos))
+        elif kind == "open":
+            parens.append((None, pos))
+        elif kind == "close":
+            if not parens:
+                return match.start()
+            name, start = parens.pop()
+            if name is not None:
+                record_call(calls, name, start, match.start())
+        elif kind == "lbrace":
+            braces += 1
+        elif braces == 0:
+            return None
+        else:
+            braces -= 1
+
+
+def record_call(calls, name, start, stop):
+    """Keep the call of name that starts first, so outer calls win over nested ones"""
+    span = calls.get(name)
+    if span is None or start < span[0]:
+        calls[name] = (start, stop)
+
+
+def warn_unclosed(text, name, start):
+    if not isinstance(text, str):
+        name = name.decode("ascii")
+    newline = "\n" if isinstance(text, str) else b"\n"
+    line = 1
+    found = text.find(newline, 0, start)
+    while found != -1:
+        line += 1
+        found = text.find(newline, found + 1, start)
+    print(f"Warning: {name}( on line {line} is never closed, ignoring it")
+
+
+def decode_names(calls):
+    """Call names found in bytes text, as str like everywhere else"""
+    return {name.decode("ascii"): span for name, span in calls.items()}
+
+
+def skip_template(text, pos, end, braces):
+    """Skip template literal text starting at pos, entering ${ if present"""
+    if isinstance(text, str):
+        match, expr = TEMPLATE_RE.match(text, pos, end), "${"
+    else:
+        match, expr = TEMPLATE_BYTES_RE.match(text, pos, end), b"${"
+    if match.group(1) == expr:
+        braces.append(TEMPLATE_EXPR)
+    return match.end()
+
+
+def iter_plugin_blocks(text, start=0, end=None):
+    """Yield plugin/cplugin blocks in text one at a time, in order.
+
+    Nothing is carried over from one block to the next, so a scan resumed
+    at the end of any block finds the same blocks a full scan would.
+    """
+    if end is None:
+        end = len(text)
+    as_bytes = not isinstance(text, str)
+    search = (HEADER_BYTES_RE if as_bytes else HEADER_RE).search
+    pos = start
+    while True:
+        header = search(text, pos, end)
+        if header is None:
+            return
+        body_start = header.end()
+        body_end, calls = scan_body(text, body_start, end)
+        block_end = min(body_end + 1, end)
+        kind, name = header.group(1, 2)
+        if as_bytes:
+            kind, name = kind.decode("ascii"), name.decode("ascii")
+        yield PluginBlock(kind, name, header.start(), block_end, body_start, body_end, calls)
+        pos = block_end
+
+
+def lex_plugin_blocks(text, start=0, end=None):
+    """Find every plugin/cplugin block in text in one linear pass.
+
+    Blocks nested inside another plugin block are part of that block's body
+    and are not reported separately.
+    """
+    return list(iter_plugin_blocks(text, start, end))
+
+
+def lex_calls(text):
+    """Return call name -> argument span for a standalone piece of JavaScript"""
+    return scan_body(text, 0, block=False)[1]
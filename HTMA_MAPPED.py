@@ -0,0 +1,111 @@
+import hashlib
+import mmap
+import os
+
+# Pieces arg contents are normalised, hashed and written in, so memory use
+# does not grow with the size of an arg
+CHUNK_SIZE = 1024 * 1024
+
+# What text-mode files turn "\n" into on this platform
+LINE_END = os.linesep.encode("ascii")
+
+
+class MappedDocument:
+    """A large .htma file mapped read-only instead of read into a str.
+
+    data is the mmap: the lexer runs over it with its bytes patterns and
+    arg contents stay ArgSpans into it until they are written out, so the
+    file is never copied whole. close() once every span has been written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.data)
+
+    def close(self):
+        if not self.data.closed:
+            self.data.close()
+
+
+class ArgSpan:
+    """Content of an arg, as a byte range of a MappedDocument.
+
+    What it yields, hashes and writes matches the str that reading the
+    file in text mode would have produced: line endings are normalised to
+    "\\n" (and written the way text-mode files write them), so digest()
+    equals HTMA_INDEX.text_digest() of that str and arg files are shared
+    with the str parse path.
+    """
+
+    __slots__ = ("data", "start", "end")
+
+    def __init__(self, data, start, end):
+        self.data = data              # MappedDocument.data
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def has_cr(self):
+        return self.data.find(b"\r", self.start, self.end) != -1
+
+    def chunks(self):
+        """The content as UTF-8 bytes with "\\n" line endings, CHUNK_SIZE at a time"""
+        data = self.data
+        if not self.has_cr():
+            # Nothing to normalise: hand out views of the map itself
+            view = memoryview(data)
+            try:
+                for pos in range(self.start, self.end, CHUNK_SIZE):
+                    yield view[pos:min(pos + CHUNK_SIZE, self.end)]
+            finally:
+                view.release()
+            return
+        carry = b""
+        for pos in range(self.start, self.end, CHUNK_SIZE):
+            chunk = carry + data[pos:min(pos + CHUNK_SIZE, self.end)]
+            # A "\r" at the end may be the first half of a "\r\n"
+            carry = b""
+            if chunk.endswith(b"\r") and pos + CHUNK_SIZE < self.end:
+                chunk, carry = chunk[:-1], b"\r"
+            yield chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        if carry:
+            yield b"\n"
+
+    def digest(self):
+        """Same value as text_digest() of the str this span stands for"""
+        h = hashlib.blake2b(digest_size=16)
+        for chunk in self.chunks():
+            h.update(chunk)
+        return h.hexdigest()
+
+    def write_to(self, f):
+        """Write the content to a file opened in binary mode, as a text-mode write would"""
+        for chunk in self.chunks():
+            if LINE_END != b"\n":
+                chunk = bytes(chunk).replace(b"\n", LINE_END)
+            f.write(chunk)
+
+    def text(self):
+        """The content as a str (a full copy, for transports that need one)"""
+        return b"".join(bytes(chunk) for chunk in self.chunks()).decode("utf-8")
+
+
+def arg_text(content):
+    """An arg payload as a str, whether it is one already or an ArgSpan"""
+    return content if isinstance(content, str) else content.text()
+
+
+def write_arg(path, content):
+    """Write an arg payload (str or ArgSpan) to a new file at path"""
+    if isinstance(content, str):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return
+    with open(path, "wb") as f:
+        content.write_to(f)
@@ -1,19 +1,34 @@
+import hashlib
 import json
-import re
 import sys
 import string
 import random
 from pathlib import Path
 
+import HTMA_TRACE as trace
+from HTMA_ARGS import pack_metadata, PackedMetadata, STDIN_ARG, SHM_PREFIX
+from HTMA_INDEX import ArgStore, ParseIndex, text_digest
+from HTMA_LEX import lex_plugin_blocks, lex_calls, unquote
+from HTMA_MAPPED import ArgSpan, MappedDocument, arg_text, write_arg
+from HTMA_REGISTRY import PluginRegistry
+from HTMA_SCHEDULER import PluginScheduler, reads_stdin
+from HTMA_SESSION import Session, tmp_root
+from HTMA_SETTINGS import load_settings
+
 class HTMAParser:
-    def __init__(self, htma_file):
+    def __init__(self, htma_file, settings=None, plugin_dir=None):
         self.htma_file = Path(htma_file).resolve()
         if not self.htma_file.exists():
             raise FileNotFoundError(f"HTMA file not found: {self.htma_file}")
         
         # Use the script's directory as the base (where HTMA_PARSE.py is located)
         self.script_dir = Path(__file__).parent.resolve()
-        self.plugin_dir = self.script_dir / "plugins"
+        # plugin_dir replaces plugins/ (e.g. with stub plugins in bench/)
+        self.plugin_dir = Path(plugin_dir).resolve() if plugin_dir else self.script_dir / "plugins"
+        self.settings = settings if settings is not None else load_settings(self.script_dir)
+        
+        # Every plugin config, scanned and validated once per launch
+        self.registry = PluginRegistry(self.plugin_dir)
         
         # Track plugin instances for naming
         self.plugin_instances = {}
@@ -22,8 +37,28 @@ class HTMAParser:
         self.metadata = {}
         self.metadata_tmp = None
         
+        # Per-run TMP directory, created on first use and removed as a whole
+        self.session = None
+        
+        # Arg contents by metadata key, collected while parsing (str, or
+        # ArgSpans into self.mapped for a memory-mapped document)
+        self.arg_payloads = {}
+        self.mapped = None
+        # Content hashes of args by metadata key, for the arg store
+        self.arg_hashes = {}
+        
         # List of arg TMP files to pass to UI for cleanup
         self.arg_tmp_files = []
+        
+        # Single-buffer metadata for plugins using the stdin or shm transport
+        self.packed_metadata = None
+        self.shared_memory = None
+        
+        # Scheduler running this page's plugins (set by execute_plugins)
+        self.scheduler = None
+        
+        # Socket between the page's JavaScript and "bridge" plugins
+        self.bridge = None
     
     def generate_id(self):
         """Generate a random 20-character alphanumeric ID"""
@@ -40,78 +75,80 @@ class HTMAParser:
     
     def load_plugin_config(self, plugin_name, plugin_type):
         """Load plugin JSON configuration"""
-        # Add underscores around plugin name for folder lookup
-        folder_name = f"_{plugin_name}_"
-        
-        if plugin_type == "plugin":
-            plugin_path = self.plugin_dir / folder_name / "plugin.json"
-        else:  # cplugin
-            plugin_path = self.plugin_dir / "custom" / folder_name / "plugin.json"
-        
-        if plugin_path.exists():
-            with open(plugin_path, "r", encoding='utf-8') as f:
-                return json.load(f)
-        return None
+        entry = self.registry.get(plugin_name, plugin_type)
+        if entry is None:
+            return None
+        return entry["config"]
     
     def extract_arg_content(self, func_body, arg_name):
         """Extract content from an arg function call like content(...)"""
-        # Match arg_name(...) and capture everything inside, handling nested parentheses
-        pattern = rf'{arg_name}\s*\('
-        match = re.search(pattern, func_body)
-        if not match:
+        span = lex_calls(func_body).get(arg_name)
+        if span is None:
             return ""
+        return unquote(func_body[span[0]:span[1]])
+    
+    def read_source(self):
+        """Return the document to parse
         
-        # Find matching closing parenthesis
-        start = match.end()
-        paren_count = 1
-        i = start
-        while i < len(func_body) and paren_count > 0:
-            if func_body[i] == '(':
-                paren_count += 1
-            elif func_body[i] == ')':
-                paren_count -= 1
-            i += 1
-        
-        if paren_count == 0:
-            content = func_body[start:i-1].strip()
-            # Remove quotes if wrapped in backticks or quotes
-            if content.startswith('`') and content.endswith('`'):
-                content = content[1:-1]
-            elif content.startswith('"') and content.endswith('"'):
-                content = content[1:-1]
-            elif content.startswith("'") and content.endswith("'"):
-                content = content[1:-1]
-            return content
-        return ""
+        Files of mmap_parse_mb megabytes and up are memory-mapped instead of
+        read into a str, and the map is returned; close_mapped() releases it.
+        Smaller ones are read with their <import> tags resolved.
+        """
+        threshold = self.settings.get("mmap_parse_mb", 64)
+        size = self.htma_file.stat().st_size
+        if threshold and size and size >= threshold * 1024 * 1024:
+            self.mapped = MappedDocument(self.htma_file)
+            print(f"Memory-mapped {size / (1024 * 1024):.0f} MB document for parsing")
+            if self.mapped.data.find(b"<import") != -1:
+                print("Warning: <import> tags are not resolved in memory-mapped documents")
+            return self.mapped.data
+        from UI import read_document
+        return read_document(self.htma_file)
+    
+    def close_mapped(self):
+        """Unmap the document once every arg span has been written out"""
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+    
+    def parse_index(self):
+        """Sidecar index of this file's plugin blocks, or None if disabled"""
+        if not self.settings.get("parse_index", True):
+            return None
+        name = hashlib.sha256(str(self.htma_file).encode("utf-8")).hexdigest()[:32]
+        return ParseIndex(self.script_dir / ".cache" / "parse" / f"{name}.json")
     
     def parse_plugin_calls(self, content):
         """Find all plugin() and cplugin() function calls and collect data"""
         plugin_list = []
         
-        # Pattern to match function plugin(name) or function cplugin(name)
-        pattern = r'function\s+(plugin|cplugin)\s*\(\s*([a-zA-Z0-9_]+)\s*\)\s*\{'
+        # One linear pass finds every function plugin(name) / cplugin(name)
+        # block along with the spans of all calls in its body; with the parse
+        # index only the part of the file that changed since last time is lexed
+        mapped = not isinstance(content, str)
+        index = None if mapped else self.parse_index()
+        # Arg hashes name the files of the arg store; nothing else uses them
+        hash_args = bool(self.settings.get("arg_store_mb", 0))
+        if index is not None:
+            blocks = index.blocks(content)
+            print(f"Parse index: {len(index.reused)} of {len(blocks)} blocks reused, "
+                  f"{index.relexed} of {len(content)} characters lexed")
+        else:
+            blocks = lex_plugin_blocks(content)
+        block_info = {}
         
-        for match in re.finditer(pattern, content):
-            func_type = match.group(1)  # 'plugin' or 'cplugin'
-            plugin_name = match.group(2)
-            
-            # Find the closing brace and extract function body
-            start = match.end()
-            brace_count = 1
-            i = start
-            while i < len(content) and brace_count > 0:
-                if content[i] == '{':
-                    brace_count += 1
-                elif content[i] == '}':
-                    brace_count -= 1
-                i += 1
-            
-            func_body = content[start:i-1]
+        for block in blocks:
+            func_type = block.kind  # 'plugin' or 'cplugin'
+            plugin_name = block.name
             
             # Load plugin config to get args and scripts
             plugin_config = self.load_plugin_config(plugin_name, func_type)
             if not plugin_config:
-                print(f"Warning: Plugin '{plugin_name}' config not found")
+                problems = self.registry.problems(plugin_name, func_type)
+                if problems:
+                    print(f"Warning: Plugin '{plugin_name}' config is invalid: {'; '.join(problems)}")
+                else:
+                    print(f"Warning: Plugin '{plugin_name}' config not found")
                 continue
             
             print(f"Found plugin '{plugin_name}'")
@@ -123,31 +160,29 @@ class HTMAParser:
             
             # Process args based on rts setting
             rts_enabled = plugin_config.get("rts", False)
+            info = block_info[block.start] = {"directory": dir_key, "args": {}}
             
             if rts_enabled:
-                # Create separate TMP files for each arg
+                # Collect arg contents; they are written out per transport later
                 for arg in plugin_config.get("args", []):
-                    arg_content = self.extract_arg_content(func_body, arg)
+                    if mapped:
+                        # Stays a byte range of the map until it is written out
+                        arg_content = ArgSpan(content, *block.arg_span(content, arg))
+                    else:
+                        arg_content = block.arg_content(content, arg)
                     instance_num = self.get_instance_number(plugin_name, arg)
                     
-                    # Create TMP file for this arg
-                    tmp_dir = self.script_dir / "TMP"
-                    tmp_dir.mkdir(exist_ok=True)
-                    
-                    arg_tmp_id = self.generate_id()
-                    arg_tmp_file = tmp_dir / f"{arg_tmp_id}.TMP"
-                    
-                    # Write raw content to TMP file
-                    with open(arg_tmp_file, 'w', encoding='utf-8') as f:
-                        f.write(arg_content)
-                    
-                    self.arg_tmp_files.append(arg_tmp_file)
-                    
-                    # Store pointer to TMP file in metadata
                     key = f"{plugin_name}:{arg}:{instance_num}"
-                    self.metadata[key] = str(arg_tmp_file)
+                    self.arg_payloads[key] = arg_content
+                    # Placeholder keeps the metadata keys in document order
+                    self.metadata[key] = None
                     
-                    print(f"  Created arg TMP: {arg} -> {arg_tmp_file.name}")
+                    digest = index.cached_hash(block, arg) if index else None
+                    if digest is None and hash_args:
+                        digest = arg_content.digest() if mapped else text_digest(arg_content)
+                    if digest is not None:
+                        self.arg_hashes[key] = digest
+                    info["args"][arg] = [key, digest]
             # If rts is false, args are not included at all
             
             # Track this plugin for execution
@@ -158,12 +193,131 @@ class HTMAParser:
                     "config": plugin_config
                 })
         
+        if index is not None:
+            index.save(content, blocks, block_info)
         return plugin_list
     
+    def console_plugins(self, content):
+        """Plugins in content whose scripts read the console (input() and the like)
+
+        Their stdin is the launching console, unless the stdin transport
+        pipes the metadata to it instead.
+        """
+        names = []
+        for block in lex_plugin_blocks(content):
+            entry = self.registry.get(block.name, block.kind)
+            if entry is None or block.name in names or self.plugin_transport(entry["config"]) == "stdin":
+                continue
+            if any(reads_stdin(Path(entry["path"]) / script) for script in entry["config"].get("scripts", [])):
+                names.append(block.name)
+        return names
+    
+    def plugin_transport(self, plugin_config):
+        """How a plugin receives its metadata: files, stdin or shm"""
+        transport = plugin_config.get("transport", self.settings.get("metadata_transport", "files"))
+        if transport not in ("files", "stdin", "shm"):
+            print(f"Warning: Unknown metadata transport '{transport}', using files")
+            return "files"
+        return transport
+    
+    def tmp_session(self):
+        """The TMP session directory for this run, created on first use"""
+        if self.session is None:
+            root = tmp_root(self.script_dir, self.settings.get("tmp_backing", "disk"))
+            self.session = Session.create(root, loose_files=root == Path(self.script_dir) / "TMP")
+        return self.session
+    
+    def arg_store(self):
+        """Store of arg files kept between runs, or None if disabled"""
+        max_mb = self.settings.get("arg_store_mb", 0)
+        if not max_mb:
+            return None
+        root = tmp_root(self.script_dir, self.settings.get("tmp_backing", "disk")) / "args"
+        return ArgStore(root, int(max_mb * 1024 * 1024))
+    
+    def write_arg_tmp_files(self):
+        """Write one TMP file per arg and point the metadata at them"""
+        store = self.arg_store()
+        if store is not None:
+            # Unchanged args keep pointing at the file an earlier run wrote.
+            # They are pinned first, so no run evicts them while in use.
+            digests = {key: store.digest(content, self.arg_hashes.get(key))
+                       for key, content in self.arg_payloads.items()}
+            store.pin(self.tmp_session(), digests.values())
+            reused = 0
+            for key, arg_content in self.arg_payloads.items():
+                path, hit = store.put(arg_content, digests[key])
+                self.metadata[key] = str(path)
+                reused += hit
+            print(f"  Arg files: {reused} reused, {store.written} written")
+            store.evict()
+            return
+        
+        tmp_dir = self.tmp_session().path
+        
+        for key, arg_content in self.arg_payloads.items():
+            arg_tmp_id = self.generate_id()
+            arg_tmp_file = tmp_dir / f"{arg_tmp_id}.TMP"
+            
+            # Write raw content to TMP file
+            write_arg(arg_tmp_file, arg_content)
+            
+            self.arg_tmp_files.append(arg_tmp_file)
+            
+            # Store pointer to TMP file in metadata
+            self.metadata[key] = str(arg_tmp_file)
+            
+            print(f"  Created arg TMP: {key} -> {arg_tmp_file.name}")
+    
+    def create_packed_metadata(self, use_shm):
+        """Pack metadata and every arg into one buffer, optionally in shared memory"""
+        values = {k: v for k, v in self.metadata.items() if k not in self.arg_payloads}
+        payloads = {key: arg_text(content) for key, content in self.arg_payloads.items()}
+        self.packed_metadata = pack_metadata(values, payloads)
+        print(f"\nPacked metadata: {len(self.packed_metadata)} bytes, {len(self.arg_payloads)} args")
+        
+        if use_shm:
+            from multiprocessing import shared_memory
+            self.shared_memory = shared_memory.SharedMemory(create=True, size=len(self.packed_metadata))
+            self.shared_memory.buf[:len(self.packed_metadata)] = self.packed_metadata
+            print(f"Shared memory block: {self.shared_memory.name}")
+    
+    def prepare_transports(self, plugin_list):
+        """Write out metadata the way the plugins on this page want to receive it"""
+        transports = {self.plugin_transport(p["config"]) for p in plugin_list}
+        
+        if "files" in transports:
+            with trace.span("write_arg_tmp_files", args=len(self.arg_payloads)):
+                self.write_arg_tmp_files()
+            with trace.span("create_metadata_tmp", entries=len(self.metadata)):
+                self.create_metadata_tmp()
+        if "stdin" in transports or "shm" in transports:
+            with trace.span("create_packed_metadata", shm="shm" in transports):
+                self.create_packed_metadata("shm" in transports)
+    
+    def start_bridge(self, plugin_list):
+        """Listen for plugins with "bridge": true and tell them where"""
+        names = [p["name"] for p in plugin_list if p["config"].get("bridge", False)]
+        if not names:
+            return None
+        from HTMA_BRIDGE import BridgeServer
+        self.bridge = BridgeServer(names)
+        self.bridge.start()
+        self.metadata.update(self.bridge.metadata())
+        return self.bridge
+    
+    def close_transports(self):
+        """Release the shared memory block once no plugin needs it"""
+        if self.bridge is not None:
+            self.bridge.close()
+        if self.shared_memory is not None:
+            self.shared_memory.close()
+            self.shared_memory.unlink()
+            self.shared_memory = None
+    
     def create_metadata_tmp(self):
         """Create the metadata JSON TMP file"""
-        tmp_dir = self.script_dir / "TMP"
-        tmp_dir.mkdir(exist_ok=True)
+        tmp_dir = self.tmp_session().path
         
         # Generate random ID for metadata TMP
         tmp_id = self.generate_id()
@@ -178,105 +332,244 @@ class HTMAParser:
         if self.metadata:
             print(f"Keys: {list(self.metadata.keys())}")
     
-    def execute_plugins(self, plugin_list):
-        """Execute plugin scripts with metadata TMP file path"""
-        import subprocess
+    def execute_plugins(self, plugin_list, finished=()):
+        """Start plugin scripts on the scheduler with the metadata TMP file path
+        
+        finished names plugins that ran before and need not run again for
+        the ones that depend on them.
+        """
+        daemon = None
+        if self.settings.get("daemon"):
+            from HTMA_DAEMON import DaemonClient
+            daemon = DaemonClient()
+        
+        self.scheduler = PluginScheduler(self.settings.get("max_workers"), metadata=self.metadata, daemon=daemon)
+        self.scheduler.finished.update(finished)
         
         for plugin_info in plugin_list:
             plugin_name = plugin_info["name"]
             plugin_type = plugin_info["type"]
             plugin_config = plugin_info["config"]
-            scripts = plugin_config.get("scripts", [])
             
-            print(f"\n{'='*50}")
-            print(f"Executing plugin: {plugin_name}")
-            
-            # Determine plugin directory
-            folder_name = f"_{plugin_name}_"
-            if plugin_type == "plugin":
-                plugin_path = self.plugin_dir / folder_name
-            else:
-                plugin_path = self.plugin_dir / "custom" / folder_name
+            print(f"Scheduling plugin: {plugin_name}")
             
-            scripts_found = False
-            for script in scripts:
-                script_path = plugin_path / script
-                
-                if not script_path.exists():
-                    continue
-                
-                scripts_found = True
-                
-                # Determine how to run the script based on extension
-                if script.endswith('.py'):
-                    cmd = ["python", str(script_path), str(self.metadata_tmp)]
-                elif script.endswith('.js'):
-                    cmd = ["node", str(script_path), str(self.metadata_tmp)]
-                else:
-                    print(f"Warning: Unknown script type: {script}")
-                    continue
-                
-                
-                try:
-                    result = subprocess.Popen(cmd)
-                    if result.stdout:
-                        print(f"Output:\n{result.stdout}")
-                    if result.stderr:
-                        print(f"Error:\n{result.stderr}")
-                except Exception as e:
-                    print(f"Failed to execute: {e}")
+            # Plugin directory as found by the registry scan
+            plugin_path = self.registry.get(plugin_name, plugin_type)["path"]
             
-            if not scripts_found:
-                print(f"Warning: No scripts found for plugin '{plugin_name}'")
+            transport = self.plugin_transport(plugin_config)
+            if transport == "stdin":
+                self.scheduler.add(plugin_name, plugin_path, plugin_config, STDIN_ARG,
+                                   stdin_data=self.packed_metadata,
+                                   metadata=PackedMetadata(self.packed_metadata))
+            elif transport == "shm":
+                self.scheduler.add(plugin_name, plugin_path, plugin_config, SHM_PREFIX + self.shared_memory.name,
+                                   metadata=PackedMetadata(self.packed_metadata))
+            else:
+                self.scheduler.add(plugin_name, plugin_path, plugin_config, str(self.metadata_tmp))
+        
+        self.scheduler.start()
+        return self.scheduler
+    
+    def blocking_plugins(self):
+        """Names of the plugins the window should wait for before opening"""
+        if not self.scheduler:
+            return []
+        wait_for_rts = self.settings.get("wait_for_plugins", False)
+        names = []
+        for job in self.scheduler.jobs.values():
+            # Bridge plugins serve the open page, so they never finish first
+            if job.config.get("bridge", False):
+                continue
+            # A plugin's own "wait" setting overrides the global one
+            if job.config.get("wait", wait_for_rts and job.config.get("rts", False)):
+                names.append(job.name)
+        return names
+    
+    def wait_for_plugins(self, names=None):
+        """Block until the given plugins (default: all) have finished"""
+        if self.scheduler:
+            self.scheduler.wait(names)
     
-    def parse_and_run(self):
-        """Parse the HTMA file and execute plugins"""
-        with open(self.htma_file, "r", encoding="utf-8") as f:
-            content = f.read()
+    def parse_and_run(self, content=None, bridge=False):
+        """Parse the HTMA file and execute plugins
+        
+        content is the already-read text of the file, or what read_source()
+        returned, if the caller has it. A memory map is closed afterwards.
+        bridge starts a plugin bridge for a window that is going to open.
+        """
+        if content is None:
+            with trace.span("read_document"):
+                content = self.read_source()
         
         print(f"Parsing: {self.htma_file}")
         
         # Parse plugin calls and collect all data
-        plugin_list = self.parse_plugin_calls(content)
+        with trace.span("parse_plugin_calls", characters=len(content)) as span:
+            plugin_list = self.parse_plugin_calls(content)
+            span.set(plugins=len(plugin_list))
         
         if not plugin_list:
             print("No plugin functions found")
         else:
             self.metadata["window:file"] = str(self.htma_file)
-            self.create_metadata_tmp()
+            if bridge:
+                self.start_bridge(plugin_list)
+            with trace.span("prepare_transports"):
+                self.prepare_transports(plugin_list)
             
             # Execute all plugins with the metadata TMP
-            self.execute_plugins(plugin_list)
+            with trace.span("execute_plugins", plugins=len(plugin_list)):
+                self.execute_plugins(plugin_list)
+        
+        # Every arg has been written out, nothing refers to the map any more
+        self.close_mapped()
         
         print(f"\n{'='*50}")
-        print("Execution complete")
+        print("Parsing complete")
         print(f"{'='*50}")
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python HTMA_PARSE.py filename.htma")
-        sys.exit(1)
+    import argparse
+    import time
+    
+    started = time.perf_counter()
+    
+    arg_parser = argparse.ArgumentParser(description="Parse an .htma file, run its plugins and open it")
+    arg_parser.add_argument("htma_file", help="filename.htma")
+    arg_parser.add_argument("--max-workers", type=int, help="most plugins running at once (default: number of cores)")
+    wait_group = arg_parser.add_mutually_exclusive_group()
+    wait_group.add_argument("--wait", dest="wait_for_plugins", action="store_true", default=None,
+                            help="open the window only after rts plugins finish")
+    wait_group.add_argument("--no-wait", dest="wait_for_plugins", action="store_false",
+                            help="open the window while plugins are still running")
+    arg_parser.add_argument("--no-cache", action="store_true", help="compile the page even if a cached copy exists")
+    arg_parser.add_argument("--clear-cache", action="store_true", help="delete every cached compiled page first")
+    arg_parser.add_argument("--timing", action="store_true", help="print time from launch to first paint and to exit")
+    arg_parser.add_argument("--watch", action="store_true",
+                            help="keep the window in sync with the page, its CSS/JS files and its plugins")
+    arg_parser.add_argument("--trace", metavar="OUT_JSON",
+                            help="record how long every phase takes and write it in Chrome trace format")
+    host_group = arg_parser.add_mutually_exclusive_group()
+    host_group.add_argument("--host", dest="host", action="store_true", default=None,
+                            help="open the page in the resident HTMA host (see HTMA_HOST.py)")
+    host_group.add_argument("--no-host", dest="host", action="store_false",
+                            help="open the page in this process even if the host setting is on")
+    args = arg_parser.parse_args()
+    
+    if args.trace:
+        trace.enable()
+        trace.complete("startup", started, time.perf_counter())
     
-    htma_file = sys.argv[1]
+    settings = load_settings()
+    if args.max_workers is not None:
+        settings["max_workers"] = args.max_workers
+    if args.wait_for_plugins is not None:
+        settings["wait_for_plugins"] = args.wait_for_plugins
+    if args.host is not None:
+        settings["host"] = args.host
+    
+    # Watch mode and traces follow one window in this process
+    if settings.get("host") and not (args.watch or args.trace or args.timing):
+        from HTMA_HOST import LOG_FILE, HostClient
+        # The host runs plugins without a console, so a page with a plugin
+        # that prompts for input opens here instead
+        try:
+            checker = HTMAParser(args.htma_file, settings)
+        except FileNotFoundError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        console = checker.console_plugins(checker.read_source())
+        checker.close_mapped()
+        if console:
+            print(f"Opening the page in this process: {', '.join(console)} read the console, "
+                  "which plugins in the HTMA host do not have")
+        else:
+            overrides = {key: settings[key] for key in ("max_workers", "wait_for_plugins")}
+            reply = HostClient().open(args.htma_file, {"settings": overrides, "no_cache": args.no_cache,
+                                                       "clear_cache": args.clear_cache})
+            if reply is not None:
+                if not reply.get("ok"):
+                    print(f"Error: {reply.get('error')}")
+                    sys.exit(1)
+                print(f"Opened in the HTMA host, its output goes to {LOG_FILE}")
+                sys.exit(0)
     
     try:
-        parser = HTMAParser(htma_file)
-        parser.parse_and_run()
+        with trace.span("import UI"):
+            from UI import check_display_value, launch_ui, load_page, page_cache, read_document
+        
+        with trace.span("load plugin registry"):
+            parser = HTMAParser(args.htma_file, settings)
+        
+        # Read the document once; the parser and the window share the text
+        # (a large one is memory-mapped and the window reads it again later)
+        with trace.span("read_document"):
+            content = parser.read_source()
+        headless = check_display_value(content)
+        parser.parse_and_run(content, bridge=not headless)
+        if not isinstance(content, str):
+            content = None
         
-        # Get all TMP file paths for cleanup
-        tmp_files = []
-        if parser.metadata_tmp:
-            tmp_files.append(str(parser.metadata_tmp))
-        tmp_files.extend([str(f) for f in parser.arg_tmp_files])
+        if headless:
+            # Headless: nothing to show, so wx is never imported
+            print("<display value=0> detected - skipping UI launch")
+        else:
+            # Hold the window for plugins that have to finish first
+            blocking = parser.blocking_plugins()
+            if blocking:
+                with trace.span("wait for blocking plugins", plugins=blocking):
+                    parser.wait_for_plugins(blocking)
+            
+            if args.clear_cache:
+                page_cache(settings).clear()
+                print("Cleared compiled page cache")
+            
+            def first_paint():
+                trace.instant("first paint", "ui")
+                if args.timing:
+                    print(f"Launch to first paint: {(time.perf_counter() - started) * 1000:.0f} ms")
+            
+            live = None
+            if args.watch:
+                from HTMA_WATCH import LiveReload
+                if content is None:
+                    content = read_document(parser.htma_file)
+                use_cache = not args.no_cache and settings.get("page_cache", True)
+                live = LiveReload(
+                    parser.htma_file, content, parser.registry,
+                    make_parser=lambda: HTMAParser(parser.htma_file, settings),
+                    compile_page=lambda text: load_page(text, parser.htma_file.parent, use_cache, settings,
+                                                        tag_assets=True))
+            
+            # The window runs on this thread while plugins keep running on
+            # the scheduler's; the session is released below, not on close
+            launch_ui(parser.htma_file, use_cache=not args.no_cache, content=content, on_loaded=first_paint,
+                      live=live, bridge=parser.bridge)
+            if live:
+                live.stop()
+        
+        # With the window gone (or never opened) bridge plugins stop serving
+        if parser.bridge:
+            parser.bridge.close()
         
-        # Launch UI after parsing
-        import subprocess
-        ui_script = Path(__file__).parent / "UI.py"
-        subprocess.Popen(["python", str(ui_script), str(parser.htma_file)] + tmp_files)
+        # Keep collecting output from plugins running alongside the window
+        if parser.scheduler:
+            with trace.span("wait for plugins"):
+                parser.wait_for_plugins()
+            parser.scheduler.report()
+        parser.close_transports()
+        if parser.session:
+            parser.session.release()
+        
+        if args.timing:
+            print(f"Launch to exit: {(time.perf_counter() - started) * 1000:.0f} ms")
         
     except Exception as e:
         print(f"Error: {e}")
         import traceback
         traceback.print_exc()
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
+    finally:
+        if args.trace:
+            trace.save(args.trace)
@@ -0,0 +1,304 @@
+import os
+import sys
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+if os.name == "nt":
+    import ctypes
+    from ctypes import wintypes
+
+    PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+    PROCESS_VM_READ = 0x0010
+    STILL_ACTIVE = 259
+    BELOW_NORMAL_PRIORITY_CLASS = 0x4000
+    IDLE_PRIORITY_CLASS = 0x0040
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    class IO_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ("ReadOperationCount", ctypes.c_ulonglong),
+            ("WriteOperationCount", ctypes.c_ulonglong),
+            ("OtherOperationCount", ctypes.c_ulonglong),
+            ("ReadTransferCount", ctypes.c_ulonglong),
+            ("WriteTransferCount", ctypes.c_ulonglong),
+            ("OtherTransferCount", ctypes.c_ulonglong),
+        ]
+
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    kernel32.OpenProcess.argtypes = [wintypes.DWORD, wintypes.BOOL, wintypes.DWORD]
+    kernel32.CloseHandle.argtypes = [wintypes.HANDLE]
+    kernel32.GetExitCodeProcess.argtypes = [wintypes.HANDLE, ctypes.POINTER(wintypes.DWORD)]
+    kernel32.K32GetProcessMemoryInfo.argtypes = [
+        wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+    # FILETIMEs are read as 64-bit counts of 100 ns
+    kernel32.GetProcessTimes.argtypes = [wintypes.HANDLE] + [ctypes.POINTER(ctypes.c_ulonglong)] * 4
+    kernel32.GetProcessIoCounters.argtypes = [wintypes.HANDLE, ctypes.POINTER(IO_COUNTERS)]
+
+
+def pid_alive(pid):
+    """Return True if a process with this pid is still running"""
+    if psutil is not None:
+        return psutil.pid_exists(pid)
+    if os.name == "nt":
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return False
+        try:
+            code = wintypes.DWORD()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+                return False
+            return code.value == STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    # An exited child nobody has waited for yet still answers signal 0
+    if sys.platform.startswith("linux"):
+        try:
+            with open(f"/proc/{pid}/stat", "r") as f:
+                return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+        except (OSError, IndexError):
+            return False
+    return True
+
+
+def memory_counters(handle):
+    """Fill PROCESS_MEMORY_COUNTERS for an open Windows process handle"""
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    if not kernel32.K32GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+        return None
+    return counters
+
+
+def process_rss(pid):
+    """Return the resident memory of a process in bytes, or None if unknown"""
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return None
+    if os.name == "nt":
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION | PROCESS_VM_READ, False, pid)
+        if not handle:
+            return None
+        try:
+            counters = memory_counters(handle)
+            return counters.WorkingSetSize if counters else None
+        finally:
+            kernel32.CloseHandle(handle)
+    if sys.platform.startswith("linux"):
+        try:
+            with open(f"/proc/{pid}/statm", "r") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            return None
+    return None
+
+
+class ProcessUsage:
+    """Resources one child process used; None where the platform cannot tell"""
+
+    __slots__ = ("wall", "cpu", "peak_rss", "read_bytes", "write_bytes")
+
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = None
+        self.peak_rss = None
+        self.read_bytes = None
+        self.write_bytes = None
+
+    def describe(self):
+        parts = []
+        if self.cpu is not None:
+            parts.append(f"cpu {self.cpu:.2f}s")
+        if self.peak_rss is not None:
+            parts.append(f"peak {self.peak_rss / (1024 * 1024):.1f} MB")
+        if self.read_bytes is not None or self.write_bytes is not None:
+            read = (self.read_bytes or 0) / (1024 * 1024)
+            written = (self.write_bytes or 0) / (1024 * 1024)
+            parts.append(f"io {read:.1f}/{written:.1f} MB read/written")
+        return ", ".join(parts)
+
+
+def process_sample(pid):
+    """(rss, peak_rss, cpu_seconds, read_bytes, write_bytes) of a running process; unknowns are None"""
+    rss = peak = cpu = read = write = None
+    if psutil is not None:
+        try:
+            p = psutil.Process(pid)
+            with p.oneshot():
+                memory = p.memory_info()
+                rss = memory.rss
+                peak = getattr(memory, "peak_wset", None)
+                times = p.cpu_times()
+                cpu = times.user + times.system
+                if hasattr(p, "io_counters"):
+                    io = p.io_counters()
+                    read, write = io.read_bytes, io.write_bytes
+        except psutil.Error:
+            pass
+        return rss, peak, cpu, read, write
+    if sys.platform.startswith("linux"):
+        try:
+            with open(f"/proc/{pid}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss = int(line.split()[1]) * 1024
+                    elif line.startswith("VmHWM:"):
+                        peak = int(line.split()[1]) * 1024
+            with open(f"/proc/{pid}/stat", "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+            with open(f"/proc/{pid}/io", "r") as f:
+                io = dict(line.split(":") for line in f if ":" in line)
+            read, write = int(io["read_bytes"]), int(io["write_bytes"])
+        except (OSError, ValueError, IndexError, KeyError):
+            pass
+        return rss, peak, cpu, read, write
+    return process_rss(pid), None, None, None, None
+
+
+def priority_options(nice):
+    """Extra Popen arguments that start a process at a lower CPU priority"""
+    if not nice or nice <= 0 or os.name != "nt":
+        return {}
+    return {"creationflags": IDLE_PRIORITY_CLASS if nice >= 10 else BELOW_NORMAL_PRIORITY_CLASS}
+
+
+def set_nice(pid, nice):
+    """Lower a started process's CPU priority on POSIX (Windows uses priority_options)"""
+    if not nice or os.name == "nt":
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, pid, os.getpriority(os.PRIO_PROCESS, pid) + nice)
+    except (OSError, AttributeError) as e:
+        print(f"Warning: Could not change priority of process {pid}: {e}")
+
+
+class ProcessWatch(threading.Thread):
+    """Follows one child process: samples what it uses and enforces its limits.
+
+    Every interval seconds the process is sampled for memory, CPU and I/O.
+    It is killed once it runs longer than timeout seconds or its resident
+    memory grows past max_rss bytes; killed_by then says which. Start it
+    right after spawning and collect the totals with wait().
+    """
+
+    def __init__(self, proc, timeout=None, max_rss=None, interval=0.1):
+        super().__init__(name=f"htma-watch-{proc.pid}", daemon=True)
+        self.proc = proc
+        self.timeout = timeout
+        self.max_rss = max_rss
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.finished = threading.Event()
+        self.killed_by = None
+        self.usage = ProcessUsage()
+        self.handle = None
+        if os.name == "nt":
+            # An open handle keeps the counters readable after the process exits
+            self.handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION | PROCESS_VM_READ, False, proc.pid)
+
+    def run(self):
+        deadline = None if self.timeout is None else self.started + self.timeout
+        while True:
+            self.sample()
+            if self.max_rss is not None and (self.usage.peak_rss or 0) > self.max_rss:
+                self.kill("memory")
+                return
+            wait = self.interval
+            if deadline is not None:
+                wait = min(wait, max(deadline - time.perf_counter(), 0))
+            if self.finished.wait(wait):
+                return
+            if deadline is not None and time.perf_counter() >= deadline:
+                self.kill("timeout")
+                return
+
+    def sample(self):
+        rss, peak, cpu, read, write = process_sample(self.proc.pid)
+        usage = self.usage
+        peak = max(filter(None, (peak, rss, usage.peak_rss)), default=None)
+        usage.peak_rss = peak
+        if cpu is not None:
+            usage.cpu = cpu
+        if read is not None:
+            usage.read_bytes, usage.write_bytes = read, write
+
+    def kill(self, reason):
+        if self.finished.is_set():
+            return
+        self.killed_by = reason
+        try:
+            self.proc.kill()
+        except OSError:
+            pass
+
+    def wait(self):
+        """Wait for the process to exit; return its exit code. Totals are in self.usage"""
+        usage = self.usage
+        rusage = None
+        if os.name != "nt" and hasattr(os, "wait4"):
+            # Reaping it ourselves gives the kernel's exact CPU and peak memory
+            try:
+                _, status, rusage = os.wait4(self.proc.pid, 0)
+                self.proc.returncode = os.waitstatus_to_exitcode(status)
+            except ChildProcessError:
+                pass
+        returncode = self.proc.wait()
+        usage.wall = time.perf_counter() - self.started
+        self.finished.set()
+        self.join()
+
+        if rusage is not None:
+            usage.cpu = rusage.ru_utime + rusage.ru_stime
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS
+            usage.peak_rss = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+            # Blocks of 512 bytes actually read from / written to storage
+            usage.read_bytes = max(usage.read_bytes or 0, rusage.ru_inblock * 512)
+            usage.write_bytes = max(usage.write_bytes or 0, rusage.ru_oublock * 512)
+        elif self.handle:
+            self.windows_totals()
+        return returncode
+
+    def windows_totals(self):
+        try:
+            usage = self.usage
+            times = [ctypes.c_ulonglong() for _ in range(4)]
+            if kernel32.GetProcessTimes(self.handle, *[ctypes.byref(t) for t in times]):
+                usage.cpu = (times[2].value + times[3].value) / 1e7
+            counters = memory_counters(self.handle)
+            if counters:
+                usage.peak_rss = counters.PeakWorkingSetSize
+            io = IO_COUNTERS()
+            if kernel32.GetProcessIoCounters(self.handle, ctypes.byref(io)):
+                usage.read_bytes, usage.write_bytes = io.ReadTransferCount, io.WriteTransferCount
+        finally:
+            kernel32.CloseHandle(self.handle)
+            self.handle = None
@@ -0,0 +1,168 @@
+import json
+import os
+from pathlib import Path
+
+# Bump when the layout of the on-disk index or the validation rules change
+INDEX_VERSION = 3
+
+
+def validate_config(config):
+    """Return a list of problems with a plugin.json config (empty if valid)"""
+    if not isinstance(config, dict):
+        return ["config must be a JSON object"]
+    problems = []
+    for key in ("args", "scripts"):
+        value = config.get(key, [])
+        if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+            problems.append(f"'{key}' must be a list of strings")
+    for key in ("rts", "bridge"):
+        if not isinstance(config.get(key, False), bool):
+            problems.append(f"'{key}' must be true or false")
+    if not isinstance(config.get("custom", {}), dict):
+        problems.append("'custom' must be an object")
+    limits = config.get("limits", {})
+    if not isinstance(limits, dict):
+        problems.append("'limits' must be an object")
+    else:
+        for key, value in limits.items():
+            if key not in ("timeout", "max_memory_mb", "nice"):
+                problems.append(f"unknown limit '{key}'")
+            elif isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                problems.append(f"limit '{key}' must be a number of at least 0")
+    return problems
+
+
+def stat_signature(path):
+    """Return (mtime_ns, size) for path, or None if it does not exist"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+class PluginRegistry:
+    """Every plugin under plugins/ and plugins/custom/, scanned once per launch.
+
+    Configs are validated when they are loaded and kept in a dict keyed by
+    (type, name), so lookups, including misses, never touch the disk. The
+    parsed configs are also written to an index file keyed by path and
+    mtime; a later launch only stats the files it already knows about and
+    re-reads the ones that changed.
+    """
+
+    def __init__(self, plugin_dir, index_file=None):
+        self.plugin_dir = Path(plugin_dir).resolve()
+        # Kept outside plugins/ so writing it does not change the folder mtime
+        self.index_file = Path(index_file) if index_file else self.plugin_dir.parent / ".cache" / "registry.json"
+
+        # (type, name) -> {"name", "type", "path", "config"}
+        self.plugins = {}
+        # (type, name) -> list of problems for configs that failed validation
+        self.invalid = {}
+
+        self.load()
+
+    def roots(self):
+        """Yield (plugin type, folder containing plugin folders)"""
+        yield "plugin", self.plugin_dir
+        yield "cplugin", self.plugin_dir / "custom"
+
+    def read_index(self):
+        """Load the on-disk index, or None if it is missing or unusable"""
+        try:
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(index, dict) or index.get("version") != INDEX_VERSION:
+            return None
+        return index
+
+    def write_index(self, index):
+        """Atomically replace the on-disk index"""
+        tmp_file = self.index_file.with_name(f"{self.index_file.name}.{os.getpid()}")
+        try:
+            self.index_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(index, f)
+            os.replace(tmp_file, self.index_file)
+        except OSError as e:
+            print(f"Warning: Could not write plugin index: {e}")
+
+    def list_folders(self):
+        """Scan the plugin roots and return {folder path: plugin type}"""
+        folders = {}
+        for plugin_type, root in self.roots():
+            try:
+                entries = list(os.scandir(root))
+            except OSError:
+                continue
+            for entry in entries:
+                name = entry.name
+                if len(name) > 2 and name.startswith("_") and name.endswith("_") and entry.is_dir():
+                    folders[entry.path] = plugin_type
+        return folders
+
+    def load(self):
+        """Populate the registry from the index, rescanning only what changed"""
+        index = self.read_index()
+        root_stats = {str(root): stat_signature(root) for _, root in self.roots()}
+
+        if index and index.get("roots") == root_stats:
+            # No plugin folder was added or removed since the index was written
+            folders = {path: entry["type"] for path, entry in index["folders"].items()}
+            known = index["folders"]
+        else:
+            folders = self.list_folders()
+            known = index["folders"] if index else {}
+
+        changed = known.keys() != folders.keys()
+        entries = {}
+        for folder, plugin_type in folders.items():
+            config_path = os.path.join(folder, "plugin.json")
+            signature = stat_signature(config_path)
+            entry = known.get(folder)
+
+            if entry is None or entry.get("stat") != signature or entry.get("type") != plugin_type:
+                entry = self.read_config(config_path, plugin_type, signature)
+                changed = True
+            entries[folder] = entry
+
+            if entry["stat"] is None:
+                continue
+            name = os.path.basename(folder)[1:-1]
+            if entry["problems"]:
+                self.invalid[(plugin_type, name)] = entry["problems"]
+            else:
+                self.plugins[(plugin_type, name)] = {
+                    "name": name,
+                    "type": plugin_type,
+                    "path": Path(folder),
+                    "config": entry["config"],
+                }
+
+        if changed or not index or index.get("roots") != root_stats:
+            self.write_index({"version": INDEX_VERSION, "roots": root_stats, "folders": entries})
+
+    def read_config(self, config_path, plugin_type, signature):
+        """Read and validate one plugin.json into an index entry"""
+        entry = {"type": plugin_type, "stat": signature, "config": None, "problems": []}
+        if signature is None:
+            return entry
+        try:
+            with open(config_path, "r", encoding="utf-8") as f:
+                entry["config"] = json.load(f)
+        except (OSError, ValueError) as e:
+            entry["problems"] = [f"could not be read: {e}"]
+            return entry
+        entry["problems"] = validate_config(entry["config"])
+        return entry
+
+    def get(self, plugin_name, plugin_type="plugin"):
+        """Return the registry entry for a plugin, or None if it is unknown"""
+        return self.plugins.get((plugin_type, plugin_name))
+
+    def problems(self, plugin_name, plugin_type="plugin"):
+        """Return validation problems for a plugin whose config was rejected"""
+        return self.invalid.get((plugin_type, plugin_name), [])
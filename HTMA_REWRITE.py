@@ -0,0 +1,214 @@
+import html
+import re
+from pathlib import Path
+
+import HTMA_TRACE as trace
+from HTMA_ASSETS import AssetLoader, is_remote
+
+
+# Literal text at the start of a pattern, up to its first regex operator
+LITERAL_PREFIX_RE = re.compile(r'[^\\.^$*+?{}\[\]|()]+')
+
+
+class RewriteRule:
+    """One HTMA construct the rewriter replaces.
+
+    pattern is the regex for the whole construct and must start with some
+    literal text (e.g. "<import"), which is what the rewriter searches for.
+    replace(match, context) returns the text written in its place, or is a
+    plain string written every time. asset_group is the pattern group that
+    holds a file reference, for rules that inline files.
+    """
+
+    def __init__(self, name, pattern, replace, flags=0, asset_group=None):
+        self.name = name
+        self.pattern = re.compile(pattern, flags)
+        self.replace = replace
+        self.asset_group = asset_group
+        prefix = LITERAL_PREFIX_RE.match(pattern)
+        if not prefix:
+            raise ValueError(f"Rewrite rule '{name}' must start with literal text")
+        self.needle = prefix.group(0)
+        # Case-insensitive needles are found with a regex, or with str.find
+        # in a lower-cased copy of ASCII text, the rest with str.find
+        self.ignore_case = bool(flags & re.IGNORECASE)
+        self.needle_re = re.compile(re.escape(self.needle), re.IGNORECASE) if self.ignore_case else None
+
+    def positions(self, text, lower=None):
+        """Every index where this construct might start
+
+        lower is text.lower() if text is ASCII (same offsets, and the only
+        case folding re.IGNORECASE does there), else None.
+        """
+        if self.ignore_case:
+            if lower is None:
+                return [m.start() for m in self.needle_re.finditer(text)]
+            text, needle = lower, self.needle.lower()
+        else:
+            needle = self.needle
+        found = []
+        find = text.find
+        i = find(needle)
+        while i != -1:
+            found.append(i)
+            i = find(needle, i + 1)
+        return found
+
+
+class Rewriter:
+    """Rewrites a document for every rule in a single left-to-right pass.
+
+    Candidate positions for all rules are found with fast literal searches,
+    then visited in order: the matching rule's full pattern is tried there
+    and, if it matches, the text before it and its replacement go into one
+    output buffer. Nothing between HTMA constructs is copied more than once,
+    and adding a rule adds a literal search, not another pass that
+    rebuilds the document.
+
+    Each rule sees the original text, so the output is the same as running
+    the rules as separate re.sub passes unless one construct sits inside
+    another's tag (e.g. an <import> inside a <link ...>), or injected file
+    contents would themselves match a later rule.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+
+    def add_rule(self, rule):
+        """Return a new rewriter that also handles rule"""
+        return Rewriter(self.rules + [rule])
+
+    def scan(self, text):
+        """The (rule, match) pairs rewrite() replaces, in document order"""
+        rules = self.rules
+        count = len(rules)
+        lower = text.lower() if text.isascii() and any(rule.ignore_case for rule in rules) else None
+        # Each candidate is one int, position * count + rule index, so a
+        # plain sort puts them in document order and rule order at a
+        # position (one alternation regex of the needles scans slower than
+        # these literal searches)
+        candidates = []
+        for order, rule in enumerate(rules):
+            candidates.extend(pos * count + order for pos in rule.positions(text, lower))
+        candidates.sort()
+
+        matches = []
+        end = 0
+        for candidate in candidates:
+            pos, order = divmod(candidate, count)
+            if pos < end:
+                # Inside a construct that is already being replaced
+                continue
+            rule = rules[order]
+            match = rule.pattern.match(text, pos)
+            if match is not None:
+                matches.append((rule, match))
+                end = match.end()
+        return matches
+
+    def rewrite(self, text, context=None, matches=None):
+        """Replace every construct; pass matches if scan() already ran"""
+        context = context if context is not None else {}
+        if matches is None:
+            matches = self.scan(text)
+        if not matches:
+            return text
+
+        out = []
+        copied = 0
+        for rule, match in matches:
+            out.append(text[copied:match.start()])
+            out.append(rule.replace(match, context) if callable(rule.replace) else rule.replace)
+            copied = match.end()
+        out.append(text[copied:])
+        return "".join(out)
+
+
+def inline_file(kind, tag):
+    """Replacement that inlines the referenced file as <tag>...</tag>.
+
+    Files come from context["loader"], which rewrite_htma fills in one go
+    before the rewrite. If context["inlined"] is a set, each file is
+    inlined only at its first reference and later ones are dropped. With
+    context["tag_assets"] the inlined element records where it came from
+    in a data-htma-asset attribute, so it can be swapped in place later.
+    """
+    def replace(match, context):
+        ref = match.group(1)
+        if is_remote(ref):
+            return match.group(0)
+        paths = context.get("paths")
+        path = paths.get(ref) if paths is not None else None
+        if path is None:
+            path = context["base_path"] / ref
+        deps = context.get("deps")
+        if deps is not None:
+            deps.append(path)
+
+        asset = context["loader"].get(path)
+        if asset.error is not None:
+            print(f"Failed to inject {kind} {ref}: {asset.error}")
+            return match.group(0)
+        if asset.served:
+            # Left as a link; the window loads it through the asset handler
+            print(f"Serving {kind}: {ref}")
+            return match.group(0)
+        if asset.text is None:
+            return match.group(0)
+
+        inlined = context.get("inlined")
+        if inlined is not None:
+            if (tag, path) in inlined:
+                print(f"Dropped repeated {kind}: {ref}")
+                return ''
+            inlined.add((tag, path))
+        print(f"Injected {kind}: {ref}")
+        if context.get("tag_assets"):
+            return f'<{tag} data-htma-asset="{html.escape(ref)}">{asset.text}</{tag}>'
+        return f'<{tag}>{asset.text}</{tag}>'
+    return replace
+
+
+# The patterns are exactly the ones strip_htma_tags and inject_resources in
+# UI.py use, in the same order
+HTMA_RULES = [
+    RewriteRule("import", r'<import\s+[^>]*>', ''),
+    RewriteRule("display", r'<display\s+[^>]*>', ''),
+    RewriteRule("doctype", r'<!DOCTYPE\s+htma>', '<!DOCTYPE html>', re.IGNORECASE),
+    RewriteRule("htma-open", r'<htma>', '<html>', re.IGNORECASE),
+    RewriteRule("htma-close", r'</htma>', '</html>', re.IGNORECASE),
+    RewriteRule("css", r'<link\s+[^>]*href\s*=\s*["\']([^"\']+)["\'][^>]*>', inline_file("CSS", "style"),
+                asset_group=1),
+    RewriteRule("js", r'<script\s+[^>]*src\s*=\s*["\']([^"\']+)["\'][^>]*>\s*</script>', inline_file("JS", "script"),
+                asset_group=1),
+]
+
+HTMA_REWRITER = Rewriter(HTMA_RULES)
+
+
+def rewrite_htma(content, base_path, deps=None, rewriter=None, loader=None, dedupe=False, tag_assets=False):
+    """HTMA source to browser HTML: strip HTMA tags and inline CSS/JS files.
+
+    Every referenced file is collected first and the unique set is read in
+    parallel through loader (a new AssetLoader on the shared cache by
+    default). If deps is a list, every file the page refers to is appended
+    to it, whether or not it exists. dedupe inlines each file only once;
+    tag_assets marks inlined files with their source (see inline_file).
+    """
+    rewriter = rewriter or HTMA_REWRITER
+    loader = loader or AssetLoader()
+    base_path = Path(base_path)
+
+    with trace.span("scan htma tags") as span:
+        matches = rewriter.scan(content)
+        span.set(matches=len(matches))
+    # A page refers to the same few files many times: one Path each
+    refs = dict.fromkeys(match.group(rule.asset_group) for rule, match in matches if rule.asset_group)
+    paths = {ref: base_path / ref for ref in refs if not is_remote(ref)}
+    with trace.span("load assets", files=len(paths)):
+        loader.load(paths.values())
+
+    context = {"base_path": base_path, "deps": deps, "loader": loader, "inlined": set() if dedupe else None,
+               "tag_assets": tag_assets, "paths": paths}
+    with trace.span("rewrite"):
+        return rewriter.rewrite(content, context, matches)
@@ -0,0 +1,494 @@
+import codecs
+import heapq
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import HTMA_TRACE as trace
+from HTMA_PROC import ProcessWatch, priority_options, set_nice
+
+# Serialises echoed plugin output so lines from different plugins don't interleave
+OUTPUT_LOCK = threading.Lock()
+
+# Scripts that may read their stdin (a prompt, a stream) get a process of
+# their own: daemon workers have no stdin to give them
+STDIN_USE = {
+    ".py": re.compile(rb"\binput\s*\(|\bstdin\b"),
+    ".js": re.compile(rb"\bprocess\.stdin\b|\breadline\b"),
+}
+# (script path, mtime) -> whether the script reads stdin
+STDIN_CACHE = {}
+
+
+def script_command(script_path, metadata_arg):
+    """Return the command line for a plugin script, or None for unknown types"""
+    script = str(script_path)
+    if script.endswith('.py'):
+        return ["python", script, metadata_arg]
+    if script.endswith('.js'):
+        return ["node", script, metadata_arg]
+    return None
+
+
+def reads_stdin(script_path):
+    """Whether a plugin script looks like it reads its stdin"""
+    pattern = STDIN_USE.get(script_path.suffix)
+    if pattern is None:
+        return False
+    try:
+        key = (str(script_path), script_path.stat().st_mtime_ns)
+        if key not in STDIN_CACHE:
+            STDIN_CACHE[key] = pattern.search(script_path.read_bytes()) is not None
+        return STDIN_CACHE[key]
+    except OSError:
+        return False
+
+
+def feed_stdin(stream, data):
+    """Write data to a child's stdin and close it; the child may stop reading early"""
+    try:
+        stream.write(data)
+    except OSError:
+        pass
+    finally:
+        try:
+            stream.close()
+        except OSError:
+            pass
+
+
+class StreamCapture(threading.Thread):
+    """Drain one pipe of a plugin process, keeping and echoing what it writes.
+
+    Reading on a dedicated thread means a chatty plugin can never block on
+    a full pipe while we wait for the other stream or for the exit code.
+    """
+
+    def __init__(self, stream, prefix, echo_to=None):
+        super().__init__(daemon=True)
+        self.stream = stream
+        self.prefix = prefix
+        self.echo_to = echo_to
+        self.parts = []
+        self.at_line_start = True
+
+    def run(self):
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        try:
+            while True:
+                chunk = self.stream.read1(65536)
+                if not chunk:
+                    break
+                self.handle(decoder.decode(chunk))
+            self.handle(decoder.decode(b"", final=True))
+        finally:
+            self.stream.close()
+
+    def handle(self, text):
+        if not text:
+            return
+        self.parts.append(text)
+        if self.echo_to is None:
+            return
+        # Prefix every line with the plugin name; partial lines such as
+        # input() prompts are written straight away
+        out = []
+        for line in text.splitlines(keepends=True):
+            if self.at_line_start:
+                out.append(self.prefix)
+            out.append(line)
+            self.at_line_start = line.endswith("\n")
+        with OUTPUT_LOCK:
+            self.echo_to.write("".join(out))
+            self.echo_to.flush()
+
+    def text(self):
+        return "".join(self.parts)
+
+
+class ScriptResult:
+    """Outcome of one plugin script"""
+
+    def __init__(self, plugin, script, cmd):
+        self.plugin = plugin
+        self.script = script
+        self.cmd = cmd
+        self.returncode = None
+        self.stdout = ""
+        self.stderr = ""
+        self.duration = 0.0
+        self.timed_out = False
+        # Killed for using more memory than its limit allows
+        self.memory_exceeded = False
+        self.error = None
+        # HTMA_PROC.ProcessUsage for scripts run in their own process
+        self.usage = None
+
+    @property
+    def ok(self):
+        return self.error is None and not self.timed_out and not self.memory_exceeded and self.returncode == 0
+
+    def describe(self):
+        if self.error:
+            return f"failed to start: {self.error}"
+        if self.timed_out:
+            return "timed out"
+        if self.memory_exceeded:
+            return "killed, over its memory limit"
+        return f"exit code {self.returncode}"
+
+
+class PluginJob:
+    """One plugin and its scripts, run in order on a scheduler worker"""
+
+    def __init__(self, name, path, config, metadata_arg, stdin_data=None, metadata=None):
+        self.name = name
+        self.path = path
+        self.config = config
+        self.metadata_arg = metadata_arg
+        # Packed metadata fed to the script's stdin (stdin transport)
+        self.stdin_data = stdin_data
+        # What in-process plugins receive instead of the scheduler-wide dict
+        self.metadata = metadata
+
+        # Optional plugin.json keys controlling scheduling
+        self.after = list(config.get("after", []))
+        self.order = config.get("order", 0)
+        # "limits": {"timeout": s, "max_memory_mb": n, "nice": n}; a top-level
+        # "timeout" is the older spelling
+        self.limits = dict(config.get("limits", {}))
+        self.timeout = self.limits.get("timeout", config.get("timeout"))
+        if config.get("bridge", False):
+            # Bridge plugins serve the page for as long as its window is open
+            self.timeout = None
+        max_memory_mb = self.limits.get("max_memory_mb")
+        self.max_rss = int(max_memory_mb * 1024 * 1024) if max_memory_mb else None
+        self.nice = self.limits.get("nice", 0)
+
+        self.waiting = set()
+        self.dependents = []
+        self.status = "pending"  # pending, running, done, failed, skipped
+        self.reason = None
+        self.results = []
+        self.done = threading.Event()
+
+    @property
+    def failed(self):
+        return self.status in ("failed", "skipped")
+
+
+class PluginScheduler:
+    """Runs plugin jobs on a bounded worker pool, honouring order and dependencies.
+
+    plugin.json may declare "after": [names] to start a plugin only once the
+    named plugins have finished successfully, "order": n to start earlier
+    (lower) or later (higher) than other ready plugins, and "timeout": seconds
+    after which a script is killed. "limits" can also cap a script's memory
+    and lower its CPU priority; every script run in its own process is
+    watched for CPU time, peak memory and I/O (see HTMA_PROC.ProcessWatch).
+    """
+
+    def __init__(self, max_workers=None, echo=True, metadata=None, daemon=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.echo = echo
+        # Parsed metadata handed to in-process plugins
+        self.metadata = metadata or {}
+        # Optional HTMA_DAEMON.DaemonClient with warm python/node workers
+        self.daemon = daemon
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.ready = []
+        self.sequence = 0
+        self.running = 0
+        self.remaining = 0
+        self.executor = None
+        self.all_done = threading.Event()
+        # Plugins that already ran earlier (e.g. before a --watch rebuild)
+        # and count as finished dependencies
+        self.finished = set()
+
+    def add(self, name, path, config, metadata_arg, stdin_data=None, metadata=None):
+        """Queue a plugin; must be called before start()"""
+        job = PluginJob(name, path, config, metadata_arg, stdin_data, metadata)
+        self.jobs[name] = job
+        return job
+
+    def start(self):
+        """Resolve dependencies and begin running every queued plugin"""
+        for job in self.jobs.values():
+            for dep in job.after:
+                if dep in self.jobs and dep != job.name:
+                    job.waiting.add(dep)
+                    self.jobs[dep].dependents.append(job)
+                elif dep not in self.finished:
+                    print(f"Warning: Plugin '{job.name}' depends on '{dep}', which is not used on this page")
+
+        # Anything Kahn's algorithm cannot order is part of (or waits on) a cycle
+        pending = {name: len(job.waiting) for name, job in self.jobs.items()}
+        queue = [name for name, count in pending.items() if count == 0]
+        ordered = set()
+        while queue:
+            name = queue.pop()
+            ordered.add(name)
+            for dependent in self.jobs[name].dependents:
+                pending[dependent.name] -= 1
+                if pending[dependent.name] == 0:
+                    queue.append(dependent.name)
+
+        self.remaining = len(self.jobs)
+        self.executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="htma-plugin")
+        with self.lock:
+            for job in self.jobs.values():
+                if job.done.is_set():
+                    continue
+                if job.name not in ordered:
+                    self.settle(job, "skipped", "dependency cycle")
+                elif not job.waiting:
+                    self.push(job)
+            self.dispatch()
+            if self.remaining == 0:
+                self.close()
+
+    def push(self, job):
+        heapq.heappush(self.ready, (job.order, self.sequence, job.name))
+        self.sequence += 1
+
+    def dispatch(self):
+        """Start ready jobs while there are free workers (lock held)"""
+        while self.running < self.max_workers and self.ready:
+            job = self.jobs[heapq.heappop(self.ready)[2]]
+            job.status = "running"
+            self.running += 1
+            self.executor.submit(self.run_job, job)
+
+    def settle(self, job, status, reason=None):
+        """Mark a job finished and release or skip its dependents (lock held)"""
+        if job.done.is_set():
+            return
+        job.status = status
+        job.reason = reason
+        job.done.set()
+        self.remaining -= 1
+        for dependent in job.dependents:
+            if job.failed:
+                self.settle(dependent, "skipped", f"dependency '{job.name}' {status}")
+                continue
+            dependent.waiting.discard(job.name)
+            if not dependent.waiting:
+                self.push(dependent)
+
+    def close(self):
+        self.all_done.set()
+        self.executor.shutdown(wait=False)
+
+    def run_job(self, job):
+        status = "done"
+        reason = None
+        start = time.perf_counter()
+        try:
+            self.execute(job)
+            failures = [r for r in job.results if not r.ok]
+            if failures:
+                status = "failed"
+                reason = f"{failures[0].script}: {failures[0].describe()}"
+        except Exception as e:
+            status = "failed"
+            reason = str(e)
+        trace.complete(f"plugin {job.name}", start, time.perf_counter(), "plugin", status=status, reason=reason)
+        with self.lock:
+            self.running -= 1
+            self.settle(job, status, reason)
+            self.dispatch()
+            if self.remaining == 0:
+                self.close()
+
+    def execute(self, job):
+        """Run each script of a plugin in the order plugin.json lists them"""
+        scripts_found = False
+        for script in job.config.get("scripts", []):
+            script_path = job.path / script
+            if not script_path.exists():
+                continue
+            scripts_found = True
+
+            # Memory and priority limits need a process of the plugin's own
+            own_process = job.max_rss is not None or job.nice
+
+            # Warm workers that outlive this launch, when the daemon is enabled
+            if self.daemon is not None and not own_process:
+                with trace.span(f"{job.name}: {script}", "plugin", runner="daemon") as span:
+                    result = self.run_on_daemon(job, script, script_path)
+                    if result is not None:
+                        span.set(exit_code=result.returncode)
+                if result is not None:
+                    job.results.append(result)
+                    continue
+
+            # Opt-in: call the plugin's entry point without a new interpreter
+            if job.config.get("mode") == "inprocess" and script.endswith('.py') and not own_process:
+                from HTMA_INPROCESS import run_inprocess
+                metadata = job.metadata if job.metadata is not None else self.metadata
+                with trace.span(f"{job.name}: {script}", "plugin", runner="inprocess") as span:
+                    result = run_inprocess(job, script, script_path, metadata, self.echo)
+                    if result is not None:
+                        span.set(exit_code=result.returncode)
+                if result is not None:
+                    job.results.append(result)
+                    continue
+
+            cmd = script_command(script_path, job.metadata_arg)
+            if cmd is None:
+                print(f"Warning: Unknown script type: {script}")
+                continue
+            job.results.append(self.run_script(job, script, cmd))
+
+        if not scripts_found:
+            print(f"Warning: No scripts found for plugin '{job.name}'")
+
+    @staticmethod
+    def plugin_env(job):
+        """Environment for a plugin's processes: lets them import HTMA_ARGS
+        and tells them which plugin they run for"""
+        from HTMA_ARGS import RUNNING_PLUGIN_ENV
+        env = dict(os.environ)
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [script_dir, env.get("PYTHONPATH")]))
+        env[RUNNING_PLUGIN_ENV] = job.name
+        # Output reaches StreamCapture as it is printed, not when a pipe
+        # buffer fills or the plugin exits
+        env["PYTHONUNBUFFERED"] = "1"
+        return env
+
+    def run_script(self, job, script, cmd):
+        """Run one script to completion, capturing its output"""
+        result = ScriptResult(job.name, script, cmd)
+        start = time.perf_counter()
+        stdin = subprocess.PIPE if job.stdin_data is not None else None
+        try:
+            proc = subprocess.Popen(cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    env=self.plugin_env(job), **priority_options(job.nice))
+        except Exception as e:
+            result.error = str(e)
+            return result
+        set_nice(proc.pid, job.nice)
+        watch = ProcessWatch(proc, job.timeout, job.max_rss)
+        watch.start()
+        trace.complete(f"spawn {job.name}: {script}", start, time.perf_counter(), "plugin")
+
+        if job.stdin_data is not None:
+            threading.Thread(target=feed_stdin, args=(proc.stdin, job.stdin_data), daemon=True).start()
+
+        prefix = f"[{job.name}] "
+        readers = [
+            StreamCapture(proc.stdout, prefix, sys.stdout if self.echo else None),
+            StreamCapture(proc.stderr, prefix, sys.stderr if self.echo else None),
+        ]
+        for reader in readers:
+            reader.start()
+
+        result.returncode = watch.wait()
+        result.usage = watch.usage
+        result.timed_out = watch.killed_by == "timeout"
+        result.memory_exceeded = watch.killed_by == "memory"
+
+        for reader in readers:
+            reader.join()
+        result.stdout = readers[0].text()
+        result.stderr = readers[1].text()
+        end = time.perf_counter()
+        result.duration = end - start
+        trace.child_process(proc.pid, f"{job.name}: {script}", start, end, exit_code=result.returncode,
+                            timed_out=result.timed_out, memory_exceeded=result.memory_exceeded,
+                            cpu=result.usage.cpu, peak_rss=result.usage.peak_rss)
+        return result
+
+    def run_on_daemon(self, job, script, script_path):
+        """Hand one script to the worker daemon; None to run it here instead"""
+        if script.endswith('.py'):
+            runtime = "python"
+        elif script.endswith('.js'):
+            runtime = "node"
+        else:
+            return None
+        if job.config.get("bridge", False):
+            # Long-lived: it would hold a worker and hit the daemon's job timeout
+            return None
+        if job.stdin_data is not None or reads_stdin(script_path):
+            # Workers have no per-job stdin
+            return None
+        mode = job.config.get("mode", "subprocess")
+
+        result = ScriptResult(job.name, script, ["daemon", runtime, str(script_path)])
+        start = time.perf_counter()
+        reply = self.daemon.run({
+            "id": f"{job.name}/{script}",
+            "plugin": job.name,
+            "runtime": runtime,
+            "script": str(script_path),
+            "argv": [job.metadata_arg],
+            "cwd": os.getcwd(),
+            "mode": mode,
+            "entry": job.config.get("entry"),
+            # Packed transports: the worker opens the metadata from argv itself
+            "metadata": None if job.metadata is not None else self.metadata if mode == "inprocess" else {},
+            "timeout": job.timeout,
+        })
+        if reply is None:
+            return None
+
+        result.returncode = reply.get("returncode")
+        result.timed_out = reply.get("timed_out", False)
+        result.stdout = reply.get("stdout", "")
+        result.stderr = reply.get("stderr", "")
+        result.duration = time.perf_counter() - start
+        if self.echo:
+            prefix = f"[{job.name}] "
+            StreamCapture(None, prefix, sys.stdout).handle(result.stdout)
+            StreamCapture(None, prefix, sys.stderr).handle(result.stderr)
+        return result
+
+    def wait(self, names=None, timeout=None):
+        """Block until the named plugins (default: all) have finished"""
+        if names is None:
+            return self.all_done.wait(timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for name in names:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            if not self.jobs[name].done.wait(remaining):
+                return False
+        return True
+
+    def report(self):
+        """Print a summary line for every plugin and script"""
+        print(f"\n{'='*50}")
+        print("Plugin results")
+        for job in self.jobs.values():
+            line = f"{job.name}: {job.status}"
+            if job.reason:
+                line += f" ({job.reason})"
+            print(line)
+            for result in job.results:
+                line = f"  {result.script}: {result.describe()} in {result.duration:.2f}s"
+                if result.usage is not None:
+                    line += f" ({result.usage.describe()})"
+                print(line)
+        self.report_usage()
+
+    def report_usage(self):
+        """One line of totals over every plugin process, naming the heaviest"""
+        measured = [result for job in self.jobs.values() for result in job.results if result.usage is not None]
+        if not measured:
+            return
+        cpu = sum(result.usage.cpu or 0 for result in measured)
+        busiest = max(measured, key=lambda result: result.usage.cpu or 0)
+        largest = max(measured, key=lambda result: result.usage.peak_rss or 0)
+        line = f"Plugin processes: {len(measured)}, cpu {cpu:.2f}s in total"
+        if busiest.usage.cpu:
+            line += f"; most cpu: {busiest.plugin}/{busiest.script} ({busiest.usage.cpu:.2f}s)"
+        if largest.usage.peak_rss:
+            line += f"; most memory: {largest.plugin}/{largest.script} ({largest.usage.peak_rss / (1024 * 1024):.1f} MB)"
+        print(line)
@@ -0,0 +1,185 @@
+import atexit
+import os
+import shutil
+import signal
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from HTMA_PROC import pid_alive
+
+SESSION_PREFIX = "session-"
+OWNER_PREFIX = "owner-"
+
+# Loose *.TMP files from before sessions existed are removed after this long
+STALE_TMP_AGE = 24 * 60 * 60
+
+
+def tmp_root(script_dir, backing="disk"):
+    """Directory that holds session directories for the configured backing.
+
+    "disk" is TMP/ next to the scripts, "memory" a RAM-backed filesystem
+    where the OS has one (/dev/shm, so Linux and similar only), and any
+    other value a directory path, e.g. a RAM disk drive on Windows.
+    """
+    if backing in (None, "disk"):
+        return Path(script_dir) / "TMP"
+    if backing == "memory":
+        if os.path.isdir("/dev/shm"):
+            return Path("/dev/shm") / "htma-plus"
+        print('Warning: No RAM-backed filesystem found, using TMP/ on disk '
+              '(set tmp_backing to the folder of a RAM disk instead, e.g. "R:\\htma")')
+        return Path(script_dir) / "TMP"
+    return Path(backing)
+
+
+def owners(session_dir):
+    """Pids that registered an interest in a session directory"""
+    pids = []
+    try:
+        entries = os.listdir(session_dir)
+    except OSError:
+        return pids
+    for name in entries:
+        if name.startswith(OWNER_PREFIX):
+            try:
+                pids.append(int(name[len(OWNER_PREFIX):]))
+            except ValueError:
+                pass
+    return pids
+
+
+def sweep(root, loose_files=False):
+    """Remove sessions whose owners have all exited
+
+    With loose_files, *.TMP files older than STALE_TMP_AGE are removed as
+    well: only for TMP/ next to the scripts, where runs from before
+    sessions existed left them. Any other root may be shared with other
+    programs, so only session directories are touched there.
+    """
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        return 0
+    removed = 0
+    now = time.time()
+    for entry in entries:
+        try:
+            if entry.name.startswith(SESSION_PREFIX) and entry.is_dir():
+                pids = owners(entry.path)
+                if not pids and now - entry.stat().st_mtime < 60:
+                    # Just created, its owner has not registered yet
+                    continue
+                if not any(pid_alive(pid) for pid in pids):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    removed += 1
+            elif loose_files and entry.name.endswith(".TMP") and entry.is_file():
+                if now - entry.stat().st_mtime > STALE_TMP_AGE:
+                    os.unlink(entry.path)
+                    removed += 1
+        except OSError:
+            continue
+    if removed:
+        print(f"Swept {removed} stale TMP entries")
+    return removed
+
+
+class Session:
+    """A per-run TMP directory that is deleted in one go when the run ends.
+
+    Every process using the directory leaves an owner-<pid> marker in it.
+    release() removes the caller's marker and deletes the whole directory
+    once no living owner is left. Release happens on normal exit, on
+    unhandled exceptions and on SIGTERM; sessions left behind by killed
+    processes are collected by sweep() on the next launch.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.released = False
+        self.lock = threading.Lock()
+
+    @classmethod
+    def create(cls, root, loose_files=False):
+        """Sweep stale sessions under root and start a new one (see sweep)"""
+        root = Path(root)
+        root.mkdir(parents=True, exist_ok=True)
+        sweep(root, loose_files)
+        session = cls(root / f"{SESSION_PREFIX}{os.getpid()}-{uuid.uuid4().hex[:12]}")
+        session.path.mkdir()
+        session.join()
+        return session
+
+    @classmethod
+    def open(cls, path):
+        """Join a session created by another process (e.g. the one that launched us)"""
+        session = cls(path)
+        if session.path.is_dir():
+            session.join()
+        return session
+
+    def marker(self, pid):
+        return self.path / f"{OWNER_PREFIX}{pid}"
+
+    def join(self):
+        self.attach(os.getpid())
+        install_signal_handlers()
+        SESSIONS.append(self)
+
+    def attach(self, pid):
+        """Keep the session alive for another process as well"""
+        try:
+            self.marker(pid).touch()
+        except OSError as e:
+            print(f"Warning: Could not register TMP session owner: {e}")
+
+    def release(self):
+        """Drop this process's claim; delete the session if nobody else holds one"""
+        with self.lock:
+            if self.released:
+                return
+            self.released = True
+            try:
+                SESSIONS.remove(self)
+            except ValueError:
+                pass
+            try:
+                self.marker(os.getpid()).unlink()
+            except OSError:
+                pass
+            if any(pid != os.getpid() and pid_alive(pid) for pid in owners(self.path)):
+                return
+            shutil.rmtree(self.path, ignore_errors=True)
+
+
+# Sessions this process joined and has not released yet (a host process
+# joins one per window), released at exit and by the signal handler
+SESSIONS = []
+HANDLERS_INSTALLED = False
+
+
+def release_sessions():
+    for session in list(SESSIONS):
+        session.release()
+
+
+atexit.register(release_sessions)
+
+
+def release_all(signum, frame):
+    release_sessions()
+    sys.exit(128 + signum)
+
+
+def install_signal_handlers():
+    """Release sessions when the process is asked to terminate"""
+    global HANDLERS_INSTALLED
+    if HANDLERS_INSTALLED or threading.current_thread() is not threading.main_thread():
+        return
+    HANDLERS_INSTALLED = True
+    for name in ("SIGTERM", "SIGHUP", "SIGBREAK"):
+        signum = getattr(signal, name, None)
+        if signum is not None and signal.getsignal(signum) in (signal.SIG_DFL, None):
+            signal.signal(signum, release_all)
@@ -0,0 +1,75 @@
+import json
+from pathlib import Path
+
+# Built-in defaults, overridden by settings.json next to HTMA_PARSE.py
+DEFAULTS = {
+    # Most plugins running at once; None uses the number of cores
+    "max_workers": None,
+    # Hold the window until every rts plugin has finished
+    "wait_for_plugins": False,
+    # How plugins get metadata and args: "files" (one TMP file per arg),
+    # "stdin" or "shm" (one packed buffer, read with HTMA_ARGS.load_metadata)
+    "metadata_transport": "files",
+    # Where per-run TMP sessions live: "disk" (TMP/), "memory" (/dev/shm, not
+    # on Windows) or a directory path such as a folder on a RAM disk
+    "tmp_backing": "disk",
+    # Remember where plugin blocks are so only changed parts of a page are
+    # parsed again
+    "parse_index": True,
+    # Documents this many megabytes or larger are parsed from a memory map
+    # and their args written straight from it, instead of being read into
+    # memory whole; 0 always reads them
+    "mmap_parse_mb": 64,
+    # Keep arg files between runs (up to this many megabytes) so unchanged
+    # args are not written again; 0 writes them into the TMP session, which
+    # is removed as a whole when the run ends
+    "arg_store_mb": 0,
+    # Reuse the compiled HTML of unchanged pages between launches
+    "page_cache": True,
+    # Size limit of the compiled page cache in megabytes
+    "page_cache_mb": 64,
+    # Inline a CSS/JS file linked several times only at its first link
+    "dedupe_assets": False,
+    # Drop comments and extra whitespace from compiled pages
+    "minify_html": False,
+    # "inline" puts every linked CSS/JS file into the page; "serve" inlines
+    # only files up to inline_max_bytes and lets the window fetch the rest
+    "asset_mode": "inline",
+    "inline_max_bytes": 64 * 1024,
+    # Hand plugin scripts to warm workers in a background daemon
+    "daemon": False,
+    # Seconds without work before the daemon exits
+    "daemon_idle_timeout": 600,
+    # Pre-started workers per runtime
+    "daemon_python_workers": 2,
+    "daemon_node_workers": 1,
+    # Workers using more memory than this after a job are replaced
+    "daemon_worker_max_mb": 512,
+    # Open pages as windows of one resident process instead of a new
+    # process (and WebView engine) per launch
+    "host": False,
+    # Seconds the host stays up with no window open; 0 exits with the last one
+    "host_idle_timeout": 300,
+}
+
+
+def load_settings(script_dir=None):
+    """Return DEFAULTS merged with settings.json, if one exists"""
+    settings = dict(DEFAULTS)
+    if script_dir is None:
+        script_dir = Path(__file__).parent.resolve()
+    settings_file = Path(script_dir) / "settings.json"
+
+    if settings_file.exists():
+        try:
+            with open(settings_file, "r", encoding="utf-8") as f:
+                user_settings = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not read {settings_file.name}: {e}")
+            return settings
+        if isinstance(user_settings, dict):
+            for key, value in user_settings.items():
+                if key not in DEFAULTS:
+                    print(f"Warning: Unknown setting '{key}'")
+                settings[key] = value
+    return settings
@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+import time
+
+# The active Tracer, or None when tracing is off. Every function below
+# checks it first, so untraced launches pay one global lookup per call.
+TRACER = None
+
+# Row the WebView's own page timings are drawn on
+WEBVIEW_TID = 1
+
+
+class Tracer:
+    """Timed events of one launch in Chrome's trace-event format.
+
+    Timestamps are microseconds since the tracer was created, on the
+    perf_counter clock. Wall-clock times (e.g. from the WebView's
+    performance.timing) are placed on the same timeline through the
+    time.time() taken at that moment. Load the saved file in
+    chrome://tracing or https://ui.perfetto.dev.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.origin_epoch = time.time()
+        self.pid = os.getpid()
+        self.events = []
+        self.lock = threading.Lock()
+        self.threads = set()
+        self.process_name(self.pid, "htma+")
+
+    def ts(self, perf_seconds=None):
+        """Trace timestamp of a perf_counter() value (default: now)"""
+        if perf_seconds is None:
+            perf_seconds = time.perf_counter()
+        return (perf_seconds - self.origin) * 1e6
+
+    def epoch_ts(self, epoch_seconds):
+        """Trace timestamp of a time.time() value"""
+        return (epoch_seconds - self.origin_epoch) * 1e6
+
+    def add(self, event):
+        if "tid" not in event:
+            thread = threading.current_thread()
+            event["tid"] = thread.ident
+            if thread.ident not in self.threads:
+                self.threads.add(thread.ident)
+                self.add({"ph": "M", "name": "thread_name", "pid": self.pid, "tid": thread.ident,
+                          "args": {"name": thread.name}})
+        event.setdefault("pid", self.pid)
+        with self.lock:
+            self.events.append(event)
+
+    def process_name(self, pid, name):
+        self.add({"ph": "M", "name": "process_name", "pid": pid, "tid": pid, "args": {"name": name}})
+
+    def save(self, path):
+        with self.lock:
+            events = list(self.events)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        print(f"Wrote trace: {path} ({len(events)} events)")
+
+
+class Span:
+    """A phase timed from __enter__ to __exit__; set() adds details to it"""
+
+    __slots__ = ("name", "cat", "args", "start")
+
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = f"{exc_type.__name__}: {exc}"
+        complete(self.name, self.start, time.perf_counter(), self.cat, **self.args)
+        return False
+
+
+class NullSpan:
+    """Stands in for Span when tracing is off"""
+
+    __slots__ = ()
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def enable():
+    """Start recording; events before this call are not kept"""
+    global TRACER
+    if TRACER is None:
+        TRACER = Tracer()
+    return TRACER
+
+
+def enabled():
+    return TRACER is not None
+
+
+def span(name, cat="htma", **args):
+    """Context manager timing one phase: with span("parse"): ..."""
+    if TRACER is None:
+        return NULL_SPAN
+    return Span(name, cat, args)
+
+
+def complete(name, start, end, cat="htma", pid=None, tid=None, **args):
+    """Record a phase that ran between two perf_counter() values"""
+    if TRACER is None:
+        return
+    event = {"ph": "X", "name": name, "cat": cat, "ts": TRACER.ts(start), "dur": (end - start) * 1e6,
+             "args": args}
+    if pid is not None:
+        event["pid"] = pid
+        event["tid"] = pid if tid is None else tid
+    TRACER.add(event)
+
+
+def instant(name, cat="htma", **args):
+    """Record a moment, e.g. the page finishing loading"""
+    if TRACER is None:
+        return
+    TRACER.add({"ph": "i", "s": "p", "name": name, "cat": cat, "ts": TRACER.ts(), "args": args})
+
+
+def child_process(pid, name, start, end, cat="plugin", **args):
+    """Record the lifetime of a child process on its own row"""
+    if TRACER is None:
+        return
+    TRACER.process_name(pid, name)
+    complete(name, start, end, cat, pid=pid, **args)
+
+
+def page_timing(timing):
+    """Record a page's performance.timing (epoch milliseconds) as spans"""
+    if TRACER is None:
+        return
+    phases = [
+        ("navigation", "navigationStart", "loadEventEnd"),
+        ("fetch", "fetchStart", "responseEnd"),
+        ("dom parsing", "domLoading", "domInteractive"),
+        ("DOMContentLoaded", "domContentLoadedEventStart", "domContentLoadedEventEnd"),
+        ("dom complete", "domInteractive", "domComplete"),
+        ("load event", "loadEventStart", "loadEventEnd"),
+    ]
+    TRACER.add({"ph": "M", "name": "thread_name", "pid": TRACER.pid, "tid": WEBVIEW_TID,
+                "args": {"name": "webview page"}})
+    for label, first, last in phases:
+        begin, finish = timing.get(first), timing.get(last)
+        if not begin or not finish or finish < begin:
+            continue
+        TRACER.add({"ph": "X", "name": label, "cat": "webview", "tid": WEBVIEW_TID,
+                    "ts": TRACER.epoch_ts(begin / 1000), "dur": (finish - begin) * 1000, "args": {}})
+
+
+def save(path):
+    if TRACER is not None:
+        TRACER.save(path)
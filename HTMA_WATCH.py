@@ -0,0 +1,283 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+from pathlib import Path
+
+from HTMA_ASSETS import ASSET_CACHE, is_remote
+from HTMA_IMPORT import imported_files
+from HTMA_LEX import lex_plugin_blocks
+from HTMA_REWRITE import HTMA_REWRITER
+
+# Seconds between polls, and how long files must stay unchanged before a
+# batch of changes is acted on
+POLL_INTERVAL = 0.25
+DEBOUNCE = 0.3
+
+# Replaces a stylesheet in the open page without reloading it. Inlined
+# sheets are found by their data-htma-asset attribute, linked ones by href.
+CSS_SWAP_JS = """(function (ref, css) {
+    document.querySelectorAll("style[data-htma-asset]").forEach(function (style) {
+        if (css !== null && style.getAttribute("data-htma-asset") === ref) {
+            style.textContent = css;
+        }
+    });
+    document.querySelectorAll("link[href]").forEach(function (link) {
+        if (link.getAttribute("href").split("?")[0] === ref) {
+            link.setAttribute("href", ref + "?htma=" + Date.now());
+        }
+    });
+})(%s, %s);"""
+
+
+def signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def folder_paths(folder):
+    """A plugin folder, its subfolders and every file in them"""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(folder):
+        dirnames[:] = [d for d in dirnames if d != "__pycache__"]
+        paths.append(Path(dirpath))
+        paths.extend(Path(dirpath) / name for name in filenames)
+    return paths
+
+
+def plugin_signatures(content):
+    """Hash of every plugin's function bodies on the page, by plugin name"""
+    digests = {}
+    for block in lex_plugin_blocks(content):
+        digest = digests.setdefault(block.name, hashlib.sha256())
+        digest.update(f"{block.kind}\0".encode("utf-8"))
+        digest.update(block.body(content).encode("utf-8"))
+        digest.update(b"\0")
+    return {name: digest.hexdigest() for name, digest in digests.items()}
+
+
+def with_dependents(plugin_list, names):
+    """names plus every plugin that runs after one of them, transitively"""
+    names = set(names)
+    grew = True
+    while grew:
+        grew = False
+        for plugin in plugin_list:
+            if plugin["name"] not in names and names.intersection(plugin["config"].get("after", [])):
+                names.add(plugin["name"])
+                grew = True
+    return names
+
+
+class FileWatcher(threading.Thread):
+    """Polls a set of files and reports changes in coalesced batches.
+
+    A burst of saves is collected until nothing has changed for DEBOUNCE
+    seconds, then callback(changed_paths) is called once from this thread.
+    """
+
+    def __init__(self, paths, callback, interval=POLL_INTERVAL, debounce=DEBOUNCE):
+        super().__init__(name="htma-watch", daemon=True)
+        self.callback = callback
+        self.interval = interval
+        self.debounce = debounce
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.signatures = {}
+        self.set_paths(paths)
+
+    def set_paths(self, paths):
+        """Replace the watched set; files already watched keep their last state"""
+        with self.lock:
+            old = self.signatures
+            self.signatures = {}
+            for path in paths:
+                path = Path(path)
+                self.signatures[path] = old[path] if path in old else signature(path)
+
+    def poll(self):
+        changed = set()
+        with self.lock:
+            for path, old in self.signatures.items():
+                new = signature(path)
+                if new != old:
+                    self.signatures[path] = new
+                    changed.add(path)
+        return changed
+
+    def run(self):
+        pending = set()
+        last_change = 0.0
+        while not self.stopped.wait(self.interval):
+            changed = self.poll()
+            now = time.monotonic()
+            if changed:
+                pending |= changed
+                last_change = now
+            elif pending and now - last_change >= self.debounce:
+                batch, pending = pending, set()
+                try:
+                    self.callback(batch)
+                except Exception as e:
+                    print(f"Watch: Rebuild failed: {e}")
+                    traceback.print_exc()
+
+    def stop(self):
+        self.stopped.set()
+
+
+class LiveReload:
+    """Keeps an open window in sync with the files it was built from.
+
+    Watches the .htma file, the fragments it imports, every CSS/JS file it
+    links and the folders of the plugins it uses, and redoes only what a
+    change affects:
+      - a linked stylesheet is swapped into the page with RunScript
+      - the page or a linked script is recompiled and shown with SetPage
+      - plugins whose function body or folder (plugin.json, scripts)
+        changed are run again, together with plugins that run after them
+    """
+
+    def __init__(self, htma_file, content, registry, make_parser, compile_page):
+        self.htma_file = Path(htma_file).resolve()
+        self.base_path = self.htma_file.parent
+        self.content = content
+        self.registry = registry
+        # make_parser() returns a fresh HTMAParser for re-running plugins,
+        # compile_page(content) the HTML to show
+        self.make_parser = make_parser
+        self.compile_page = compile_page
+        self.plugin_hashes = plugin_signatures(content)
+        self.frame = None
+        self.watcher = None
+        self.runs = []
+        self.scan_page()
+
+    def scan_page(self):
+        """Find the assets and plugin folders of the current content"""
+        self.deps = set()
+        self.css_refs = {}
+        for rule, match in HTMA_REWRITER.scan(self.content):
+            if not rule.asset_group:
+                continue
+            ref = match.group(rule.asset_group)
+            if is_remote(ref):
+                continue
+            path = self.base_path / ref
+            self.deps.add(path)
+            if rule.name == "css":
+                self.css_refs[path] = ref
+
+        self.plugin_folders = {}
+        for block in lex_plugin_blocks(self.content):
+            entry = self.registry.get(block.name, block.kind)
+            if entry is not None:
+                self.plugin_folders[Path(entry["path"])] = block.name
+
+        # Imported fragments are part of the page
+        self.fragments = set(imported_files(self.htma_file))
+
+    def watched_paths(self):
+        paths = [self.htma_file]
+        paths.extend(self.fragments)
+        paths.extend(self.deps)
+        for folder in self.plugin_folders:
+            paths.extend(folder_paths(folder))
+        return paths
+
+    def start(self, frame):
+        """Begin watching; called once the window exists"""
+        self.frame = frame
+        self.watcher = FileWatcher(self.watched_paths(), self.on_change)
+        self.watcher.start()
+        print(f"Watching {self.htma_file.name} for changes")
+
+    def stop(self):
+        """Stop watching and wait for plugins started by a rebuild"""
+        if self.watcher:
+            self.watcher.stop()
+            self.watcher.join()
+        for thread in self.runs:
+            thread.join()
+
+    def on_change(self, changed):
+        names = sorted(path.name for path in changed)
+        print(f"\nChanged: {', '.join(names)}")
+
+        page_changed = self.htma_file in changed or bool(changed & self.fragments)
+        if page_changed:
+            from UI import read_document
+            self.content = read_document(self.htma_file)
+
+        # Plugins to run again: changed bodies and changed plugin folders
+        plugins = set()
+        for folder, name in self.plugin_folders.items():
+            if any(path == folder or folder in path.parents for path in changed):
+                plugins.add(name)
+        if page_changed:
+            hashes = plugin_signatures(self.content)
+            plugins.update(name for name, digest in hashes.items() if self.plugin_hashes.get(name) != digest)
+            self.plugin_hashes = hashes
+
+        assets = changed & self.deps
+        if page_changed or any(path not in self.css_refs for path in assets):
+            self.reload_page()
+        else:
+            for path in assets:
+                self.swap_css(path)
+
+        if page_changed:
+            self.scan_page()
+        # Also picks up files added to plugin folders
+        self.watcher.set_paths(self.watched_paths())
+        if plugins:
+            self.rerun_plugins(plugins)
+
+    def reload_page(self):
+        from HTMA_WINDOW import wx
+        html_content = self.compile_page(self.content)
+        print("Reloading page")
+        wx.CallAfter(self.frame.reload_page, html_content)
+
+    def swap_css(self, path):
+        from HTMA_WINDOW import wx
+        asset = ASSET_CACHE.read(path)
+        if asset.error is not None:
+            print(f"Watch: Could not read {path.name}: {asset.error}")
+            return
+        ref = self.css_refs[path]
+        print(f"Hot-swapping CSS: {ref}")
+        wx.CallAfter(self.frame.run_script, CSS_SWAP_JS % (json.dumps(ref), json.dumps(asset.text)))
+
+    def rerun_plugins(self, names):
+        parser = self.make_parser()
+        plugin_list = parser.parse_plugin_calls(self.content)
+        names = with_dependents(plugin_list, names)
+        selected = [plugin for plugin in plugin_list if plugin["name"] in names]
+        if not selected:
+            return
+        print(f"Re-running plugins: {', '.join(plugin['name'] for plugin in selected)}")
+        parser.metadata["window:file"] = str(parser.htma_file)
+        if getattr(self.frame, "bridge", None):
+            # Re-run bridge plugins reconnect to the window's bridge, replacing
+            # the old process's connection (which makes it stop serving)
+            parser.metadata.update(self.frame.bridge.metadata())
+        parser.prepare_transports(selected)
+        parser.execute_plugins(selected, finished=[p["name"] for p in plugin_list if p["name"] not in names])
+
+        thread = threading.Thread(target=self.finish_run, args=(parser,), name="htma-rerun", daemon=True)
+        thread.start()
+        self.runs = [run for run in self.runs if run.is_alive()] + [thread]
+
+    @staticmethod
+    def finish_run(parser):
+        parser.wait_for_plugins()
+        parser.scheduler.report()
+        parser.close_transports()
+        if parser.session:
+            parser.session.release()
@@ -0,0 +1,242 @@
+import io
+import json
+import mimetypes
+import mmap
+import os
+import sys
+import time
+from email.utils import formatdate
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+
+import HTMA_TRACE as trace
+
+# Only imported once we know a window will be shown, so headless runs and
+# batch tools never pay for loading wx
+try:
+    import wx
+    import wx.html2 as webview
+except ImportError:
+    print("ERROR: wxPython not installed!")
+    print("Install with: pip install wxPython")
+    sys.exit(1)
+
+
+# URL scheme the page directory is served under in asset_mode "serve"
+ASSET_SCHEME = "htma"
+# Assets from this size on are memory-mapped rather than read into memory
+MMAP_MIN_BYTES = 1024 * 1024
+# Seconds the webview may reuse an asset before asking for it again
+ASSET_MAX_AGE = 60
+
+
+def open_asset(path):
+    """Read-only file-like object over an asset, memory-mapped when large"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size >= MMAP_MIN_BYTES:
+            # The mapping stays valid after the file is closed
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return io.BytesIO(f.read())
+
+
+if hasattr(webview, "WebViewHandlerResponseData"):
+    class AssetResponseData(webview.WebViewHandlerResponseData):
+        """An asset for WebViewHandlerResponse.Finish, which takes response
+        data (or a str) rather than a file object"""
+
+        def __init__(self, stream):
+            super().__init__()
+            self.stream = stream
+
+        def GetStream(self):
+            return self.stream
+else:
+    # wxPython before 4.2: no backend calls StartRequest
+    AssetResponseData = None
+
+
+class AssetHandler(webview.WebViewHandler):
+    """Serves files under the page directory to the webview on request.
+
+    Registered for ASSET_SCHEME; the page is loaded with base_url() as its
+    base so relative links (and anything not inlined) resolve to it.
+    """
+
+    def __init__(self, root):
+        super().__init__(ASSET_SCHEME)
+        self.root = Path(root).resolve()
+
+    def base_url(self):
+        # Edge only hands custom schemes to handlers under a virtual https host
+        edge = getattr(webview, "WebViewBackendEdge", None)
+        if os.name == "nt" and edge is not None and webview.WebView.IsBackendAvailable(edge):
+            host = self.GetVirtualHost() if hasattr(self, "GetVirtualHost") else f"{ASSET_SCHEME}.wxsite"
+            return f"https://{host}/"
+        return f"{ASSET_SCHEME}:///"
+
+    def resolve(self, uri):
+        """The file a request is for, or None if it is outside the page directory"""
+        path = (self.root / unquote(urlsplit(uri).path).lstrip("/")).resolve()
+        if self.root not in path.parents or not path.is_file():
+            return None
+        return path
+
+    def GetFile(self, uri):
+        path = self.resolve(uri)
+        if path is None:
+            return None
+        mime = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        modified = wx.DateTime.FromTimeT(int(path.stat().st_mtime))
+        return wx.FSFile(open_asset(path), uri, mime, "", modified)
+
+    def StartRequest(self, request, response):
+        # Backends that pass full requests (Edge) also get caching headers
+        path = self.resolve(request.GetURI())
+        if path is None:
+            response.FinishWithError()
+            return
+        st = path.stat()
+        response.SetContentType(mimetypes.guess_type(path.name)[0] or "application/octet-stream")
+        response.SetHeader("Cache-Control", f"max-age={ASSET_MAX_AGE}")
+        response.SetHeader("Last-Modified", formatdate(st.st_mtime, usegmt=True))
+        response.SetHeader("ETag", f'"{st.st_mtime_ns:x}-{st.st_size:x}"')
+        response.Finish(AssetResponseData(open_asset(path)))
+
+
+class HTMAFrame(wx.Frame):
+    def __init__(self, title, html_content, tmp_file=None, session=None, on_loaded=None, asset_root=None,
+                 bridge=None, on_closed=None):
+        super().__init__(None, title=title, size=(800, 600))
+        
+        # Individual TMP files from older launchers, plus the TMP session
+        if isinstance(tmp_file, (list, tuple)):
+            self.tmp_files = list(tmp_file)
+        else:
+            self.tmp_files = [tmp_file] if tmp_file else []
+        self.session = session
+        self.on_loaded = on_loaded
+        # Called after this window's own cleanup (e.g. by HTMA_HOST)
+        self.on_closed = on_closed
+        # The page's own load timings go into the trace once
+        self.trace_timing = trace.enabled()
+        
+        # Create webview
+        self.browser = webview.WebView.New(self)
+        if on_loaded or self.trace_timing:
+            self.browser.Bind(webview.EVT_WEBVIEW_LOADED, self.on_page_loaded)
+        
+        # Serve the page directory for assets that were not inlined
+        self.base_url = ""
+        self.asset_handler = None
+        if asset_root is not None:
+            self.asset_handler = AssetHandler(asset_root)
+            self.browser.RegisterHandler(self.asset_handler)
+            self.base_url = self.asset_handler.base_url()
+        
+        # Page <-> plugin messages (HTMA_BRIDGE), when a plugin asked for them
+        self.bridge = None
+        self.inline_shim = False
+        if bridge is not None:
+            self.attach_bridge(bridge)
+        html_content = self.with_shim(html_content)
+        
+        # Load HTML content directly (small resources are injected)
+        trace.instant("SetPage", "ui", characters=len(html_content))
+        self.browser.SetPage(html_content, self.base_url)
+        
+        # Center window
+        self.Centre()
+        
+        # Bind close event to cleanup
+        self.Bind(wx.EVT_CLOSE, self.on_close)
+    
+    def reload_page(self, html_content):
+        """Show a recompiled page (GUI thread only, e.g. via wx.CallAfter)"""
+        trace.instant("SetPage", "ui", characters=len(html_content))
+        self.browser.SetPage(self.with_shim(html_content), self.base_url)
+    
+    def attach_bridge(self, bridge):
+        """Route the page's htma.call() messages to bridge and its replies back"""
+        from HTMA_BRIDGE import PAGE_HANDLER, PAGE_SHIM
+        add_handler = getattr(self.browser, "AddScriptMessageHandler", None)
+        if add_handler is None or not add_handler(PAGE_HANDLER):
+            print("Warning: This WebView cannot receive messages from the page (needs wxPython 4.2); "
+                  "plugin bridge disabled")
+            return
+        self.bridge = bridge
+        self.browser.Bind(webview.EVT_WEBVIEW_SCRIPT_MESSAGE_RECEIVED, self.on_script_message)
+        # A user script runs before the page's own scripts on every load;
+        # without support for them the shim goes at the top of the HTML
+        add_script = getattr(self.browser, "AddUserScript", None)
+        self.inline_shim = add_script is None or not add_script(PAGE_SHIM)
+        bridge.attach(wx.CallAfter, self.run_script)
+    
+    def with_shim(self, html_content):
+        if not self.inline_shim:
+            return html_content
+        from HTMA_BRIDGE import PAGE_SHIM
+        return f"<script>{PAGE_SHIM}</script>{html_content}"
+    
+    def on_script_message(self, event):
+        self.bridge.from_page(event.GetString())
+    
+    def run_script(self, script):
+        """Run JavaScript in the current page (GUI thread only)"""
+        self.browser.RunScript(script)
+    
+    def on_page_loaded(self, event):
+        """Report the first paint once, then stop listening"""
+        trace.instant("webview loaded", "ui")
+        if self.trace_timing:
+            self.trace_timing = False
+            self.trace_page_timing()
+        callback, self.on_loaded = self.on_loaded, None
+        if callback:
+            callback()
+        event.Skip()
+    
+    def trace_page_timing(self):
+        """Put the page's performance.timing on the trace timeline"""
+        try:
+            # wxPython 4.1+ returns (success, result); older versions only success
+            reply = self.browser.RunScript("JSON.stringify(performance.timing)")
+            if isinstance(reply, tuple) and reply[0]:
+                trace.page_timing(json.loads(reply[1]))
+        except Exception as e:
+            print(f"Warning: Could not read page timing: {e}")
+    
+    def on_close(self, event):
+        """Cleanup TMP files on close"""
+        for tmp_file in self.tmp_files:
+            if Path(tmp_file).exists():
+                try:
+                    Path(tmp_file).unlink()
+                    print(f"Deleted TMP file: {tmp_file}")
+                except Exception as e:
+                    print(f"Failed to delete TMP file: {e}")
+        if self.session:
+            self.session.release()
+            print(f"Released TMP session: {self.session.path.name}")
+        if self.bridge:
+            # Plugins serving the page see the connection close and finish
+            self.bridge.close()
+        if self.on_closed:
+            self.on_closed()
+        self.Destroy()
+
+
+def show_window(title, html_content, tmp_file=None, session=None, on_loaded=None, asset_root=None,
+                on_start=None, bridge=None):
+    """Open one window and run the GUI loop until it is closed
+    
+    on_start(frame) is called once the window is shown.
+    """
+    with trace.span("create window", "ui"):
+        app = wx.App()
+        frame = HTMAFrame(title, html_content, tmp_file, session, on_loaded, asset_root, bridge)
+        frame.Show()
+    if on_start:
+        on_start(frame)
+    shown = time.perf_counter()
+    app.MainLoop()
+    trace.complete("window open", shown, time.perf_counter(), "ui")
@@ -0,0 +1,77 @@
+// Warm Node.js worker started by HTMA_DAEMON.py.
+// Reads one JSON job per line on stdin and answers with one JSON line on stdout.
+// A script is done when require() returns, or when the function it exports
+// (module.exports or module.exports[entry]) resolves in "inprocess" mode.
+
+const readline = require("readline");
+
+const channelWrite = process.stdout.write.bind(process.stdout);
+
+class ExitSignal {
+    constructor(code) {
+        this.code = code === undefined ? 0 : code;
+    }
+}
+
+async function runJob(job) {
+    const out = [];
+    const err = [];
+    const saved = {
+        stdoutWrite: process.stdout.write,
+        stderrWrite: process.stderr.write,
+        exit: process.exit,
+        argv: process.argv,
+        cwd: process.cwd(),
+    };
+
+    process.stdout.write = (chunk) => { out.push(String(chunk)); return true; };
+    process.stderr.write = (chunk) => { err.push(String(chunk)); return true; };
+    process.exit = (code) => { throw new ExitSignal(code); };
+    process.argv = [process.argv[0], job.script, ...job.argv];
+
+    let returncode = 0;
+    try {
+        process.chdir(job.cwd);
+        const resolved = require.resolve(job.script);
+        // Run the script fresh every time, like a new process would
+        delete require.cache[resolved];
+        const exported = require(resolved);
+        if (job.mode === "inprocess") {
+            const entry = typeof exported === "function" ? exported
+                : exported && typeof exported[job.entry || "run"] === "function" ? exported[job.entry || "run"]
+                : null;
+            if (entry) {
+                await entry(job.metadata || {});
+            }
+        }
+    } catch (e) {
+        if (e instanceof ExitSignal) {
+            returncode = e.code;
+        } else {
+            err.push(((e && e.stack) || String(e)) + "\n");
+            returncode = 1;
+        }
+    } finally {
+        process.stdout.write = saved.stdoutWrite;
+        process.stderr.write = saved.stderrWrite;
+        process.exit = saved.exit;
+        process.argv = saved.argv;
+        process.chdir(saved.cwd);
+    }
+    return { id: job.id, returncode, stdout: out.join(""), stderr: err.join("") };
+}
+
+// Stray async errors from a finished plugin must not kill the warm worker
+process.on("uncaughtException", (e) => process.stderr.write(((e && e.stack) || String(e)) + "\n"));
+process.on("unhandledRejection", (e) => process.stderr.write(((e && e.stack) || String(e)) + "\n"));
+
+let queue = Promise.resolve();
+readline.createInterface({ input: process.stdin }).on("line", (line) => {
+    if (!line.trim()) {
+        return;
+    }
+    queue = queue.then(async () => {
+        const reply = await runJob(JSON.parse(line));
+        channelWrite(JSON.stringify(reply) + "\n");
+    });
+});
@@ -2,17 +2,26 @@ import sys
 import re
 from pathlib import Path
 
-try:
-    import wx
-    import wx.html2 as webview
-except ImportError:
-    print("ERROR: wxPython not installed!")
-    print("Install with: pip install wxPython")
-    sys.exit(1)
+import HTMA_TRACE as trace
+from HTMA_ASSETS import AssetLoader
+from HTMA_CACHE import PageCache
+from HTMA_REWRITE import rewrite_htma
+from HTMA_SESSION import Session
+from HTMA_SETTINGS import load_settings
+
+
+def __getattr__(name):
+    # HTMAFrame lives in HTMA_WINDOW so wx is only loaded when a window opens
+    if name == "HTMAFrame":
+        from HTMA_WINDOW import HTMAFrame
+        return HTMAFrame
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def check_display_value(content):
-    """Check if <display value=0> is present"""
+    """Check if <display value=0> is present (content may also be bytes or an mmap)"""
     pattern = r'<display\s+value\s*=\s*["\']?0["\']?\s*>'
+    if not isinstance(content, str):
+        pattern = pattern.encode("ascii")
     return bool(re.search(pattern, content))
 
 def strip_htma_tags(content):
@@ -28,8 +37,12 @@ def strip_htma_tags(content):
     content = re.sub(r'</htma>', '</html>', content, flags=re.IGNORECASE)
     return content
 
-def inject_resources(html_content, base_path):
-    """Inject external CSS and JS files directly into the HTML"""
+def inject_resources(html_content, base_path, deps=None):
+    """Inject external CSS and JS files directly into the HTML
+    
+    If deps is a list, every file the page refers to is appended to it,
+    whether or not it exists, so callers can tell when the output is stale.
+    """
     
     # Find all <link> tags for CSS
     link_pattern = r'<link\s+[^>]*href\s*=\s*["\']([^"\']+)["\'][^>]*>'
@@ -37,6 +50,8 @@ def inject_resources(html_content, base_path):
     def replace_css(match):
         href = match.group(1)
         css_path = base_path / href
+        if deps is not None:
+            deps.append(css_path)
         
         if css_path.exists():
             try:
@@ -57,6 +72,8 @@ def inject_resources(html_content, base_path):
     def replace_js(match):
         src = match.group(1)
         js_path = base_path / src
+        if deps is not None:
+            deps.append(js_path)
         
         if js_path.exists():
             try:
@@ -84,82 +101,151 @@ def inject_resources(html_content, base_path):
     content = re.sub(r'</htma>', '</html>', content, flags=re.IGNORECASE)
     return content
 
-class HTMAFrame(wx.Frame):
-    def __init__(self, title, html_content, tmp_file):
-        super().__init__(None, title=title, size=(800, 600))
-        
-        self.tmp_file = tmp_file
-        
-        # Create webview
-        self.browser = webview.WebView.New(self)
-        
-        # Load HTML content directly (all resources are now injected)
-        self.browser.SetPage(html_content, "")
-        
-        # Center window
-        self.Centre()
-        
-        # Bind close event to cleanup
-        self.Bind(wx.EVT_CLOSE, self.on_close)
-    
-    def on_close(self, event):
-        """Cleanup TMP files on close"""
-        if self.tmp_file and Path(self.tmp_file).exists():
-            try:
-                Path(self.tmp_file).unlink()
-                print(f"Deleted TMP file: {self.tmp_file}")
-            except Exception as e:
-                print(f"Failed to delete TMP file: {e}")
-        self.Destroy()
+def compile_page(content, base_path, deps=None, dedupe=False, inline_max_bytes=None, tag_assets=False,
+                 minify=False):
+    """Turn HTMA source into the final HTML shown in the window
+    
+    One pass over the document does what strip_htma_tags followed by
+    inject_resources does (bench/verify_rewrite.py checks they agree).
+    Linked files are read up front, in parallel, through the shared asset
+    cache. With dedupe, a file linked more than once is inlined only once.
+    Files larger than inline_max_bytes keep their link and are served to
+    the window by its asset handler. tag_assets marks inlined files so
+    --watch can swap them in place. minify drops comments and extra
+    whitespace from the result (HTMA_IMPORT.minify_html).
+    """
+    loader = AssetLoader(inline_max_bytes=inline_max_bytes)
+    html_content = rewrite_htma(content, base_path, deps, loader=loader, dedupe=dedupe, tag_assets=tag_assets)
+    loader.report()
+    if minify:
+        from HTMA_IMPORT import minify_html
+        html_content = minify_html(html_content)
+    return html_content
+
+def page_cache(settings=None):
+    """The compiled page cache configured in settings.json"""
+    settings = settings if settings is not None else load_settings()
+    cache_dir = Path(__file__).parent.resolve() / ".cache" / "pages"
+    return PageCache(cache_dir, int(settings.get("page_cache_mb", 64) * 1024 * 1024))
 
-def launch_ui(htma_file, tmp_file=None):
-    """Launch wxPython window with HTML content"""
-    # Read the htma file
+def compile_options(settings, tag_assets=False):
+    """Settings that change the compiled HTML, also part of the page cache key"""
+    options = {}
+    if tag_assets:
+        options["tag_assets"] = True
+    if settings.get("dedupe_assets", False):
+        options["dedupe_assets"] = True
+    if settings.get("minify_html", False):
+        options["minify"] = True
+    if settings.get("asset_mode", "inline") == "serve":
+        options["inline_max_bytes"] = int(settings.get("inline_max_bytes", 64 * 1024))
+    return options
+
+def load_page(content, base_path, use_cache=True, settings=None, tag_assets=False):
+    """Compiled HTML for content, from the page cache when nothing changed"""
+    settings = settings if settings is not None else load_settings()
+    options = compile_options(settings, tag_assets)
+    cache = page_cache(settings) if use_cache else None
+    if cache:
+        with trace.span("page cache lookup") as span:
+            html_content = cache.get(content, base_path, options)
+            span.set(hit=html_content is not None)
+        if html_content is not None:
+            print("Loaded compiled page from cache")
+            return html_content
+    
+    deps = []
+    with trace.span("compile_page", characters=len(content)):
+        html_content = compile_page(content, base_path, deps, options.get("dedupe_assets", False),
+                                    options.get("inline_max_bytes"), tag_assets, options.get("minify", False))
+    if cache:
+        with trace.span("page cache store"):
+            cache.put(content, base_path, deps, html_content, options)
+    return html_content
+
+def read_document(htma_file):
+    """Read an .htma file once so parser and window can share the text
+    
+    <import> tags are resolved here, so fragments' plugin blocks are seen
+    by the parser and their markup by the compiler.
+    """
+    from HTMA_IMPORT import resolve_imports
     with open(htma_file, 'r', encoding='utf-8') as f:
-        content = f.read()
+        return resolve_imports(f.read(), htma_file)
+
+def prepare_window(htma_file, use_cache=True, content=None, settings=None, tag_assets=False):
+    """Return the title, compiled HTML and asset root of a window for htma_file"""
+    if content is None:
+        content = read_document(htma_file)
     
     # Get base path for resource injection
     base_path = Path(htma_file).parent
     
-    # Strip htma-specific tags
-    html_content = strip_htma_tags(content)
+    # Strip htma tags and inject CSS/JS, or reuse the result of an earlier launch
+    if settings is None:
+        settings = load_settings()
+    use_cache = use_cache and settings.get("page_cache", True)
+    html_content = load_page(content, base_path, use_cache, settings, tag_assets=tag_assets)
     
-    # Inject external CSS and JS files
-    html_content = inject_resources(html_content, base_path)
+    # In serve mode large assets stay links, fetched from the page directory
+    asset_root = base_path if settings.get("asset_mode", "inline") == "serve" else None
     
     # Get file name for window title
     window_title = Path(htma_file).stem or "htma+ Application"
-    
+    return window_title, html_content, asset_root
+
+def launch_ui(htma_file, tmp_file=None, session=None, use_cache=True, content=None, on_loaded=None,
+              live=None, bridge=None):
+    """Launch wxPython window with HTML content
+    
+    Pass content when the file has already been read (e.g. by HTMA_PARSE.py).
+    on_loaded is called once the page has been painted for the first time.
+    live is an HTMA_WATCH.LiveReload to start once the window is open,
+    bridge an HTMA_BRIDGE.BridgeServer connecting the page with plugins.
+    """
+    window_title, html_content, asset_root = prepare_window(htma_file, use_cache, content,
+                                                            tag_assets=live is not None)
     print(f"Launching UI: {window_title}")
     
-    # Create wxPython app
-    app = wx.App()
-    frame = HTMAFrame(window_title, html_content, tmp_file)
-    frame.Show()
-    
-    # Start the GUI loop
-    app.MainLoop()
+    # Create the window and start the GUI loop; this is the first wx import
+    with trace.span("import wx", "ui"):
+        from HTMA_WINDOW import show_window
+    show_window(window_title, html_content, tmp_file, session, on_loaded, asset_root,
+                on_start=live.start if live else None, bridge=bridge)
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python UI.py filename.htma [tmp_file]")
-        sys.exit(1)
+    import argparse
+    
+    arg_parser = argparse.ArgumentParser(description="Open an .htma file in a window")
+    arg_parser.add_argument("htma_file", help="filename.htma")
+    arg_parser.add_argument("tmp_files", nargs="*", help="TMP files to delete when the window closes")
+    arg_parser.add_argument("--session", help="TMP session directory shared with HTMA_PARSE.py")
+    arg_parser.add_argument("--no-cache", action="store_true", help="compile the page even if a cached copy exists")
+    arg_parser.add_argument("--clear-cache", action="store_true", help="delete every cached compiled page first")
+    args = arg_parser.parse_args()
     
-    htma_file = Path(sys.argv[1]).resolve()
-    tmp_file = sys.argv[2] if len(sys.argv) > 2 else None
+    if args.clear_cache:
+        page_cache().clear()
+        print("Cleared compiled page cache")
+    
+    htma_file = Path(args.htma_file).resolve()
+    
+    # Joining the session means it is removed however this process ends
+    session = Session.open(args.session) if args.session else None
     
     if not htma_file.exists():
         print(f"Error: File not found: {htma_file}")
         sys.exit(1)
     
-    # Read file to check display value
-    with open(htma_file, 'r', encoding='utf-8') as f:
-        content = f.read()
+    # Read the file once; the display check and the window share it
+    content = read_document(htma_file)
     
     # Check if display value is 0
     if check_display_value(content):
         print("<display value=0> detected - skipping UI launch")
+        for tmp_file in args.tmp_files:
+            Path(tmp_file).unlink(missing_ok=True)
         sys.exit(0)
     
     # Launch UI
-    launch_ui(htma_file, tmp_file)
\ No newline at end of file
+    launch_ui(htma_file, args.tmp_files, session, use_cache=not args.no_cache, content=content)
\ No newline at end of file
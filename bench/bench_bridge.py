@@ -0,0 +1,113 @@
+import argparse
+import json
+import queue
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from HTMA_BRIDGE import DELIVER_JS, BridgeServer
+
+# A plugin process answering echo() and emitting a stream of events
+PLUGIN = """import sys
+sys.path.insert(0, %r)
+from HTMA_BRIDGE import BridgeClient
+
+bridge = BridgeClient(sys.argv[1], sys.argv[2], "bench")
+
+@bridge.function
+def echo(value):
+    return value
+
+@bridge.function
+def blob(size):
+    return bytes(size)
+
+@bridge.function
+def burst(count):
+    for n in range(count):
+        bridge.emit("tick", n)
+    return count
+
+bridge.serve()
+""" % str(ROOT)
+
+
+class FakePage:
+    """Stands in for the window: a GUI thread running posted functions and a
+    page receiving what the bridge hands to RunScript"""
+
+    def __init__(self):
+        self.tasks = queue.Queue()
+        self.delivered = queue.Queue()
+        self.scripts = 0
+        threading.Thread(target=self.loop, daemon=True).start()
+
+    def loop(self):
+        while True:
+            self.tasks.get()()
+
+    def post(self, func):
+        self.tasks.put(func)
+
+    def run_script(self, js):
+        self.scripts += 1
+        prefix, suffix = DELIVER_JS.split("%s")
+        for message in json.loads(js[len(prefix):-len(suffix)]):
+            self.delivered.put(message)
+
+
+def call(server, page, fn, *args, call_id=1):
+    server.from_page(json.dumps([{"id": call_id, "plugin": "bench", "fn": fn, "args": list(args)}]))
+    while True:
+        message = page.delivered.get(timeout=10)
+        if message.get("type") == "reply" and message["id"] == call_id:
+            return message
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Round-trip latency through the page/plugin bridge")
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--blob", type=int, default=64 * 1024, help="bytes returned by the binary call")
+    parser.add_argument("--burst", type=int, default=10000, help="events emitted in one burst")
+    options = parser.parse_args()
+
+    server = BridgeServer(["bench"])
+    server.start()
+    page = FakePage()
+    server.attach(page.post, page.run_script)
+    plugin = subprocess.Popen([sys.executable, "-c", PLUGIN, server.address, server.token])
+    try:
+        call(server, page, "echo", "warm up")
+
+        times = []
+        for n in range(options.calls):
+            start = time.perf_counter()
+            call(server, page, "echo", {"n": n}, call_id=n + 2)
+            times.append((time.perf_counter() - start) * 1000)
+        times.sort()
+        print(f"echo round trip over {options.calls} calls: median {statistics.median(times):.3f} ms, "
+              f"p99 {times[int(len(times) * 0.99)]:.3f} ms")
+
+        start = time.perf_counter()
+        reply = call(server, page, "blob", options.blob, call_id=-1)
+        print(f"{options.blob / 1024:.0f} KB binary reply: {(time.perf_counter() - start) * 1000:.2f} ms "
+              f"({len(reply['base64'])} base64 characters)")
+
+        scripts = page.scripts
+        start = time.perf_counter()
+        call(server, page, "burst", options.burst, call_id=-2)
+        elapsed = time.perf_counter() - start
+        print(f"{options.burst} events in {elapsed * 1000:.1f} ms, delivered in {page.scripts - scripts} RunScript batches")
+    finally:
+        server.close()
+        plugin.wait(5)
+
+
+if __name__ == "__main__":
+    main()
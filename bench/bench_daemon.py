@@ -0,0 +1,84 @@
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from HTMA_DAEMON import DaemonClient
+from HTMA_SCHEDULER import PluginScheduler
+
+STUB_PY = """import json, sys
+with open(sys.argv[1], encoding="utf-8") as f:
+    metadata = json.load(f)
+print(len(metadata))
+"""
+
+STUB_JS = """const fs = require("fs");
+const metadata = JSON.parse(fs.readFileSync(process.argv[2], "utf-8"));
+console.log(Object.keys(metadata).length);
+"""
+
+
+def make_plugins(root, count, with_node):
+    """Write count stub plugins (one .py, optionally one .js script each)"""
+    plugins = []
+    for n in range(count):
+        path = root / f"_stub{n}_"
+        path.mkdir()
+        scripts = ["stub.py"]
+        (path / "stub.py").write_text(STUB_PY, encoding="utf-8")
+        if with_node:
+            scripts.append("stub.js")
+            (path / "stub.js").write_text(STUB_JS, encoding="utf-8")
+        plugins.append((f"stub{n}", path, {"rts": True, "args": [], "scripts": scripts}))
+    return plugins
+
+
+def run_once(plugins, metadata_file, daemon):
+    scheduler = PluginScheduler(echo=False, daemon=daemon)
+    for name, path, config in plugins:
+        scheduler.add(name, path, config, str(metadata_file))
+    start = time.perf_counter()
+    scheduler.start()
+    scheduler.wait()
+    elapsed = time.perf_counter() - start
+    failed = [job.name for job in scheduler.jobs.values() if job.failed]
+    if failed:
+        print(f"Warning: failed plugins: {failed}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time plugin completion on a cold start versus the warm worker daemon")
+    parser.add_argument("--plugins", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--node", action="store_true", help="add a .js script to every stub plugin")
+    parser.add_argument("--keep-daemon", action="store_true", help="leave the daemon running afterwards")
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        plugins = make_plugins(root, options.plugins, options.node)
+        metadata_file = root / "metadata.TMP"
+        metadata_file.write_text(json.dumps({"window:file": "bench.htma"}), encoding="utf-8")
+
+        cold = min(run_once(plugins, metadata_file, None) for _ in range(options.repeat))
+
+        client = DaemonClient()
+        client.stop()
+        first = run_once(plugins, metadata_file, client)
+        warm = min(run_once(plugins, metadata_file, client) for _ in range(options.repeat))
+        if not options.keep_daemon:
+            client.stop()
+
+    print(f"{options.plugins} plugins")
+    print(f"  cold (process per script): {cold * 1000:8.1f} ms")
+    print(f"  daemon first use (start):  {first * 1000:8.1f} ms")
+    print(f"  daemon warm:               {warm * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from HTMA_IMPORT import ImportResolver
+
+
+def write_tree(folder, depth, fanout, size):
+    """A page importing fanout fragments, each importing fanout more, depth levels down"""
+    filler = "<p>" + "x" * size + "</p>\n"
+    leaves = []
+
+    def fragment(path, level):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        lines = [filler]
+        if level < depth:
+            for n in range(fanout):
+                lines.append(f'<import src="{path.stem}/{n}.htma">\n')
+                fragment(path.parent / path.stem / f"{n}.htma", level + 1)
+        else:
+            leaves.append(path)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("".join(lines))
+
+    page = folder / "page.htma"
+    fragment(page, 0)
+    return page, leaves
+
+
+def resolve(page, cache_dir):
+    with open(page, "r", encoding="utf-8") as f:
+        content = f.read()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        resolver = ImportResolver(page, cache_dir)
+        text = resolver.resolve(content)
+    return (time.perf_counter() - start) * 1000, resolver, len(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resolving a tree of imports: cold, unchanged and after one edit")
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--fanout", type=int, default=5)
+    parser.add_argument("--size", type=int, default=2000, help="characters of text per fragment")
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        page, leaves = write_tree(Path(tmp) / "site", options.depth, options.fanout, options.size)
+        cache_dir = Path(tmp) / "imports"
+
+        ms, resolver, length = resolve(page, cache_dir)
+        print(f"{len(resolver.files)} fragments, {length / 1024:.0f} KB resolved")
+        print(f"  cold:      {ms:8.1f} ms ({resolver.resolved} read)")
+        ms, resolver, _ = resolve(page, cache_dir)
+        print(f"  unchanged: {ms:8.1f} ms ({resolver.resolved} read, {resolver.reused} reused)")
+
+        leaf = leaves[len(leaves) // 2]
+        with open(leaf, "a", encoding="utf-8") as f:
+            f.write("<p>edited</p>\n")
+        st = leaf.stat()
+        os.utime(leaf, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+        ms, resolver, _ = resolve(page, cache_dir)
+        print(f"  one edit:  {ms:8.1f} ms ({resolver.resolved} read, {resolver.reused} reused)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from HTMA_LEX import lex_plugin_blocks
+
+
+def legacy_extract_arg_content(func_body, arg_name):
+    """The regex + paren counting extractor HTMAParser used before the lexer"""
+    match = re.search(rf'{arg_name}\s*\(', func_body)
+    if not match:
+        return ""
+    start = match.end()
+    paren_count = 1
+    i = start
+    while i < len(func_body) and paren_count > 0:
+        if func_body[i] == '(':
+            paren_count += 1
+        elif func_body[i] == ')':
+            paren_count -= 1
+        i += 1
+    if paren_count == 0:
+        content = func_body[start:i-1].strip()
+        if content.startswith('`') and content.endswith('`'):
+            content = content[1:-1]
+        elif content.startswith('"') and content.endswith('"'):
+            content = content[1:-1]
+        elif content.startswith("'") and content.endswith("'"):
+            content = content[1:-1]
+        return content
+    return ""
+
+
+def legacy_parse(content, args):
+    """The regex + brace counting block finder HTMAParser used before the lexer"""
+    results = []
+    pattern = r'function\s+(plugin|cplugin)\s*\(\s*([a-zA-Z0-9_]+)\s*\)\s*\{'
+    for match in re.finditer(pattern, content):
+        start = match.end()
+        brace_count = 1
+        i = start
+        while i < len(content) and brace_count > 0:
+            if content[i] == '{':
+                brace_count += 1
+            elif content[i] == '}':
+                brace_count -= 1
+            i += 1
+        func_body = content[start:i-1]
+        results.append((match.group(2), [legacy_extract_arg_content(func_body, a) for a in args]))
+    return results
+
+
+def lexer_parse(content, args):
+    return [(block.name, [block.arg_content(content, a) for a in args])
+            for block in lex_plugin_blocks(content)]
+
+
+def generate_document(blocks, arg_size, args, seed=0):
+    """Build a page with the given number of plugin blocks and filler markup"""
+    rng = random.Random(seed)
+    words = ["alpha", "beta", "gamma", "delta", "render", "value", "items"]
+    parts = ["<!DOCTYPE htma>\n<htma>\n<head><title>bench</title></head>\n<body>\n"]
+    for n in range(blocks):
+        parts.append(f"<div class=\"card\"><p>Card {n} text</p></div>\n<script>\n")
+        parts.append(f"function plugin(bench{n % 8}) {{\n")
+        for arg in args:
+            filler = " ".join(rng.choice(words) for _ in range(max(1, arg_size // 6)))
+            parts.append(f"    {arg}(`{filler}`);\n")
+        parts.append("    if (x) { log(\"done\"); }\n}\n</script>\n")
+    parts.append("</body>\n</htma>\n")
+    return "".join(parts)
+
+
+def measure(func, content, args, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(content, args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the HTMA lexer with the legacy regex parser")
+    parser.add_argument("--blocks", type=int, default=2000)
+    parser.add_argument("--arg-size", type=int, default=400)
+    parser.add_argument("--args", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    options = parser.parse_args()
+
+    args = [f"arg{n}" for n in range(options.args)]
+    content = generate_document(options.blocks, options.arg_size, args)
+    size_mb = len(content.encode("utf-8")) / (1024 * 1024)
+
+    if legacy_parse(content, args) != lexer_parse(content, args):
+        print("Warning: lexer and legacy parser disagree on this document")
+
+    print(f"Document: {size_mb:.2f} MB, {options.blocks} blocks, {options.args} args each")
+    for label, func in (("legacy", legacy_parse), ("lexer", lexer_parse)):
+        elapsed = measure(func, content, args, options.repeat)
+        print(f"{label:>8}: {elapsed * 1000:9.1f} ms  {size_mb / elapsed:8.2f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import contextlib
+import io
+import json
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from corpus import CorpusSpec, write_corpus
+
+
+def parse_once(page, plugin_dir, tmp_backing, mmap_mb):
+    """Read, parse and write the args of page the way HTMA_PARSE.py does"""
+    from bench_pipeline import bench_settings
+    from HTMA_PARSE import HTMAParser
+
+    settings = bench_settings(Path(tmp_backing).parent)
+    settings["mmap_parse_mb"] = mmap_mb
+    # Peak of what Python allocates. Process RSS would also count the pages
+    # of the mapped file, which the OS can drop at any time.
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        parser = HTMAParser(page, settings, plugin_dir)
+        content = parser.read_source()
+        parser.plugin_list = parser.parse_plugin_calls(content)
+        parser.prepare_transports(parser.plugin_list)
+        parser.close_mapped()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    parser.session.release()
+    return {"ms": elapsed * 1000, "peak_mb": peak / (1024 * 1024)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak memory of parsing a large page, read whole vs memory-mapped")
+    parser.add_argument("--size-mb", type=int, nargs="+", default=[50, 200], help="page sizes to try")
+    parser.add_argument("--blocks", type=int, default=20, help="plugin blocks the args are spread over")
+    parser.add_argument("--run", nargs=4, help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.run:
+        page, plugin_dir, tmp_backing, mmap_mb = options.run
+        print(json.dumps(parse_once(page, plugin_dir, tmp_backing, float(mmap_mb))))
+        return 0
+
+    print(f"{'page MB':>8}  {'mode':>6}  {'time ms':>9}  {'peak heap MB':>12}")
+    for size_mb in options.size_mb:
+        with tempfile.TemporaryDirectory() as tmp:
+            # Two args per block carry nearly all of the page
+            arg_size = size_mb * 1024 * 1024 // (options.blocks * 2)
+            spec = CorpusSpec(blocks=options.blocks, plugins=2, args=2, arg_size=arg_size, css=0, js=0, filler=0)
+            page = write_corpus(Path(tmp) / "corpus", spec)
+            for mode, mmap_mb in (("read", 0), ("mmap", 1)):
+                # A fresh interpreter per mode, so one peak does not hide the other
+                result = subprocess.run([sys.executable, __file__, "--run", str(page), str(page.parent / "plugins"),
+                                         str(Path(tmp) / "TMP"), str(mmap_mb)],
+                                        capture_output=True, text=True, check=True)
+                timing = json.loads(result.stdout.strip().splitlines()[-1])
+                print(f"{page.stat().st_size / (1024 * 1024):8.0f}  {mode:>6}  {timing['ms']:9.0f}  "
+                      f"{timing['peak_mb']:12.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+import argparse
+import contextlib
+import io
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from corpus import add_spec_arguments, spec_from_arguments, write_corpus
+from HTMA_ASSETS import ASSET_CACHE
+from HTMA_LEX import lex_plugin_blocks
+from HTMA_PARSE import HTMAParser
+from HTMA_SETTINGS import DEFAULTS
+from UI import check_display_value, compile_page, inject_resources, read_document, strip_htma_tags
+
+# Bump when stages are renamed or measure something different
+RESULTS_FORMAT = 1
+
+# Changes smaller than this are noise, whatever the ratio
+NOISE_MS = 0.5
+
+
+def bench_settings(work_dir):
+    """Built-in defaults, with every cache that would carry over between runs off"""
+    settings = dict(DEFAULTS)
+    settings.update({"parse_index": False, "arg_store_mb": 0, "page_cache": False, "daemon": False,
+                     "tmp_backing": str(Path(work_dir) / "TMP")})
+    return settings
+
+
+def quiet(func, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args)
+
+
+def measure(run, setup=None, repeat=5):
+    """Milliseconds of run(state) over repeat runs; setup() makes a fresh state and is not timed"""
+    runs = []
+    for _ in range(repeat):
+        state = quiet(setup) if setup else None
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            run(state)
+            runs.append((time.perf_counter() - start) * 1000)
+    return {"best_ms": min(runs), "median_ms": statistics.median(runs), "runs_ms": runs}
+
+
+def run_stages(page, plugin_dir, settings, repeat, launches):
+    """Time every stage of the pipeline on one page"""
+    content = read_document(page)
+    base_path = page.parent
+
+    def new_parser():
+        return HTMAParser(page, settings, plugin_dir)
+
+    def parsed():
+        parser = new_parser()
+        parser.plugin_list = parser.parse_plugin_calls(content)
+        return parser
+
+    def with_args():
+        parser = parsed()
+        parser.write_arg_tmp_files()
+        return parser
+
+    def prepared():
+        parser = parsed()
+        parser.metadata["window:file"] = str(parser.htma_file)
+        parser.prepare_transports(parser.plugin_list)
+        return parser
+
+    def run_plugins(parser):
+        parser.execute_plugins(parser.plugin_list)
+        parser.wait_for_plugins()
+        failed = [job.name for job in parser.scheduler.jobs.values() if job.failed]
+        if failed:
+            raise RuntimeError(f"stub plugins failed: {failed}")
+
+    bodies = [block.body(content) for block in lex_plugin_blocks(content)]
+    arg_names = sorted({arg for plugin in quiet(parsed).plugin_list for arg in plugin["config"].get("args", [])})
+    extractor = new_parser()
+    stripped = strip_htma_tags(content)
+
+    stages = {}
+    stages["parse_plugin_calls"] = measure(lambda parser: parser.parse_plugin_calls(content), new_parser, repeat)
+    stages["extract_arg_content"] = measure(
+        lambda _: [extractor.extract_arg_content(body, arg) for body in bodies for arg in arg_names], None, repeat)
+    stages["write_arg_tmp_files"] = measure(lambda parser: parser.write_arg_tmp_files(), parsed, repeat)
+    stages["create_metadata_tmp"] = measure(lambda parser: parser.create_metadata_tmp(), with_args, repeat)
+    stages["execute_plugins"] = measure(run_plugins, prepared, repeat)
+    stages["strip_htma_tags"] = measure(lambda _: strip_htma_tags(content), None, repeat)
+    stages["inject_resources"] = measure(lambda _: inject_resources(stripped, base_path), None, repeat)
+    stages["compile_page"] = measure(lambda _: compile_page(content, base_path), ASSET_CACHE.clear, repeat)
+
+    # A fresh interpreter per launch, like HTMA_PARSE.py on a <display value=0> page
+    command = [sys.executable, str(Path(__file__).resolve()), "--launch", str(page), str(plugin_dir),
+               settings["tmp_backing"]]
+
+    def launch(_):
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"launch failed:\n{result.stdout}")
+    stages["end_to_end"] = measure(launch, None, launches)
+    return stages
+
+
+def launch_headless(page, plugin_dir, tmp_backing):
+    """What HTMA_PARSE.py does for a headless page, with the stub plugins"""
+    settings = bench_settings(Path(tmp_backing).parent)
+    parser = HTMAParser(page, settings, plugin_dir)
+    content = read_document(parser.htma_file)
+    parser.parse_and_run(content)
+    if not check_display_value(content):
+        compile_page(content, parser.htma_file.parent)
+    failed = []
+    if parser.scheduler:
+        parser.wait_for_plugins()
+        parser.scheduler.report()
+        failed = [job.name for job in parser.scheduler.jobs.values() if job.failed]
+    parser.close_transports()
+    if parser.session:
+        parser.session.release()
+    return 1 if failed else 0
+
+
+def git_revision():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def print_stages(stages):
+    for name, timing in stages.items():
+        print(f"{name:>20}: {timing['median_ms']:9.2f} ms median, {timing['best_ms']:9.2f} ms best")
+
+
+def compare(old, new, threshold):
+    """Print median changes per stage; return the names of stages that got slower than threshold"""
+    if old.get("corpus") != new.get("corpus"):
+        print("Warning: the two results were measured on different corpora")
+    print(f"{'stage':>20}  {'old ms':>9}  {'new ms':>9}  change")
+    slower = []
+    for name, timing in new["stages"].items():
+        before = old["stages"].get(name)
+        if before is None:
+            print(f"{name:>20}  {'-':>9}  {timing['median_ms']:9.2f}  new stage")
+            continue
+        a, b = before["median_ms"], timing["median_ms"]
+        change = (b - a) / a if a else 0.0
+        flag = ""
+        if change > threshold and b - a > NOISE_MS:
+            flag = "  REGRESSION"
+            slower.append(name)
+        print(f"{name:>20}  {a:9.2f}  {b:9.2f}  {change * 100:+6.1f}%{flag}")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every stage of the HTMA pipeline on a generated page")
+    add_spec_arguments(parser)
+    parser.add_argument("--corpus", help="use a folder written by bench/corpus.py instead of generating one")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per in-process stage")
+    parser.add_argument("--launches", type=int, default=3, help="runs of the end-to-end launch")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--compare", nargs="+", metavar="JSON",
+                        help="compare with an earlier result (OLD), or two results (OLD NEW) without running")
+    parser.add_argument("--threshold", type=float, default=0.10, help="slowdown reported as a regression")
+    parser.add_argument("--launch", nargs=3, help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.launch:
+        return launch_headless(*options.launch)
+
+    if options.compare and len(options.compare) > 2:
+        parser.error("--compare takes one or two files")
+    if options.compare and len(options.compare) == 2:
+        old, new = (json.loads(Path(name).read_text(encoding="utf-8")) for name in options.compare)
+        return 1 if compare(old, new, options.threshold) else 0
+
+    spec = spec_from_arguments(options)
+    with tempfile.TemporaryDirectory() as tmp:
+        if options.corpus:
+            corpus = Path(options.corpus).resolve()
+            page = corpus / "page.htma"
+            corpus_info = {"folder": str(corpus)}
+        else:
+            corpus = Path(tmp) / "corpus"
+            page = write_corpus(corpus, spec)
+            corpus_info = spec.to_dict()
+        corpus_info["page_bytes"] = page.stat().st_size
+        settings = bench_settings(tmp)
+
+        print(f"Page: {page.stat().st_size / 1024:.1f} KB, {options.repeat} runs per stage")
+        stages = run_stages(page, corpus / "plugins", settings, options.repeat, options.launches)
+        shutil.rmtree(settings["tmp_backing"], ignore_errors=True)
+
+    results = {
+        "format": RESULTS_FORMAT,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": corpus_info,
+        "stages": stages,
+    }
+    print_stages(stages)
+    if options.out:
+        Path(options.out).write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"Wrote {options.out}")
+    if options.compare:
+        old = json.loads(Path(options.compare[0]).read_text(encoding="utf-8"))
+        return 1 if compare(old, results, options.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
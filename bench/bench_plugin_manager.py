@@ -0,0 +1,197 @@
+import argparse
+import contextlib
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+ROOT = Path(__file__).resolve().parent.parent
+PLUGIN_MANAGER = ROOT / "plugins" / "_plugin_" / "plugin.py"
+
+
+class PluginServer(ThreadingHTTPServer):
+    """Stands in for the search/fetch APIs and the file host.
+
+    Archives are served with ETag/Last-Modified, answer conditional
+    requests with 304 and Range requests with 206, after latency seconds
+    and at most rate bytes per second per download.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, archives, latency, rate, with_sha256=False):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.archives = archives          # id -> zip bytes
+        self.latency = latency
+        self.rate = rate
+        self.with_sha256 = with_sha256
+        self.modified = formatdate(time.time(), usegmt=True)
+        self.lock = threading.Lock()
+        self.file_bytes = 0
+        self.file_requests = 0
+
+    @property
+    def base(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, value):
+        body = json.dumps(value).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/search/":
+            self.send_json([{"id": plugin_id, "name": f"bench{plugin_id}", "type": "official"}
+                            for plugin_id in server.archives])
+        elif url.path == "/fetch/":
+            plugin_id = int(query["id"][0])
+            if plugin_id not in server.archives:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            info = {"name": f"bench{plugin_id}", "type": "official",
+                    "download_link": f"{server.base}/files/{plugin_id}.zip"}
+            if server.with_sha256:
+                info["sha256"] = hashlib.sha256(server.archives[plugin_id]).hexdigest()
+            self.send_json(info)
+        elif url.path.startswith("/files/"):
+            self.send_file(server.archives[int(Path(url.path).stem)])
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    def send_file(self, data):
+        server = self.server
+        time.sleep(server.latency)
+        etag = f'"{hashlib.sha256(data).hexdigest()[:16]}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        start = 0
+        byte_range = self.headers.get("Range")
+        if byte_range and self.headers.get("If-Range") in (None, etag):
+            start = int(byte_range.split("=")[1].split("-")[0])
+        body = data[start:]
+        self.send_response(206 if start else 200)
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", server.modified)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        with server.lock:
+            server.file_requests += 1
+            server.file_bytes += len(body)
+        step = max(1, server.rate // 20)
+        for pos in range(0, len(body), step):
+            self.wfile.write(body[pos:pos + step])
+            time.sleep(len(body[pos:pos + step]) / server.rate)
+
+
+def make_archive(plugin_id, size):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        archive.writestr(f"_bench{plugin_id}_/plugin.json", json.dumps({"rts": True, "scripts": ["p.py"]}))
+        archive.writestr(f"_bench{plugin_id}_/p.py", "print('bench')\n")
+        archive.writestr(f"_bench{plugin_id}_/data.bin", os.urandom(size))
+    return buffer.getvalue()
+
+
+def load_manager(server):
+    os.environ["HTMA_PLUGIN_SEARCH_URL"] = f"{server.base}/search/"
+    os.environ["HTMA_PLUGIN_FETCH_URL"] = f"{server.base}/fetch/"
+    spec = importlib.util.spec_from_file_location("plugin_manager", PLUGIN_MANAGER)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def timed(server, func):
+    """Run func quietly; returns (ms, archive bytes served, archive requests)"""
+    served, requests_made = server.file_bytes, server.file_requests
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+    return ((time.perf_counter() - start) * 1000, server.file_bytes - served,
+            server.file_requests - requests_made)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plugin Manager installs against a local stand-in server")
+    parser.add_argument("--plugins", type=int, default=8)
+    parser.add_argument("--size-kb", type=int, default=512, help="archive size per plugin")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds before each archive starts")
+    parser.add_argument("--rate-kb", type=int, default=4096, help="KB per second per download")
+    options = parser.parse_args()
+
+    archives = {plugin_id: make_archive(plugin_id, options.size_kb * 1024)
+                for plugin_id in range(1, options.plugins + 1)}
+    server = PluginServer(archives, options.latency, options.rate_kb * 1024)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    module = load_manager(server)
+    ids = list(archives)
+
+    def row(label, result):
+        ms, served, made = result
+        print(f"{label:<34} {ms:8.0f} ms  {served / 1024:8.0f} KB in {made} downloads")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for workers in (1, 4):
+            plugins_dir = tmp / f"plugins{workers}"
+            plugins_dir.mkdir()
+            manager = module.PluginManager(plugins_dir=str(plugins_dir), cache_dir=str(tmp / f"cache{workers}"),
+                                           max_downloads=workers)
+            row(f"fresh install, {workers} at a time", timed(server, lambda: manager.install_many(ids)))
+
+        row("reinstall, unchanged", timed(server, lambda: manager.install_many(ids)))
+        shutil.rmtree(plugins_dir / "_bench1_")
+        row("reinstall, one folder deleted", timed(server, lambda: manager.install_many(ids)))
+        assert (plugins_dir / "_bench1_" / "p.py").exists()
+
+        # A download cut off half way: the partial file is resumed with Range
+        entry = manager.index["plugins"]["2"]
+        data = archives[2]
+        os.remove(manager.archive_path(entry["archives"][0]))
+        part_file = Path(manager.partial_dir) / "2.part"
+        part_file.write_bytes(data[:len(data) // 2])
+        (Path(manager.partial_dir) / "2.part.json").write_text(json.dumps(
+            {"url": entry["download_link"], "etag": entry["etag"]}), encoding="utf-8")
+        row("resume a half-downloaded archive", timed(server, lambda: manager.install_many([2])))
+        assert os.path.exists(manager.archive_path(hashlib.sha256(data).hexdigest()))
+
+        server.with_sha256 = True
+        row("reinstall, server sends sha256", timed(server, lambda: manager.install_many(ids)))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
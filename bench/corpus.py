@@ -0,0 +1,164 @@
+import argparse
+import json
+import random
+import sys
+from pathlib import Path
+
+STUB_PLUGIN = """import sys
+# Stub plugin for benchmarks: read the metadata like a real plugin, do nothing else
+with open(sys.argv[1], encoding="utf-8") as f:
+    f.read()
+"""
+
+WORDS = ["alpha", "beta", "gamma", "delta", "render", "value", "items", "<b>", "x < y", "{ }", "( )"]
+
+
+class CorpusSpec:
+    """Shape of a generated page.
+
+    blocks:      plugin blocks on the page
+    plugins:     distinct stub plugins the blocks are spread over
+    args:        args per plugin, each called once per block
+    arg_size:    characters of every arg's content
+    depth:       nesting of braces around the calls and of parentheses in
+                 an extra expression inside every block
+    css / js:    linked stylesheets / scripts, each asset_size bytes
+    rts:         whether the stub plugins receive their args
+    filler:      characters of plain markup between blocks
+    """
+
+    def __init__(self, blocks=200, plugins=4, args=2, arg_size=200, depth=2, css=4, js=4, asset_size=8192,
+                 rts=True, filler=200, seed=0):
+        self.blocks = blocks
+        self.plugins = max(1, plugins)
+        self.args = args
+        self.arg_size = arg_size
+        self.depth = depth
+        self.css = css
+        self.js = js
+        self.asset_size = asset_size
+        self.rts = rts
+        self.filler = filler
+        self.seed = seed
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    def arg_names(self):
+        return [f"arg{n}" for n in range(self.args)]
+
+
+def text(rng, size):
+    """About size characters of words, no backticks"""
+    parts = []
+    total = 0
+    while total < size:
+        word = rng.choice(WORDS)
+        parts.append(word)
+        total += len(word) + 1
+    return " ".join(parts)[:size]
+
+
+def generate_page(spec):
+    """HTMA source for spec"""
+    rng = random.Random(spec.seed)
+    parts = ["<!DOCTYPE htma>\n<htma>\n<head>\n<title>bench</title>\n<display value=0>\n"]
+    parts.extend(f'<link rel="stylesheet" href="assets/style{n}.css">\n' for n in range(spec.css))
+    parts.extend(f'<script src="assets/script{n}.js"></script>\n' for n in range(spec.js))
+    parts.append("</head>\n<body>\n")
+
+    for n in range(spec.blocks):
+        if spec.filler:
+            parts.append(f'<div class="card"><p>{text(rng, spec.filler)}</p></div>\n')
+        parts.append(f"<script>\nfunction plugin(stub{n % spec.plugins}) {{\n")
+        indent = "    "
+        for level in range(spec.depth):
+            parts.append(f"{indent}if (level{level}) {{\n")
+            indent += "    "
+        for arg in spec.arg_names():
+            parts.append(f"{indent}{arg}(`{text(rng, spec.arg_size)}`);\n")
+        expression = "1"
+        for level in range(spec.depth):
+            expression = f"f{level}({expression}, (2))"
+        parts.append(f"{indent}let v = {expression};\n")
+        for level in range(spec.depth):
+            indent = indent[:-4]
+            parts.append(f"{indent}}}\n")
+        parts.append("}\n</script>\n")
+
+    parts.append("</body>\n</htma>\n")
+    return "".join(parts)
+
+
+def write_assets(root, spec):
+    rng = random.Random(spec.seed + 1)
+    assets = Path(root) / "assets"
+    assets.mkdir(parents=True, exist_ok=True)
+    for n in range(spec.css):
+        rules = []
+        while sum(map(len, rules)) < spec.asset_size:
+            rules.append(f".c{len(rules)} {{ color: #{rng.randrange(0x1000000):06x}; margin: {rng.randrange(20)}px; }}\n")
+        (assets / f"style{n}.css").write_text("".join(rules)[:spec.asset_size], encoding="utf-8")
+    for n in range(spec.js):
+        lines = []
+        while sum(map(len, lines)) < spec.asset_size:
+            lines.append(f"function f{len(lines)}(a) {{ return a < {rng.randrange(100)} ? a : -a; }}\n")
+        (assets / f"script{n}.js").write_text("".join(lines)[:spec.asset_size], encoding="utf-8")
+
+
+def write_plugins(root, spec):
+    """Stub plugins stub0..stubN in root/plugins, as HTMAParser(plugin_dir=...) expects"""
+    plugin_dir = Path(root) / "plugins"
+    for n in range(spec.plugins):
+        folder = plugin_dir / f"_stub{n}_"
+        folder.mkdir(parents=True, exist_ok=True)
+        config = {"name": f"stub{n}", "rts": spec.rts, "args": spec.arg_names(), "scripts": ["stub.py"]}
+        (folder / "plugin.json").write_text(json.dumps(config, indent=4), encoding="utf-8")
+        (folder / "stub.py").write_text(STUB_PLUGIN, encoding="utf-8")
+    return plugin_dir
+
+
+def write_corpus(root, spec):
+    """Write page.htma, its assets and stub plugins under root; return the page path"""
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    page = root / "page.htma"
+    page.write_text(generate_page(spec), encoding="utf-8")
+    write_assets(root, spec)
+    write_plugins(root, spec)
+    return page
+
+
+def add_spec_arguments(parser):
+    defaults = CorpusSpec()
+    parser.add_argument("--blocks", type=int, default=defaults.blocks, help="plugin blocks on the page")
+    parser.add_argument("--plugins", type=int, default=defaults.plugins, help="distinct stub plugins")
+    parser.add_argument("--args", type=int, default=defaults.args, help="args per plugin")
+    parser.add_argument("--arg-size", type=int, default=defaults.arg_size, help="characters per arg")
+    parser.add_argument("--depth", type=int, default=defaults.depth, help="brace/parenthesis nesting in blocks")
+    parser.add_argument("--css", type=int, default=defaults.css, help="linked stylesheets")
+    parser.add_argument("--js", type=int, default=defaults.js, help="linked scripts")
+    parser.add_argument("--asset-size", type=int, default=defaults.asset_size, help="bytes per CSS/JS file")
+    parser.add_argument("--no-rts", dest="rts", action="store_false", help="stub plugins do not receive args")
+    parser.add_argument("--filler", type=int, default=defaults.filler, help="characters of markup between blocks")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def spec_from_arguments(options):
+    return CorpusSpec(options.blocks, options.plugins, options.args, options.arg_size, options.depth, options.css,
+                      options.js, options.asset_size, options.rts, options.filler, options.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic HTMA page with assets and stub plugins")
+    parser.add_argument("out", help="folder to write the corpus to")
+    add_spec_arguments(parser)
+    options = parser.parse_args()
+
+    page = write_corpus(options.out, spec_from_arguments(options))
+    print(f"Wrote {page} ({page.stat().st_size / 1024:.1f} KB)")
+    print(f"Time it with: python bench/bench_pipeline.py --corpus {options.out}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
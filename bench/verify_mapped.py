@@ -0,0 +1,86 @@
+import argparse
+import contextlib
+import io
+import mmap
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from HTMA_INDEX import text_digest
+from HTMA_LEX import lex_plugin_blocks
+from HTMA_MAPPED import ArgSpan
+
+# Pieces arg contents are made of: ASCII and Unicode whitespace that
+# str.strip() removes, quotes, brackets, template substitutions, every kind
+# of line ending (a lone \r is a newline to the str path) and multi-byte
+# characters
+PIECES = [" ", "  ", "\t", "\n", "\r\n", "\r", " ", "　", " ", "\u0085", "​",
+          "x", "word", "é", "中文", "\U0001f600", "`", '"', "'", "a b", "http://example.com/x",
+          "Don't", "(nested)", "$", "{", "}"]
+ARGS = ["content", "css"]
+
+
+def generate_document(blocks, rng):
+    parts = ["<htma>\n<script>\n"]
+    for n in range(blocks):
+        parts.append(f"function plugin(p{n}) {{\n")
+        for arg in ARGS:
+            inner = "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 8)))
+            wrap = rng.choice(["", "`", '"'])
+            parts.append(f"    {arg}({wrap}{inner}{wrap});\n")
+        parts.append("}\n")
+    parts.append("</script>\n</htma>\n")
+    return "".join(parts)
+
+
+def str_digests(path):
+    """Arg hashes the str parse path gives (the file read in text mode)"""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    return [(block.name, arg, text_digest(block.arg_content(text, arg)))
+            for block in lex_plugin_blocks(text) for arg in ARGS]
+
+
+def mapped_digests(path):
+    """Arg hashes the memory-mapped parse path gives"""
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return [(block.name, arg, ArgSpan(data, *block.arg_span(data, arg)).digest())
+                for block in lex_plugin_blocks(data) for arg in ARGS]
+    finally:
+        data.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the str and memory-mapped parse paths give the same args")
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--blocks", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    options = parser.parse_args()
+
+    rng = random.Random(options.seed)
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "page.htma"
+        for n in range(options.documents):
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                f.write(generate_document(options.blocks, rng))
+            # Unclosed calls are reported by both paths; only the results matter here
+            with contextlib.redirect_stdout(io.StringIO()):
+                expected, found = str_digests(path), mapped_digests(path)
+            if expected != found:
+                failures += 1
+                mismatch = next((a, b) for a, b in zip(expected, found) if a != b) if len(expected) == len(found) \
+                    else (len(expected), len(found))
+                print(f"Document {n}: paths differ: {mismatch}")
+    print(f"{options.documents} documents, {options.documents * options.blocks} blocks: "
+          f"{'OK' if not failures else f'{failures} differ'}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+import argparse
+import contextlib
+import io
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from HTMA_REWRITE import rewrite_htma
+from UI import inject_resources, strip_htma_tags
+
+
+# Pieces pages are assembled from. Each one is a complete construct, so no
+# HTMA tag ends up inside another's tag (see HTMA_REWRITE.Rewriter).
+FRAGMENTS = [
+    '<!DOCTYPE htma>\n', '<!doctype HTMA>\n', '<!DOCTYPE html>\n', '<!DOCTYPE  htma >\n',
+    '<htma>\n', '</htma>\n', '<HTMA>', '</Htma>', '<htma lang="en">', '<html>', '</html>',
+    '<import src="lib.htma">', '<import>', '<import\n  src="a"\n>', '<importer x>',
+    '<display value=0>', '<display value="1">', '<display>', '<DISPLAY value=0>',
+    '<link rel="stylesheet" href="style.css">', "<link href='style.css' rel=stylesheet>",
+    '<link rel="icon" href="favicon.png">', '<link href="missing.css">', '<LINK href="style.css">',
+    '<link rel="preload" as="style" href="sub/theme.css" />', '<link rel=stylesheet>',
+    '<script src="app.js"></script>', "<script defer src='app.js'>\n  </script>",
+    '<script src="missing.js"></script>', '<script src="app.js">console.log(1)</script>',
+    '<script type="module" src="sub/mod.js"></script>', '<script>let a = "<link href=x>";</script>',
+    '<SCRIPT src="app.js"></SCRIPT>', '<scripts src="app.js"></script>',
+    '<div class="box">text</div>\n', '<p>a &lt; b &gt; c</p>\n', 'plain text < with > brackets\n',
+    '<!-- <import src="x"> in a comment -->\n', '<style>body{color:red}</style>\n',
+    '<script>\nfunction plugin(demo) {\n    content(`<b>hi</b>`)\n}\n</script>\n',
+    'é中文 unicode \U0001f600\n', '<', '>', '\n',
+]
+
+ASSETS = {
+    "style.css": "body { margin: 0; }\n/* </style> */\n",
+    "sub/theme.css": ":root { --c: #333; }\n",
+    "favicon.png": "not really a png\n",
+    "app.js": "console.log('app');\nif (a < b && c > d) {}\n",
+    "sub/mod.js": "export default 1;\n",
+}
+
+
+# Ordinary markup, for pages where HTMA constructs are rare
+PLAIN = [
+    '<div class="row"><span>cell</span><span>cell</span></div>\n',
+    '<p>Lorem ipsum dolor sit amet, <em>consectetur</em> adipiscing elit.</p>\n',
+    '<ul><li><a href="#a">one</a></li><li><a href="#b">two</a></li></ul>\n',
+]
+
+
+def make_page(rng, size, plain=0.0):
+    parts = []
+    total = 0
+    while total < size:
+        part = rng.choice(PLAIN if rng.random() < plain else FRAGMENTS)
+        parts.append(part)
+        total += len(part)
+    return "".join(parts)
+
+
+def legacy_compile(content, base_path, deps):
+    return inject_resources(strip_htma_tags(content), base_path, deps)
+
+
+def quiet(func, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args)
+
+
+def check(content, base_path):
+    """Compare both compilers on one page; return the two timings"""
+    legacy_deps, new_deps = [], []
+    start = time.perf_counter()
+    expected = quiet(legacy_compile, content, base_path, legacy_deps)
+    legacy_time = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = quiet(rewrite_htma, content, base_path, new_deps)
+    new_time = time.perf_counter() - start
+    if actual.encode("utf-8") != expected.encode("utf-8"):
+        return None
+    # The old passes list every CSS file before every JS file, the rewriter
+    # lists them in document order; the page cache only needs the same set
+    if sorted(map(str, legacy_deps)) != sorted(map(str, new_deps)):
+        return None
+    return legacy_time, new_time
+
+
+def report(label, legacy_time, new_time):
+    print(f"{label}: legacy {legacy_time * 1000:.1f} ms, one-pass {new_time * 1000:.1f} ms "
+          f"({legacy_time / max(new_time, 1e-9):.2f}x)")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Check the one-pass rewriter against strip_htma_tags + inject_resources")
+    arg_parser.add_argument("files", nargs="*", help="extra .htma files to check")
+    arg_parser.add_argument("--pages", type=int, default=500, help="random pages to generate")
+    arg_parser.add_argument("--seed", type=int, default=1)
+    args = arg_parser.parse_args()
+
+    rng = random.Random(args.seed)
+    failures = 0
+    legacy_total = new_total = 0.0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base_path = Path(tmp)
+        for name, text in ASSETS.items():
+            (base_path / name).parent.mkdir(parents=True, exist_ok=True)
+            (base_path / name).write_text(text, encoding="utf-8")
+
+        cases = [(f"random page {i}", make_page(rng, rng.choice([200, 2000, 20000])), base_path)
+                 for i in range(args.pages)]
+        cases.append(("large page, dense HTMA", make_page(rng, 2 * 1024 * 1024), base_path))
+        cases.append(("large page, sparse HTMA", make_page(rng, 2 * 1024 * 1024, plain=0.99), base_path))
+        for name in args.files:
+            path = Path(name).resolve()
+            cases.append((str(path), path.read_text(encoding="utf-8"), path.parent))
+
+        for label, content, page_base in cases:
+            result = check(content, page_base)
+            if result is None:
+                failures += 1
+                print(f"MISMATCH: {label}")
+                continue
+            if label.startswith("random"):
+                legacy_total += result[0]
+                new_total += result[1]
+            else:
+                report(label, *result)
+
+    if legacy_total and new_total:
+        report(f"{args.pages} random pages", legacy_total, new_total)
+    print(f"{len(cases) - failures}/{len(cases)} pages identical")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,130 +1,430 @@
-import requests
+import concurrent.futures
+import glob
+import hashlib
+import importlib.util
+import json
 import os
+import shutil
 import subprocess
-import urllib3
+import sys
+import tempfile
+import threading
+import urllib.parse
 import zipfile
-import glob
-
-subprocess.run(["python", "CLI_PACK\\register.py"])
 
-subprocess.run(["pip", "install", "gdown"])
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-while True:    
-    print("Type 1 to begin Downloading a plugin and type 2 to begin Uploading a plugin")
-    ud = input()
-    print("you have chosen " + ud + ", to proceed type " + ud + " again, to change your choice please type the other option")
-    ud = input()
-    if ud == "1":
-        print("Please type the name of the plugin you want to download then type the number next to the plugin you want to download")
-        name = input()
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Plugins are extracted next to this one
+PLUGINS_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
+CACHE_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, "..", "..", ".cache", "plugin-manager"))
+
+# Overridable so the manager can be pointed at a mirror or a local test server
+SEARCH_URL = os.environ.get(
+    "HTMA_PLUGIN_SEARCH_URL",
+    "http://api.piscript.org/requests/q7m2v9t4c1x8r5p0lbdwz6yhnfuj3sk8q1m5v9t0r2c7x4p6lbdwz8yhfnu3sj5k1mq7v2t9c4x1r8p5l0bdwz6yhnfu/")
+FETCH_URL = os.environ.get(
+    "HTMA_PLUGIN_FETCH_URL",
+    "https://hapi.piscript.org/requests/f9x2m7q4t1c8r5p0lbdwz6yhnfu3sj9k1v8t4c2x7m5p0rldwz6yhfnu3sj8k1m9q4t2v7c5x0p/")
+# Plugins downloaded and extracted at once
+MAX_DOWNLOADS = int(os.environ.get("HTMA_PLUGIN_DOWNLOADS", "4"))
+
+# Where a Drive file is downloaded from; only its headers are read, to
+# tell whether it changed
+DRIVE_DOWNLOAD_URL = "https://drive.google.com/uc"
+
+REGISTER_SCRIPT = os.path.join("CLI_PACK", "register.py")
+CHUNK_SIZE = 256 * 1024
+TIMEOUT = 5
+
+GREEN = '\033[92m'
+RESET = '\033[0m'
+
+
+def make_session(pool_size=MAX_DOWNLOADS):
+    """One pooled session for every request, so connections are reused"""
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=0.3, status_forcelist=(502, 503, 504), allowed_methods=("GET",))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def is_drive_link(url):
+    return "drive.google.com" in url or "docs.google.com" in url
 
-        GREEN = '\033[92m'
-        RESET = '\033[0m'
 
+def drive_id(url):
+    """The file or folder ID in a Google Drive link, or None"""
+    parsed = urllib.parse.urlparse(url)
+    query = urllib.parse.parse_qs(parsed.query)
+    if query.get("id"):
+        return query["id"][0]
+    parts = parsed.path.split("/")
+    for marker in ("folders", "d"):
+        if marker in parts[:-1]:
+            return parts[parts.index(marker) + 1]
+    return None
+
+
+def ensure_gdown():
+    if importlib.util.find_spec("gdown") is None:
+        subprocess.run([sys.executable, "-m", "pip", "install", "gdown"])
+
+
+class PluginManager:
+    """Downloads and installs plugins, remembering what it installed.
+
+    The local index (index.json in the cache folder) keeps, per plugin ID,
+    its download link, the validators the server sent (ETag and
+    Last-Modified), the SHA-256 of its archives and the folders they
+    extracted to. Archives are stored by SHA-256, so installing a plugin
+    whose archive is unchanged and whose folders are present does nothing,
+    and one whose folders were deleted is extracted again without a
+    download. A download that was cut off resumes with a Range request.
+    Google Drive links are handed to gdown, which is installed on first
+    need. For those the index keeps the ID of every file at the link with
+    the ETag/Last-Modified/size Drive sends for it; while these are the
+    same and the archives are cached, gdown is not run again. A file Drive
+    sends no validators for is downloaded every time.
+    """
+
+    def __init__(self, session=None, plugins_dir=PLUGINS_DIR, cache_dir=CACHE_DIR, max_downloads=MAX_DOWNLOADS):
+        self.session = session or make_session(max_downloads)
+        self.plugins_dir = plugins_dir
+        self.cache_dir = cache_dir
+        self.archive_dir = os.path.join(cache_dir, "archives")
+        self.partial_dir = os.path.join(cache_dir, "partial")
+        self.index_file = os.path.join(cache_dir, "index.json")
+        self.max_downloads = max_downloads
+        self.lock = threading.Lock()
+        os.makedirs(self.archive_dir, exist_ok=True)
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self.index = self.load_index()
+
+    def load_index(self):
         try:
-            resp = requests.get(f"http://api.piscript.org/requests/q7m2v9t4c1x8r5p0lbdwz6yhnfuj3sk8q1m5v9t0r2c7x4p6lbdwz8yhfnu3sj5k1mq7v2t9c4x1r8p5l0bdwz6yhnfu/?query={name}", timeout=5)
-            resp.raise_for_status()
-            results = resp.json()
-        except Exception as e:
-            print("Error fetching search results:", e)
-            results = []
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault("plugins", {})
+        return index
+
+    def save_index(self):
+        with self.lock:
+            tmp_file = f"{self.index_file}.{os.getpid()}"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(self.index, f, indent=2)
+            os.replace(tmp_file, self.index_file)
+
+    def register_once(self):
+        """Run CLI_PACK/register.py the first time the manager starts"""
+        if self.index.get("registered"):
+            return
+        if not os.path.exists(REGISTER_SCRIPT):
+            print(f"Warning: {REGISTER_SCRIPT} not found, skipping registration")
+            return
+        if subprocess.run([sys.executable, REGISTER_SCRIPT]).returncode == 0:
+            self.index["registered"] = True
+            self.save_index()
+
+    def search(self, name):
+        resp = self.session.get(SEARCH_URL, params={"query": name}, timeout=TIMEOUT)
+        resp.raise_for_status()
+        return resp.json()
+
+    def fetch_info(self, plugin_id):
+        resp = self.session.get(FETCH_URL, params={"id": plugin_id}, timeout=TIMEOUT, verify=False)
+        resp.raise_for_status()
+        return resp.json()
+
+    def archive_path(self, digest):
+        return os.path.join(self.archive_dir, f"{digest}.zip")
+
+    def installed(self, entry):
+        """Whether every archive of entry is cached and its folders exist"""
+        return (entry.get("archives")
+                and all(os.path.exists(self.archive_path(digest)) for digest in entry["archives"])
+                and all(os.path.isdir(os.path.join(self.plugins_dir, folder)) for folder in entry.get("folders", [])))
+
+    def install(self, plugin_id):
+        """Fetch, download and extract one plugin; returns a status line"""
+        key = str(plugin_id)
+        try:
+            info = self.fetch_info(plugin_id)
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return f"Plugin with ID {plugin_id} not found."
+            return f"Error fetching plugin {plugin_id}: {e}"
 
-        if not results:
-            print("No plugins found for:", name)
+        name = info["name"]
+        link = info["download_link"]
+        with self.lock:
+            old = dict(self.index["plugins"].get(key, {}))
+        entry = {"name": name, "type": info.get("type"), "download_link": link}
+
+        expected = info.get("sha256")
+        if expected and os.path.exists(self.archive_path(expected)):
+            # The server says which archive it serves, and it is cached
+            archives = [expected]
+            entry.update({k: old[k] for k in ("etag", "last_modified") if k in old})
+        elif is_drive_link(link):
+            drive = self.drive_files(link)
+            if (drive and old.get("download_link") == link and old.get("drive") == drive
+                    and old.get("archives")
+                    and all(os.path.exists(self.archive_path(digest)) for digest in old["archives"])):
+                archives = old["archives"]
+            else:
+                print(f"Downloading {name} (ID: {plugin_id})...")
+                archives = self.download_drive(link, key)
+            if drive:
+                entry["drive"] = drive
         else:
-            print("\nSearch results:")
-            for i, plugin in enumerate(results, 1):
-                display_name = plugin["name"]
-                if plugin["type"] == "official":
-                    display_name = f"\033[92m{display_name}\033[0m"
-                print(f"{i}. {display_name} [ID: {plugin['id']}]")
-
-
-
-        choice = input("\nType the list number OR plugin ID to download (or anything else to cancel): ")
-
-        selected_id = None
-        selected_name = None
-        selected_type = None
-        
-        if choice.isdigit():
-            choice_num = int(choice)
-            
-            if results:
-                for plugin in results:
-                    if plugin['id'] == choice_num:
-                        selected_id = plugin['id']
-                        selected_name = plugin['name']
-                        selected_type = plugin['type']
-                        break
-            
-            if not selected_id:
-                selected_id = choice_num
-        
-        if selected_id:
+            print(f"Downloading {name} (ID: {plugin_id})...")
+            validators = old if old.get("download_link") == link else {}
+            digest, validators = self.download(link, key, validators, expected)
+            entry.update(validators)
+            archives = [digest]
+
+        if old.get("archives") == archives and self.installed(old):
+            entry["folders"] = old["folders"]
+            result = f"{name} (ID: {plugin_id}) is up to date."
+        else:
+            folders = []
+            for digest in archives:
+                folders.extend(self.extract(digest))
+            entry["folders"] = sorted(set(folders))
+            result = f"Installed {name} (ID: {plugin_id}): {', '.join(entry['folders']) or 'no folders'}"
+        entry["archives"] = archives
+        with self.lock:
+            self.index["plugins"][key] = entry
+        self.save_index()
+        return result
+
+    def download(self, url, key, validators, expected=None):
+        """Download url into the archive cache; returns (sha256, validators)
+
+        A cached archive is revalidated with If-None-Match/If-Modified-Since
+        and a partial one in the cache's partial folder is resumed with
+        Range (If-Range makes the server send it whole if it changed).
+        """
+        part_file = os.path.join(self.partial_dir, f"{key}.part")
+        meta_file = f"{part_file}.json"
+        cached = validators.get("archives", [])
+        headers = {}
+        if len(cached) == 1 and os.path.exists(self.archive_path(cached[0])):
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+
+        resume_from = 0
+        if os.path.exists(part_file):
             try:
-                print(f"Fetching download link for plugin ID {selected_id}...")
-                fetch_resp = requests.get(f"https://hapi.piscript.org/requests/f9x2m7q4t1c8r5p0lbdwz6yhnfu3sj9k1v8t4c2x7m5p0rldwz6yhfnu3sj8k1m9q4t2v7c5x0p/?id={selected_id}", timeout=5, verify=False)
-                fetch_resp.raise_for_status()
-                plugin_data = fetch_resp.json()
-                
-                selected_name = plugin_data['name']
-                selected_type = plugin_data['type']
-                download_link = plugin_data['download_link']
-                
-                script_dir = os.path.dirname(os.path.abspath(__file__))
-                download_dir = os.path.join(script_dir, "plugins")
-                extract_dir = os.path.join(script_dir, "..")
-                os.makedirs(download_dir, exist_ok=True)
-        
-                print(f"Downloading {selected_name} (ID: {selected_id})...")
-        
-                subprocess.run([
-                    "gdown",
-                    download_link,
-                    "--folder",
-                    "-O",
-                    download_dir,
-                    "--fuzzy"
-                ])
-                
-                for zip_path in glob.glob(os.path.join(download_dir, "*.zip")):
-                    with zipfile.ZipFile(zip_path, 'r') as archive:
-                        archive.extractall(extract_dir)
-                        print(f"Extracted: {zip_path}")
-                    os.remove(zip_path)
-                    print(f"Deleted: {zip_path}")
-        
-                print("Download complete.")
-            except requests.exceptions.HTTPError as e:
-                if e.response.status_code == 404:
-                    print(f"Plugin with ID {selected_id} not found.")
-                else:
-                    print(f"Error fetching plugin: {e}")
-            except Exception as e:
-                print(f"Error downloading plugin: {e}")
+                with open(meta_file, "r", encoding="utf-8") as f:
+                    part_meta = json.load(f)
+            except (OSError, ValueError):
+                part_meta = {}
+            validator = part_meta.get("etag") or part_meta.get("last_modified")
+            if part_meta.get("url") == url and validator:
+                resume_from = os.path.getsize(part_file)
+                headers["Range"] = f"bytes={resume_from}-"
+                headers["If-Range"] = validator
+
+        with self.session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as resp:
+            if resp.status_code == 304:
+                return cached[0], {"etag": validators.get("etag"), "last_modified": validators.get("last_modified")}
+            if resp.status_code == 416 and resume_from:
+                # The partial file is no use; start over
+                os.remove(part_file)
+                return self.download(url, key, validators, expected)
+            resp.raise_for_status()
+            found = {"etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+            mode = "ab" if resp.status_code == 206 and resume_from else "wb"
+            if mode == "ab":
+                print(f"Resuming download at {resume_from / 1024:.0f} KB")
+            with open(meta_file, "w", encoding="utf-8") as f:
+                json.dump({"url": url, **found}, f)
+            with open(part_file, mode) as f:
+                for chunk in resp.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+
+        digest = file_sha256(part_file)
+        os.remove(meta_file)
+        if expected and digest != expected:
+            os.remove(part_file)
+            raise ValueError(f"Archive checksum mismatch for {url}")
+        os.replace(part_file, self.archive_path(digest))
+        return digest, found
+
+    def drive_files(self, link):
+        """{file ID: validators} for the files at a Google Drive link, without
+        downloading them; None if they cannot be listed or Drive sends
+        nothing that would show a file changed"""
+        if "/folders/" in link:
+            ensure_gdown()
+            try:
+                import gdown
+                files = gdown.download_folder(url=link, skip_download=True, quiet=True)
+            except Exception:
+                # Older gdown cannot list a folder without downloading it
+                return None
+            file_ids = [f.id for f in files or [] if f.path.lower().endswith(".zip")]
         else:
-            print("Cancelled.")
+            file_ids = [drive_id(link)]
+        if not all(file_ids):
+            return None
+        found = {}
+        try:
+            for file_id in file_ids:
+                with self.session.get(DRIVE_DOWNLOAD_URL, params={"export": "download", "id": file_id},
+                                      stream=True, timeout=TIMEOUT) as resp:
+                    resp.raise_for_status()
+                    if resp.headers.get("Content-Type", "").startswith("text/html"):
+                        # Drive's large-file warning page, not the file
+                        return None
+                    validators = {"etag": resp.headers.get("ETag"),
+                                  "last_modified": resp.headers.get("Last-Modified"),
+                                  "size": resp.headers.get("Content-Length")}
+                    if not any(validators.values()):
+                        # Nothing to tell a re-uploaded file from the old one
+                        return None
+                    found[file_id] = validators
+        except requests.exceptions.RequestException:
+            return None
+        return found or None
 
+    def download_drive(self, link, key):
+        """Download a Google Drive folder with gdown; returns the sha256 of each zip in it"""
+        ensure_gdown()
+        download_dir = tempfile.mkdtemp(prefix=f"{key}-", dir=self.partial_dir)
+        try:
+            subprocess.run([sys.executable, "-m", "gdown", link, "--folder", "-O", download_dir, "--fuzzy"])
+            archives = []
+            for zip_path in sorted(glob.glob(os.path.join(download_dir, "**", "*.zip"), recursive=True)):
+                digest = file_sha256(zip_path)
+                os.replace(zip_path, self.archive_path(digest))
+                archives.append(digest)
+        finally:
+            shutil.rmtree(download_dir, ignore_errors=True)
+        if not archives:
+            raise ValueError(f"No zip files found at {link}")
+        return archives
 
+    def extract(self, digest):
+        """Extract a cached archive into the plugins folder; returns its top-level folders"""
+        with zipfile.ZipFile(self.archive_path(digest), "r") as archive:
+            archive.extractall(self.plugins_dir)
+            names = archive.namelist()
+        print(f"Extracted: {digest[:12]}.zip")
+        return {name.split("/")[0] for name in names if "/" in name}
 
+    def install_many(self, plugin_ids):
+        """Install several plugins at once, max_downloads at a time"""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_downloads) as pool:
+            futures = {pool.submit(self.install, plugin_id): plugin_id for plugin_id in plugin_ids}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    print(future.result())
+                except Exception as e:
+                    print(f"Error downloading plugin {futures[future]}: {e}")
 
-        
-    else:
-        if ud == "2":
-            print("Please type the full path of the plugin you want to upload")
-            fullpath = input()
-            print("'" + fullpath + "'")
-            print("Is that correct? If yes type 1. If else type anything other than '1'")
-            uconfirmation = input()
-            if uconfirmation == "1":
-                print("temp")
-                # upload logic
-            else:
-                print("Please type the full path of the plugin you want to upload")
-                fullpath = input()
-                # upload logic
+
+def pick_ids(choice, results):
+    """Plugin IDs for a choice of list numbers and/or IDs, separated by commas or spaces"""
+    ids = []
+    known = {plugin["id"] for plugin in results}
+    for item in choice.replace(",", " ").split():
+        if not item.isdigit():
+            return []
+        number = int(item)
+        if number in known:
+            ids.append(number)
+        elif 1 <= number <= len(results):
+            ids.append(results[number - 1]["id"])
         else:
-           continue
+            ids.append(number)
+    return list(dict.fromkeys(ids))
+
+
+def download_prompt(manager):
+    print("Please type the name of the plugin you want to download then type the number next to the plugin you want to download")
+    name = input()
+
+    try:
+        results = manager.search(name)
+    except Exception as e:
+        print("Error fetching search results:", e)
+        results = []
+
+    if not results:
+        print("No plugins found for:", name)
+    else:
+        print("\nSearch results:")
+        for i, plugin in enumerate(results, 1):
+            display_name = plugin["name"]
+            if plugin["type"] == "official":
+                display_name = f"{GREEN}{display_name}{RESET}"
+            print(f"{i}. {display_name} [ID: {plugin['id']}]")
+
+    choice = input("\nType the list numbers OR plugin IDs to download, separated by commas (or anything else to cancel): ")
+    ids = pick_ids(choice, results)
+    if ids:
+        manager.install_many(ids)
+        print("Download complete.")
+    else:
+        print("Cancelled.")
+
+
+def upload_prompt():
+    print("Please type the full path of the plugin you want to upload")
+    fullpath = input()
+    print("'" + fullpath + "'")
+    print("Is that correct? If yes type 1. If else type anything other than '1'")
+    uconfirmation = input()
+    if uconfirmation == "1":
+        print("temp")
+        # upload logic
+    else:
+        print("Please type the full path of the plugin you want to upload")
+        fullpath = input()
+        # upload logic
+
+
+def main():
+    manager = PluginManager()
+    manager.register_once()
+
+    # python plugin.py install ID [ID ...] installs without prompting
+    if len(sys.argv) > 2 and sys.argv[1] == "install":
+        manager.install_many(pick_ids(" ".join(sys.argv[2:]), []))
+        return
+
+    while True:
+        print("Type 1 to begin Downloading a plugin and type 2 to begin Uploading a plugin")
+        ud = input()
+        print("you have chosen " + ud + ", to proceed type " + ud + " again, to change your choice please type the other option")
+        ud = input()
+        if ud == "1":
+            download_prompt(manager)
+        elif ud == "2":
+            upload_prompt()
+
+
+if __name__ == "__main__":
+    main()